@@ -0,0 +1,66 @@
+# Checks that the NumPy colouring path in src/process_colours.py produces the
+# same colours as assign_colours_to_patients on a synthetic cohort, and times
+# the two against each other.
+#
+#     python benchmarks/bench_colours.py --patients 20000 --visits 10
+
+import argparse
+import copy
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import process_colours
+from synthetic import write_random_lookup
+
+
+def main(n_patients: int, n_visits: int, repeats: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lookup_file = Path(tmp_dir) / "lookup.csv"
+        write_random_lookup(lookup_file, n_patients, n_visits)
+        patients_dict = process_colours.lookup_to_dict(lookup_file)
+
+    n_total = sum(len(visits) for visits in patients_dict.values())
+    print(f"{n_patients} patients, {n_total} visits")
+
+    for name, function in (
+        ("assign_colours_to_patients", process_colours.assign_colours_to_patients),
+        ("assign_colours_to_patients_vectorized", process_colours.assign_colours_to_patients_vectorized),
+    ):
+        timings = []
+
+        for _ in range(repeats):
+            patients_copy = copy.deepcopy(patients_dict)
+            start = time.perf_counter()
+            function(patients_copy)
+            timings.append(time.perf_counter() - start)
+
+        print(f"{name:<40} {min(timings):>8.3f} s")
+
+    expected = process_colours.assign_colours_to_patients(copy.deepcopy(patients_dict))
+    actual = process_colours.assign_colours_to_patients_vectorized(copy.deepcopy(patients_dict))
+
+    if expected != actual:
+        print("The vectorized colours differ from assign_colours_to_patients")
+        sys.exit(1)
+
+    print("The colours of both paths match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the NumPy colouring path against assign_colours_to_patients"
+    )
+    parser.add_argument("-p", "--patients", type=int, default=20000,
+                        help="Number of patients in the synthetic cohort")
+    parser.add_argument("-v", "--visits", type=int, default=10,
+                        help="Number of visits per patient")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of timed runs, the fastest is reported")
+
+    args = parser.parse_args()
+
+    main(args.patients, args.visits, args.repeats)
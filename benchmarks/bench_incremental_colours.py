@@ -0,0 +1,114 @@
+# Recompiles the lookup store after a batch of new visits is appended to the
+# lookup CSV, recolouring the whole cohort against keeping the colours already
+# in the store (compile-lookup --incremental-colours), and reports how long
+# each took and how many CAPs, i.e. trees to re-render, changed colour. Checks
+# that:
+#     - a fresh compile has the same colours as assign_colours_to_patients
+#     - an incremental compile only reports, and only changes, the CAPs that
+#       had visits appended
+#
+#     python benchmarks/bench_incremental_colours.py --patients 10000 --new-visits 50
+
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import lookup_store
+import process_colours
+from synthetic import make_cohort_visits, write_lookup
+
+
+def append_visits(cohort: dict, n_new_visits: int, seed: int) -> list:
+    # Give some patients one more visit, at a week none of their visits are at
+    rng = random.Random(seed)
+    updated_caps = rng.sample(sorted(cohort), n_new_visits)
+
+    for cap_id in updated_caps:
+        visits = cohort[cap_id]
+        art_week = visits[0][1] + visits[0][2]
+        taken_weeks = {wpi for _, wpi, _ in visits}
+        week = rng.choice([week for week in range(1, art_week) if week not in taken_weeks])
+        visit_code = max(code for code, _, _ in visits) + 10
+
+        visits.append((visit_code, week, art_week - week))
+
+    return sorted(updated_caps)
+
+
+def read_store(store_file: Path) -> dict:
+    store = lookup_store.LookupStore(store_file)
+    patients_dict = dict(store)
+    store.close()
+
+    return patients_dict
+
+
+def main(args):
+    cohort = make_cohort_visits(args.patients, args.visits, args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lookup_file = Path(tmp_dir) / "lookup.csv"
+        store_file = Path(tmp_dir) / "lookup.sqlite"
+        write_lookup(lookup_file, cohort)
+
+        lookup_store.compile_store(lookup_file, store_file)
+        expected = process_colours.assign_colours_to_patients(
+            process_colours.lookup_to_dict(lookup_file)
+        )
+
+        if read_store(store_file) != expected:
+            print("A fresh compile differs from assign_colours_to_patients")
+            sys.exit(1)
+
+        previous = read_store(store_file)
+        updated_caps = append_visits(cohort, args.new_visits, args.seed)
+        write_lookup(lookup_file, cohort)
+
+        full_store_file = Path(tmp_dir) / "full.sqlite"
+        shutil.copy(store_file, full_store_file)
+
+        start = time.perf_counter()
+        recoloured_caps = lookup_store.compile_store(lookup_file, full_store_file)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        changed_caps = lookup_store.compile_store(lookup_file, store_file, incremental=True)
+        incremental_time = time.perf_counter() - start
+
+        current = read_store(store_file)
+
+    if sorted(changed_caps) != updated_caps:
+        print(f"Expected {len(updated_caps)} changed CAPs, got {len(changed_caps)}")
+        sys.exit(1)
+
+    for cap_id, visits in previous.items():
+        for code, visit in visits.items():
+            if current[cap_id][code]["colour"] != visit["colour"]:
+                print(f"The colour of {cap_id} visit {code} changed")
+                sys.exit(1)
+
+    print(f"{'':>12} {'compile s':>10} {'changed CAPs':>13}")
+    print(f"{'full':>12} {full_time:>10.3f} {len(recoloured_caps):>13}")
+    print(f"{'incremental':>12} {incremental_time:>10.3f} {len(changed_caps):>13}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time incremental colouring of a growing lookup table"
+    )
+    parser.add_argument("-p", "--patients", type=int, default=10000,
+                        help="Number of patients in the synthetic cohort")
+    parser.add_argument("-v", "--visits", type=int, default=10,
+                        help="Number of visits per patient")
+    parser.add_argument("-n", "--new-visits", type=int, default=50,
+                        help="Number of patients that get a new visit")
+    parser.add_argument("-s", "--seed", type=int, default=336,
+                        help="Seed of the synthetic cohort")
+
+    main(parser.parse_args())
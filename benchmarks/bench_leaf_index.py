@@ -0,0 +1,88 @@
+# Compares joining a tree's leaves against a patient's visits by splitting
+# every label in a list-membership loop, as optimise_patient_dict and
+# extract_wpis_from_sample_names used to, against the columnar LeafIndex in
+# src/leaf_index.py, and checks that both keep the same visits.
+#
+#     python benchmarks/bench_leaf_index.py --leaves 10000 100000 --visits 200
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import newick
+from leaf_index import LeafIndex
+from synthetic import make_cohort_visits, write_patient_tree
+
+
+def loop_visits_in_tree(patient_visits: dict, leaf_names: list) -> dict:
+    wpis_in_tree = []
+
+    for leaf_name in leaf_names:
+        leaf_wpi = int(leaf_name.split("_")[2].replace("WPI", ""))
+
+        if leaf_wpi and (leaf_wpi not in wpis_in_tree) and (leaf_wpi != 0):
+            wpis_in_tree.append(leaf_wpi)
+
+    return {
+        visit_id: visit
+        for visit_id, visit in patient_visits.items()
+        if visit["WPI"] in wpis_in_tree
+    }
+
+
+def index_visits_in_tree(patient_visits: dict, leaf_names: list) -> dict:
+    return LeafIndex(leaf_names).visits_in_tree(patient_visits)
+
+
+def main(leaf_counts: list, n_visits: int, repeats: int):
+    print(f"{'leaves':>8} {'visits':>7} {'loop s':>9} {'index s':>9}")
+
+    cohort = make_cohort_visits(1, n_visits)
+    cap_id, visits = next(iter(cohort.items()))
+    patient_visits = {
+        visit_code: {"WPI": wpi, "colour": (255, 0, 0)} for visit_code, wpi, _ in visits
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_leaves in leaf_counts:
+            tree_file = Path(tmp_dir) / f"{cap_id}_NEF.nwk"
+            write_patient_tree(tree_file, cap_id, [wpi for _, wpi, _ in visits], n_leaves)
+            leaf_names = list(newick.iter_leaf_names(tree_file))
+            results = {}
+            timings = {}
+
+            for name, function in (("loop", loop_visits_in_tree), ("index", index_visits_in_tree)):
+                runs = []
+
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    results[name] = function(patient_visits, leaf_names)
+                    runs.append(time.perf_counter() - start)
+
+                timings[name] = min(runs)
+
+            if results["loop"] != results["index"]:
+                print(f"{n_leaves} leaves: the index and the loop keep different visits")
+                sys.exit(1)
+
+            print(f"{n_leaves:>8} {len(visits):>7} {timings['loop']:>9.3f} {timings['index']:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the columnar leaf index against splitting labels in a loop"
+    )
+    parser.add_argument("-l", "--leaves", type=int, nargs="*", default=[10000, 100000],
+                        help="Sizes of synthetic trees to benchmark")
+    parser.add_argument("-v", "--visits", type=int, default=200,
+                        help="Number of visits of the synthetic patient")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of timed runs, the fastest is reported")
+
+    args = parser.parse_args()
+
+    main(args.leaves, args.visits, args.repeats)
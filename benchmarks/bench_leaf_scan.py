@@ -0,0 +1,86 @@
+# Compares reading the leaf names of a Newick file with ete3 against the
+# streaming scanner in src/newick.py.
+#
+# Run it against real trees:
+#     python benchmarks/bench_leaf_scan.py --intree CAP336_NEF.nwk
+# or against a synthetic tree of a given size:
+#     python benchmarks/bench_leaf_scan.py --leaves 50000
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import newick
+from ete3 import Tree
+from synthetic import write_random_tree
+
+
+def ete3_leaf_names(tree_file: Path) -> list:
+    tree_obj = Tree(str(tree_file))
+
+    return [leaf.name for leaf in tree_obj.get_tree_root().get_leaves()]
+
+
+def scanner_leaf_names(tree_file: Path) -> list:
+    return list(newick.iter_leaf_names(tree_file))
+
+
+def measure(function, tree_file: Path, repeats: int) -> tuple:
+    timings = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        leaf_names = function(tree_file)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(tree_file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return leaf_names, min(timings), peak
+
+
+def main(tree_files: list, repeats: int):
+    print(f"{'tree':<40} {'leaves':>8} {'ete3 s':>9} {'scan s':>9} {'ete3 MiB':>9} {'scan MiB':>9}")
+
+    for tree_file in tree_files:
+        ete3_names, ete3_time, ete3_peak = measure(ete3_leaf_names, tree_file, repeats)
+        scan_names, scan_time, scan_peak = measure(scanner_leaf_names, tree_file, repeats)
+
+        if ete3_names != scan_names:
+            print(f"{tree_file.name}: the scanner and ete3 disagree on the leaf names")
+            sys.exit(1)
+
+        print(
+            f"{tree_file.name:<40} {len(scan_names):>8} {ete3_time:>9.3f} {scan_time:>9.3f} "
+            f"{ete3_peak / 2**20:>9.1f} {scan_peak / 2**20:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the streaming leaf-name scanner against ete3"
+    )
+    parser.add_argument("-i", "--intree", type=str, nargs="*", default=[],
+                        help="Newick tree files to benchmark")
+    parser.add_argument("-l", "--leaves", type=int, nargs="*", default=[],
+                        help="Sizes of synthetic trees to benchmark")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of timed runs per tree, the fastest is reported")
+
+    args = parser.parse_args()
+    tree_paths = [Path(intree) for intree in args.intree]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_leaves in args.leaves or ([] if tree_paths else [1000, 10000, 50000]):
+            tree_path = Path(tmp_dir) / f"synthetic_{n_leaves}.nwk"
+            write_random_tree(tree_path, n_leaves)
+            tree_paths.append(tree_path)
+
+        main(tree_paths, args.repeats)
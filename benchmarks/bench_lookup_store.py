@@ -0,0 +1,70 @@
+# Times what a single-tree job pays to get its patient's visits: parsing and
+# colouring the whole lookup CSV, against fetching one CAP from the SQLite
+# store in src/lookup_store.py, for growing cohorts. Every CAP fetched from
+# the store is checked against the CSV path.
+#
+#     python benchmarks/bench_lookup_store.py --patients 1000 10000 50000
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import lookup_store
+import process_colours
+from synthetic import write_random_lookup
+
+
+def build_patients_dict(lookup_fp: Path) -> dict:
+    patients_dict = process_colours.lookup_to_dict(lookup_fp)
+
+    return process_colours.assign_colours_to_patients_vectorized(patients_dict)
+
+
+def main(cohort_sizes: list, n_visits: int):
+    print(f"{'patients':>9} {'csv s':>9} {'compile s':>10} {'store s':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_patients in cohort_sizes:
+            lookup_file = Path(tmp_dir) / f"lookup_{n_patients}.csv"
+            store_file = Path(tmp_dir) / f"lookup_{n_patients}.sqlite"
+            write_random_lookup(lookup_file, n_patients, n_visits)
+            cap_id = f"CAP{n_patients // 2}"
+
+            start = time.perf_counter()
+            patients_dict = build_patients_dict(lookup_file)
+            csv_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            lookup_store.compile_store(lookup_file, store_file)
+            compile_time = time.perf_counter() - start
+
+            # What a job does: check the store is current, open it, fetch a CAP
+            start = time.perf_counter()
+            store = lookup_store.open_store(lookup_file, store_file)
+            store[cap_id]
+            store_time = time.perf_counter() - start
+
+            if dict(store) != patients_dict:
+                print(f"{n_patients} patients: the store differs from the CSV")
+                sys.exit(1)
+
+            store.close()
+            print(f"{n_patients:>9} {csv_time:>9.3f} {compile_time:>10.3f} {store_time:>9.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare loading one CAP from the lookup CSV and from the SQLite store"
+    )
+    parser.add_argument("-p", "--patients", type=int, nargs="*", default=[1000, 10000, 50000],
+                        help="Cohort sizes to benchmark")
+    parser.add_argument("-v", "--visits", type=int, default=10,
+                        help="Number of visits per patient")
+
+    args = parser.parse_args()
+
+    main(args.patients, args.visits)
@@ -0,0 +1,87 @@
+# Times the native matplotlib renderer in src/render.py against rendering the
+# same trees with Dendroscope.
+#
+#     python benchmarks/bench_render.py --leaves 100 1000 5000
+#     python benchmarks/bench_render.py --leaves 1000 --dendroscope ~/dendroscope/Dendroscope
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import dendro_interface
+import render
+from synthetic import write_random_tree
+from bench_styles import make_patient_visits
+
+
+def time_native(tree_file: Path, patient_visits: dict, tmp_dir: Path) -> float:
+    start = time.perf_counter()
+    render.render_tree(
+        tree_file, patient_visits, tmp_dir / "native.png", tmp_dir / "native.linear.png"
+    )
+    return time.perf_counter() - start
+
+
+def time_dendroscope(dendroscope: str, tree_file: Path, patient_visits: dict, tmp_dir: Path) -> float:
+    command_file = tmp_dir / "render.dendrocmd.txt"
+
+    with open(command_file, "w") as command_fh:
+        command_fh.write(
+            dendro_interface.build_dendro_command(
+                tree_file,
+                patient_visits,
+                tmp_dir / "dendro.png",
+                tmp_dir / "dendro.linear.png",
+                tmp_dir / "dendro.nexus",
+            )
+        )
+
+    start = time.perf_counter()
+    subprocess.run(
+        [dendroscope, "-g", "--commandFile", str(command_file)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main(leaf_counts: list, n_visits: int, dendroscope: str | None):
+    print(f"{'leaves':>8} {'native s':>9} {'dendro s':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        patient_visits = make_patient_visits(n_visits)
+
+        for n_leaves in leaf_counts:
+            tree_file = tmp_path / f"synthetic_{n_leaves}.nwk"
+            write_random_tree(tree_file, n_leaves)
+
+            native_time = time_native(tree_file, patient_visits, tmp_path)
+            dendro_time = (
+                f"{time_dendroscope(dendroscope, tree_file, patient_visits, tmp_path):>9.2f}"
+                if dendroscope
+                else f"{'-':>9}"
+            )
+
+            print(f"{n_leaves:>8} {native_time:>9.2f} {dendro_time}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the native renderer against Dendroscope"
+    )
+    parser.add_argument("-l", "--leaves", type=int, nargs="*", default=[100, 1000, 5000],
+                        help="Sizes of synthetic trees to benchmark")
+    parser.add_argument("-v", "--visits", type=int, default=12,
+                        help="Number of visits of the synthetic patient")
+    parser.add_argument("-d", "--dendroscope", type=str, default=None,
+                        help="Dendroscope binary to compare against")
+
+    args = parser.parse_args()
+
+    main(args.leaves, args.visits, args.dendroscope)
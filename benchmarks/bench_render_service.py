@@ -0,0 +1,143 @@
+# Load tests `main.py serve` on a synthetic cohort. Starts the service with
+# fake_dendroscope.py, posts every tree from several client threads, half of
+# them by path and half as Newick text, waits for each job and reports how
+# many trees a minute the service got through. Checks every job finished with
+# its outputs written.
+#
+# main.py refuses to run outside a virtual environment, so neither does this:
+#     venv/bin/python benchmarks/bench_render_service.py --patients 100 --clients 8
+#     venv/bin/python benchmarks/bench_render_service.py --servers 4 --workers 4
+
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from synthetic import write_cohort
+
+SRC_DIRECTORY = Path(__file__).resolve().parent.parent / "src"
+FAKE_DENDROSCOPE = Path(__file__).resolve().parent / "fake_dendroscope.py"
+
+
+def get_free_port() -> int:
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+def request(url: str, body=None) -> dict:
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=600) as response:
+        return json.loads(response.read())
+
+
+def wait_until_up(url: str, service: subprocess.Popen):
+    while service.poll() is None:
+        try:
+            return request(f"{url}/status")
+        except OSError:
+            time.sleep(0.1)
+
+    print("The service exited before it started answering")
+    sys.exit(1)
+
+
+def render(url: str, tree_file: Path, upload: bool) -> dict:
+    if upload:
+        body = {"name": tree_file.name, "newick": tree_file.read_text()}
+    else:
+        body = {"tree_file": str(tree_file)}
+
+    job = request(f"{url}/jobs", body)
+
+    while job["status"] not in ("done", "failed"):
+        job = request(f"{url}/jobs/{job['id']}?wait=60")
+
+    return job
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        lookup_file, tree_directory = write_cohort(
+            tmp_path / "cohort", args.patients, args.visits, args.leaves, tuple(args.genes)
+        )
+        tree_files = sorted(tree_directory.glob("*.nwk"))
+        port = get_free_port()
+        url = f"http://127.0.0.1:{port}"
+
+        service = subprocess.Popen(
+            [
+                sys.executable, "main.py", "serve",
+                "--lookup-file", str(lookup_file),
+                "--output-directory", str(tmp_path / "output"),
+                "--dendroscope-bin", str(FAKE_DENDROSCOPE),
+                "--port", str(port),
+                "--workers", str(args.workers),
+                "--servers", str(args.servers),
+            ],
+            cwd=SRC_DIRECTORY,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        try:
+            wait_until_up(url, service)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.clients) as clients:
+                jobs = list(
+                    clients.map(
+                        lambda tree: render(url, tree[1], tree[0] % 2 == 1),
+                        enumerate(tree_files),
+                    )
+                )
+            elapsed = time.perf_counter() - start
+            status = request(f"{url}/status")
+        finally:
+            service.terminate()
+            service.wait()
+
+        failed = [job for job in jobs if job["status"] != "done"]
+        missing = [
+            output_file
+            for job in jobs
+            for output_file in job.get("outputs", [])
+            if not Path(output_file).exists()
+        ]
+
+    print(f"{'trees':>6} {'clients':>8} {'seconds':>8} {'trees/min':>10}")
+    print(f"{len(jobs):>6} {args.clients:>8} {elapsed:>8.2f} {len(jobs) / elapsed * 60:>10.0f}")
+    print(f"Service status at the end: {status}")
+
+    if failed or missing:
+        print(f"{len(failed)} jobs failed and {len(missing)} outputs are missing")
+        for job in failed[:5]:
+            print(job)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the render service")
+    parser.add_argument("-p", "--patients", type=int, default=100,
+                        help="Number of patients in the synthetic cohort")
+    parser.add_argument("-v", "--visits", type=int, default=10,
+                        help="Number of visits per patient")
+    parser.add_argument("-l", "--leaves", type=int, default=200,
+                        help="Number of NGS leaves per tree")
+    parser.add_argument("-g", "--genes", nargs="+", default=["NEF", "ENV"],
+                        help="Genes to write a tree for, per patient")
+    parser.add_argument("-c", "--clients", type=int, default=8,
+                        help="Number of client threads posting trees")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Number of workers of the service")
+    parser.add_argument("-s", "--servers", type=int, default=0,
+                        help="Number of long-lived Dendroscope processes of the service")
+
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+# Times whole process-dir runs over a synthetic cohort with fake_dendroscope.py
+# standing in for Dendroscope, to compare the ways trees can be scheduled:
+# one process per tree, batches, asyncio and long-lived servers, each at a
+# few worker counts.
+#
+# The fake's latency is set to something like the real thing's, so the
+# comparison is about hiding JVM start up and waiting, not about Python:
+#     venv/bin/python benchmarks/bench_scheduling.py --patients 40 --workers 1 4
+#     venv/bin/python benchmarks/bench_scheduling.py --startup-seconds 3 --node-seconds 0.0001
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic import write_cohort
+
+MAIN_SCRIPT = Path(__file__).resolve().parent.parent / "src" / "main.py"
+FAKE_DENDROSCOPE = Path(__file__).resolve().parent / "fake_dendroscope.py"
+
+MODES = {
+    "per tree": [],
+    "batches of 8": ["--batch-size", "8"],
+    "asyncio": ["--use-asyncio"],
+    "servers": ["--servers", "{workers}"],
+}
+
+
+def run_mode(
+    mode_args: list,
+    workers: int,
+    lookup_file: Path,
+    tree_directory: Path,
+    output_directory: Path,
+    env: dict,
+) -> tuple:
+    shutil.rmtree(output_directory, ignore_errors=True)
+    command = [
+        sys.executable,
+        str(MAIN_SCRIPT),
+        "process-dir",
+        "--tree-directory", str(tree_directory),
+        "--lookup-file", str(lookup_file),
+        "--output-directory", str(output_directory),
+        "--dendroscope-bin", str(FAKE_DENDROSCOPE),
+        "--workers", str(workers),
+    ] + [arg.format(workers=workers) for arg in mode_args]
+
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, result.returncode == 0 and "All trees were rendered" in result.stderr
+
+
+def main(args):
+    env = dict(
+        os.environ,
+        FAKE_DENDROSCOPE_STARTUP_SECONDS=str(args.startup_seconds),
+        FAKE_DENDROSCOPE_NODE_SECONDS=str(args.node_seconds),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        lookup_file, tree_directory = write_cohort(
+            tmp_path / "cohort", args.patients, args.visits, args.leaves
+        )
+
+        print(f"{'mode':<16} {'workers':>8} {'wall s':>9} {'trees/s':>9}")
+
+        for mode, mode_args in MODES.items():
+            for workers in args.workers:
+                elapsed, succeeded = run_mode(
+                    mode_args, workers, lookup_file, tree_directory, tmp_path / "output", env
+                )
+                status = "" if succeeded else "  (failed)"
+                print(
+                    f"{mode:<16} {workers:>8} {elapsed:>9.2f} {args.patients / elapsed:>9.2f}{status}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the scheduling modes of process-dir against a fake Dendroscope"
+    )
+    parser.add_argument("-p", "--patients", type=int, default=24,
+                        help="Number of patients, with one tree each")
+    parser.add_argument("-v", "--visits", type=int, default=10,
+                        help="Number of visits per patient")
+    parser.add_argument("-l", "--leaves", type=int, default=500,
+                        help="Number of NGS leaves per tree")
+    parser.add_argument("-w", "--workers", type=int, nargs="*", default=[1, 4],
+                        help="Worker counts to try each mode with")
+    parser.add_argument("--startup-seconds", type=float, default=1.0,
+                        help="Simulated Dendroscope start up time")
+    parser.add_argument("--node-seconds", type=float, default=0.00005,
+                        help="Simulated time per node for each search and export")
+
+    main(parser.parse_args())
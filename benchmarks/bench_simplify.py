@@ -0,0 +1,65 @@
+# Times the simplification pass in src/simplify.py on synthetic NGS trees of
+# growing size, and reports how many leaves are left for Dendroscope to draw
+# with each setting. Every reduced tree is parsed back to check it is valid
+# Newick with the leaves simplify_tree says it has.
+#
+#     python benchmarks/bench_simplify.py --leaves 10000 50000 --min-count 50
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import simplify
+import tree as compact_tree
+from synthetic import write_patient_tree
+
+
+def main(args):
+    settings = {
+        "collapse": simplify.SimplifyOptions(collapse_same_wpi=True),
+        "thresholds": simplify.SimplifyOptions(
+            min_count=args.min_count, min_frequency=args.min_frequency
+        ),
+        "both": simplify.SimplifyOptions(True, args.min_count, args.min_frequency),
+    }
+
+    print(f"{'leaves':>8} {'setting':>11} {'simplify s':>11} {'leaves left':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_leaves in args.leaves:
+            tree_file = Path(tmp_dir) / f"CAP1_NEF_{n_leaves}.nwk"
+            reduced_file = Path(tmp_dir) / "reduced.nwk"
+            write_patient_tree(tree_file, "CAP1", args.wpis, n_leaves)
+
+            for name, options in settings.items():
+                start = time.perf_counter()
+                newick_text, leaf_names, _ = simplify.simplify_tree(tree_file, options)
+                simplify_time = time.perf_counter() - start
+
+                reduced_file.write_text(newick_text)
+
+                if compact_tree.Tree.from_newick(reduced_file).leaf_names() != leaf_names:
+                    print(f"{n_leaves} leaves, {name}: the reduced tree has different leaves")
+                    sys.exit(1)
+
+                print(f"{n_leaves:>8} {name:>11} {simplify_time:>11.3f} {len(leaf_names):>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the tree simplification pass on synthetic trees"
+    )
+    parser.add_argument("-l", "--leaves", type=int, nargs="+", default=[10000, 50000],
+                        help="Numbers of NGS leaves to try")
+    parser.add_argument("-w", "--wpis", type=int, nargs="+", default=[30, 80, 150],
+                        help="WPIs the haplotypes are spread over")
+    parser.add_argument("-c", "--min-count", type=int, default=50,
+                        help="Read count threshold of the threshold settings")
+    parser.add_argument("-f", "--min-frequency", type=float, default=0.0,
+                        help="Frequency threshold of the threshold settings")
+
+    main(parser.parse_args())
@@ -0,0 +1,102 @@
+# Times working out the visits and the Dendroscope command of every tree in a
+# synthetic cohort with several genes per patient, from scratch against with a
+# StyleMemo shared by the trees of each CAP. Each tree is gone through twice,
+# as process-dir does: once to fingerprint it for the manifest and once to
+# render it. Checks that both give the same command for every tree.
+#
+#     python benchmarks/bench_style_memo.py --patients 200 --genes NEF ENV GAG POL
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import dendro_interface
+import process_colours
+from leaf_index import LeafIndex
+from synthetic import write_cohort
+
+PASSES = 2
+
+
+def build_command(tree_file: Path, visits: dict, leaf_index: LeafIndex, styling_command=None):
+    return dendro_interface.build_dendro_command(
+        tree_file,
+        visits,
+        Path(f"{tree_file.stem}.dendrotree.png"),
+        Path(f"{tree_file.stem}.linear.dendrotree.png"),
+        Path(f"{tree_file.stem}.dendro_nexus.nexus"),
+        leaf_index=leaf_index,
+        styling_command=styling_command,
+    )
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lookup_file, tree_directory = write_cohort(
+            Path(tmp_dir), args.patients, args.visits, args.leaves, tuple(args.genes), args.seed
+        )
+        patients_dict = process_colours.assign_colours_to_patients_vectorized(
+            process_colours.lookup_to_dict(lookup_file)
+        )
+        trees = [
+            (tree_file, tree_file.stem.split("_")[0], LeafIndex.from_newick(tree_file))
+            for tree_file in sorted(tree_directory.glob("*.nwk"))
+        ]
+
+    start = time.perf_counter()
+    for _ in range(PASSES):
+        expected = [
+            build_command(
+                tree_file,
+                leaf_index.visits_in_tree(patients_dict[cap_id]),
+                leaf_index,
+            )
+            for tree_file, cap_id, leaf_index in trees
+        ]
+    scratch_time = time.perf_counter() - start
+
+    memo = dendro_interface.StyleMemo()
+    start = time.perf_counter()
+    for _ in range(PASSES):
+        memoised = []
+
+        for tree_file, cap_id, leaf_index in trees:
+            visits = memo.visits_in_tree(cap_id, patients_dict[cap_id], leaf_index)
+            memoised.append(
+                build_command(
+                    tree_file,
+                    visits,
+                    leaf_index,
+                    memo.styling_command(cap_id, visits, leaf_index),
+                )
+            )
+    memo_time = time.perf_counter() - start
+
+    if memoised != expected:
+        print("The memoised commands differ from the ones built from scratch")
+        sys.exit(1)
+
+    print(f"{'trees':>6} {'scratch s':>10} {'memo s':>8}")
+    print(f"{len(trees):>6} {scratch_time:>10.3f} {memo_time:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time building tree commands with and without the per-CAP style memo"
+    )
+    parser.add_argument("-p", "--patients", type=int, default=200,
+                        help="Number of patients in the synthetic cohort")
+    parser.add_argument("-v", "--visits", type=int, default=12,
+                        help="Number of visits per patient")
+    parser.add_argument("-l", "--leaves", type=int, default=200,
+                        help="Number of NGS leaves per tree")
+    parser.add_argument("-g", "--genes", nargs="+", default=["NEF", "ENV", "GAG", "POL"],
+                        help="Genes to write a tree for, per patient")
+    parser.add_argument("-s", "--seed", type=int, default=336,
+                        help="Seed of the synthetic cohort")
+
+    main(parser.parse_args())
@@ -0,0 +1,116 @@
+# Compares the Dendroscope styling strategies on synthetic trees: one regex
+# search per visit (create_wpi_group_styles), one wholewords search per leaf
+# (as dendro_call_for_nih_cure.py does), and the compiled styles that
+# compile_styles picks.
+#
+# Each `find` makes Dendroscope scan every node, so the number of passes times
+# the number of nodes is reported as the amount of search work. Given a
+# Dendroscope binary, each variant is also rendered and timed end to end.
+#
+#     python benchmarks/bench_styles.py --leaves 1000 20000 --visits 12
+#     python benchmarks/bench_styles.py --leaves 20000 --dendroscope ~/dendroscope/Dendroscope
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import dendro_interface
+from leaf_index import LeafIndex
+from synthetic import write_random_tree
+
+
+def make_patient_visits(n_visits: int) -> dict:
+    # Year one visits all share red, later visits get their own shade
+    patient_visits = {}
+
+    for visit in range(n_visits):
+        wpi = 1 + visit * 300 // n_visits
+        colour = (255, 0, 0) if wpi < 52 else (0, (visit * 37) % 256, 255)
+        patient_visits[1000 + visit] = {"WPI": wpi, "colour": colour}
+
+    return patient_visits
+
+
+def variants(patient_visits: dict, leaf_index: LeafIndex) -> dict:
+    def per_visit():
+        return (
+            dendro_interface.create_wpi_group_styles(patient_visits)
+            + dendro_interface.create_other_styles()
+        )
+
+    return {
+        "per visit": per_visit,
+        "per leaf": lambda: dendro_interface.per_leaf_styles(per_visit(), leaf_index.names),
+        "compiled": lambda: dendro_interface.compile_styles(patient_visits, leaf_index),
+    }
+
+
+def time_dendroscope(dendroscope: str, tree_file: Path, styles: list, tmp_dir: Path) -> float:
+    command_file = tmp_dir / "styles.dendrocmd.txt"
+
+    with open(command_file, "w") as command_fh:
+        command_fh.write(dendro_interface.generate_dendro_preamble(str(tree_file)))
+        command_fh.write("".join(style.to_dendro_string() for style in styles))
+        command_fh.write(
+            dendro_interface.generate_dendro_export_command(
+                tmp_dir / "main.png", tmp_dir / "linear.png", tmp_dir / "tree.nexus"
+            )
+        )
+
+    start = time.perf_counter()
+    subprocess.run(
+        [dendroscope, "-g", "--commandFile", str(command_file)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main(leaf_counts: list, n_visits: int, dendroscope: str | None):
+    print(f"{'leaves':>8} {'strategy':<10} {'passes':>8} {'node scans':>12} {'build s':>9} {'dendro s':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+
+        for n_leaves in leaf_counts:
+            tree_file = tmp_path / f"synthetic_{n_leaves}.nwk"
+            write_random_tree(tree_file, n_leaves)
+            leaf_index = LeafIndex.from_newick(tree_file)
+            patient_visits = make_patient_visits(n_visits)
+            n_nodes = 2 * n_leaves - 1
+
+            for strategy, build_styles in variants(patient_visits, leaf_index).items():
+                start = time.perf_counter()
+                styles = build_styles()
+                build_time = time.perf_counter() - start
+
+                dendro_time = (
+                    f"{time_dendroscope(dendroscope, tree_file, styles, tmp_path):>9.2f}"
+                    if dendroscope
+                    else f"{'-':>9}"
+                )
+                print(
+                    f"{n_leaves:>8} {strategy:<10} {len(styles):>8} {len(styles) * n_nodes:>12} "
+                    f"{build_time:>9.3f} {dendro_time}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the Dendroscope styling strategies"
+    )
+    parser.add_argument("-l", "--leaves", type=int, nargs="*", default=[100, 1000, 20000],
+                        help="Sizes of synthetic trees to benchmark")
+    parser.add_argument("-v", "--visits", type=int, default=12,
+                        help="Number of visits of the synthetic patient")
+    parser.add_argument("-d", "--dendroscope", type=str, default=None,
+                        help="Dendroscope binary to time the styles with")
+
+    args = parser.parse_args()
+
+    main(args.leaves, args.visits, args.dendroscope)
@@ -0,0 +1,91 @@
+# Compares parse time and retained memory of the compact tree in src/tree.py
+# against ete3 on the same files.
+#
+#     python benchmarks/bench_tree.py --intree CAP336_NEF.nwk CAP337_ENV.nwk
+#     python benchmarks/bench_tree.py --leaves 10000 50000
+
+import argparse
+import gc
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import tree
+from synthetic import write_random_tree
+from ete3 import Tree
+
+
+def load_ete3(tree_file: Path):
+    return Tree(str(tree_file))
+
+
+def load_compact(tree_file: Path):
+    compact_tree = tree.Tree.from_newick(tree_file)
+    # Include the child index, which is built lazily on first use
+    compact_tree.children(0)
+    return compact_tree
+
+
+def measure(loader, tree_files: list) -> tuple:
+    # Time without tracemalloc, which slows allocation-heavy code down a lot
+    gc.collect()
+    start = time.perf_counter()
+    loaded = [loader(tree_file) for tree_file in tree_files]
+    elapsed = time.perf_counter() - start
+    del loaded
+
+    gc.collect()
+    tracemalloc.start()
+    loaded = [loader(tree_file) for tree_file in tree_files]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del loaded
+
+    return elapsed, retained
+
+
+def main(tree_files: list):
+    print(f"{'tree':<40} {'ete3 s':>9} {'compact s':>10} {'ete3 MiB':>9} {'compact MiB':>12}")
+
+    for tree_file in tree_files:
+        ete3_time, ete3_mem = measure(load_ete3, [tree_file])
+        compact_time, compact_mem = measure(load_compact, [tree_file])
+
+        print(
+            f"{tree_file.name:<40} {ete3_time:>9.3f} {compact_time:>10.3f} "
+            f"{ete3_mem / 2**20:>9.2f} {compact_mem / 2**20:>12.2f}"
+        )
+
+    if len(tree_files) > 1:
+        ete3_time, ete3_mem = measure(load_ete3, tree_files)
+        compact_time, compact_mem = measure(load_compact, tree_files)
+
+        print(
+            f"{'all trees held at once':<40} {ete3_time:>9.3f} {compact_time:>10.3f} "
+            f"{ete3_mem / 2**20:>9.2f} {compact_mem / 2**20:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the compact tree model against ete3"
+    )
+    parser.add_argument("-i", "--intree", type=str, nargs="*", default=[],
+                        help="Newick tree files to benchmark")
+    parser.add_argument("-l", "--leaves", type=int, nargs="*", default=[],
+                        help="Sizes of synthetic trees to benchmark")
+
+    args = parser.parse_args()
+    tree_paths = [Path(intree) for intree in args.intree]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_leaves in args.leaves or ([] if tree_paths else [1000, 10000, 50000]):
+            tree_path = Path(tmp_dir) / f"synthetic_{n_leaves}.nwk"
+            write_random_tree(tree_path, n_leaves)
+            tree_paths.append(tree_path)
+
+        main(tree_paths)
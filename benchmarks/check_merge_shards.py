@@ -0,0 +1,135 @@
+# Checks that merge-shards never loses the trees of a shard. Renders a
+# synthetic cohort as a sharded run with fake_dendroscope.py, then:
+#     - merges it, and checks an unsharded process-dir skips every tree
+#     - merges it with one shard too many, and checks merge-shards fails and
+#       leaves the manifest as it was
+#     - removes a shard's manifest and merges the rest with --partial, and
+#       checks the trees of that shard are still in the manifest
+#
+# main.py refuses to run outside a virtual environment, so neither does this:
+#     venv/bin/python benchmarks/check_merge_shards.py --shards 3
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import manifest as incremental
+import shards
+from synthetic import write_cohort
+
+SRC_DIRECTORY = Path(__file__).resolve().parent.parent / "src"
+FAKE_DENDROSCOPE = Path(__file__).resolve().parent / "fake_dendroscope.py"
+
+
+def run_main(*arguments) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "main.py", *map(str, arguments)],
+        cwd=SRC_DIRECTORY,
+        capture_output=True,
+        text=True,
+    )
+
+
+def main(args):
+    failures = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        lookup_file, tree_directory = write_cohort(
+            tmp_path / "cohort", args.patients, args.visits, args.leaves, tuple(args.genes)
+        )
+        output_directory = tmp_path / "output"
+        manifest_file = incremental.get_manifest_path(output_directory)
+        n_trees = len(list(tree_directory.glob("*.nwk")))
+        process_dir = (
+            "process-dir",
+            "--tree-directory", tree_directory,
+            "--lookup-file", lookup_file,
+            "--output-directory", output_directory,
+            "--dendroscope-bin", FAKE_DENDROSCOPE,
+        )
+
+        for index in range(args.shards):
+            if run_main(*process_dir, "--shard", f"{index}/{args.shards}").returncode != 0:
+                print(f"Shard {index}/{args.shards} failed to render")
+                sys.exit(1)
+
+        merge = run_main(
+            "merge-shards",
+            "--output-directory", output_directory,
+            "--shard-count", args.shards,
+            "--tree-directory", tree_directory,
+        )
+        merged = json.loads(manifest_file.read_text())
+
+        if merge.returncode != 0 or len(merged) != n_trees:
+            failures.append(
+                f"Merging all {args.shards} shards gave {len(merged)} of {n_trees} trees "
+                f"and exit code {merge.returncode}"
+            )
+
+        if "rebuilt 0 trees" not in run_main(*process_dir).stderr:
+            failures.append("process-dir rendered trees again after a full merge")
+
+        too_many = run_main(
+            "merge-shards",
+            "--output-directory", output_directory,
+            "--shard-count", args.shards + 1,
+        )
+
+        if too_many.returncode == 0:
+            failures.append(f"Merging with --shard-count {args.shards + 1} did not fail")
+
+        if json.loads(manifest_file.read_text()) != merged:
+            failures.append(f"Merging with --shard-count {args.shards + 1} changed the manifest")
+
+        shard_manifest = incremental.get_manifest_path(
+            output_directory, shards.get_shard_name((0, args.shards))
+        )
+        shard_trees = set(json.loads(shard_manifest.read_text()))
+        shard_manifest.unlink()
+
+        partial = run_main(
+            "merge-shards",
+            "--output-directory", output_directory,
+            "--shard-count", args.shards,
+            "--partial",
+        )
+        kept = shard_trees & set(json.loads(manifest_file.read_text()))
+
+        if partial.returncode != 0 or kept != shard_trees:
+            failures.append(
+                f"A partial merge kept {len(kept)} of the {len(shard_trees)} trees of the "
+                f"shard without a manifest, with exit code {partial.returncode}"
+            )
+
+    print(f"{n_trees} trees over {args.shards} shards")
+
+    for failure in failures:
+        print(failure)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check merge-shards keeps the manifest when shards are missing"
+    )
+    parser.add_argument("-s", "--shards", type=int, default=3,
+                        help="Number of shards to split the run into")
+    parser.add_argument("-p", "--patients", type=int, default=12,
+                        help="Number of patients in the synthetic cohort")
+    parser.add_argument("-v", "--visits", type=int, default=6,
+                        help="Number of visits per patient")
+    parser.add_argument("-l", "--leaves", type=int, default=50,
+                        help="Number of NGS leaves per tree")
+    parser.add_argument("-g", "--genes", nargs="+", default=["NEF", "ENV"],
+                        help="Genes to write a tree for, per patient")
+
+    main(parser.parse_args())
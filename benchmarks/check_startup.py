@@ -0,0 +1,127 @@
+# Checks that main.py still starts quickly. Runs the CLI under
+# python -X importtime, along with a bare Typer app that prints its help, and
+# compares how many times the reference's import time each command takes with
+# the baseline in startup_baseline.json. Fails if:
+#     - that ratio is more than --tolerance times the baseline's
+#     - a command imports one of the modules the baseline says it shouldn't,
+#       e.g. numpy or matplotlib for --help
+#
+# main.py refuses to run outside a virtual environment, so run this with the
+# virtual environment's python:
+#     venv/bin/python benchmarks/check_startup.py
+#     venv/bin/python benchmarks/check_startup.py --update   # after an intended change
+#
+# Import times swing with the load on the machine, by a third or more between
+# two runs on a busy one. Measuring the reference in the same run, one run of
+# it before each run of the command, takes the machine's speed out of the
+# comparison, and the best of --runs takes out most of the noise. What is
+# left is why the tolerance is as wide as it is: the module checks catch the
+# usual regression, an eager import of something heavy, exactly.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIRECTORY = Path(__file__).resolve().parent.parent / "src"
+BASELINE_FILE = Path(__file__).resolve().parent / "startup_baseline.json"
+# Imports Typer and prints a help page, like main.py does before it gets to
+# anything of its own
+REFERENCE_ARGUMENTS = [
+    "-c",
+    "import typer; app = typer.Typer(); app.command()(lambda: None); app()",
+    "--help",
+]
+
+
+def measure_imports(arguments: list) -> tuple:
+    # Total import time in microseconds and the names of the imported modules
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *arguments],
+        cwd=SRC_DIRECTORY,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "COLUMNS": "100"},
+    )
+
+    total = 0
+    modules = set()
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+
+        # Only modules imported at the top level count towards the total, the
+        # times of the others are already part of their importer's
+        if not name.startswith("  "):
+            total += int(cumulative)
+
+    return total, modules
+
+
+def main(args):
+    baseline = json.loads(BASELINE_FILE.read_text())
+    regressions = []
+
+    print(f"{'command':>22} {'reference ms':>13} {'import ms':>10} {'ratio':>6} {'baseline':>9}")
+
+    for name, command in baseline["commands"].items():
+        references = []
+        runs = []
+
+        for _ in range(args.runs):
+            references.append(measure_imports(REFERENCE_ARGUMENTS)[0])
+            runs.append(measure_imports(["main.py", *command["arguments"]]))
+
+        reference = min(references)
+        total = min(run_total for run_total, _ in runs)
+        modules = set().union(*(run_modules for _, run_modules in runs))
+        ratio = total / reference
+
+        print(
+            f"{name:>22} {reference / 1000:>13.1f} {total / 1000:>10.1f} "
+            f"{ratio:>6.2f} {command['import_ratio']:>9.2f}"
+        )
+
+        if args.update:
+            command["import_ratio"] = round(ratio, 3)
+            continue
+
+        if ratio > command["import_ratio"] * args.tolerance:
+            regressions.append(
+                f"{name} took {ratio:.2f} times the reference's import time, "
+                f"{ratio / command['import_ratio']:.1f} times its baseline"
+            )
+
+        for module in sorted(modules & set(command["not_imported"])):
+            regressions.append(f"{name} imports {module}")
+
+    if args.update:
+        BASELINE_FILE.write_text(json.dumps(baseline, indent=4) + "\n")
+        print(f"Updated {BASELINE_FILE}")
+        return
+
+    for regression in regressions:
+        print(regression)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check main.py's import time against the checked-in baseline"
+    )
+    parser.add_argument("-r", "--runs", type=int, default=5,
+                        help="Number of runs of each command to take the best of")
+    parser.add_argument("-t", "--tolerance", type=float, default=1.5,
+                        help="How many times its baseline ratio a command may take")
+    parser.add_argument("-u", "--update", action="store_true",
+                        help="Record the measured times as the new baseline")
+
+    main(parser.parse_args())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# A stand-in for the Dendroscope binary, for load testing the pipeline on
+# machines without Java or X11.
+#
+# It takes the same arguments the pipeline passes to Dendroscope:
+#     fake_dendroscope.py -g --commandFile CAP336_NEF.dendrocmd.txt
+# or, without --commandFile, reads commands from stdin as the long-lived
+# servers of dendro_server.py feed them.
+#
+# The commands the pipeline generates are parsed and checked: unknown commands
+# or settings, bad regexes and missing trees are reported on stderr and make it
+# exit with code 1. exportimage and save write small placeholder files. Latency
+# is simulated with two settings, taken from the environment so the pipeline
+# doesn't need to know it isn't talking to the real thing:
+#     FAKE_DENDROSCOPE_STARTUP_SECONDS   once, before the first command (the JVM)
+#     FAKE_DENDROSCOPE_NODE_SECONDS      per node of the open tree, for every
+#                                        find, exportimage and save
+
+import argparse
+import base64
+import os
+import re
+import shlex
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import tree as compact_tree
+
+# A 1x1 white PNG
+PLACEHOLDER_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC"
+)
+PLACEHOLDER_NEXML = """<?xml version="1.0" encoding="UTF-8"?>
+<nex:nexml xmlns:nex="http://www.nexml.org/2009" version="0.9">
+  <!-- Written by fake_dendroscope.py for {tree_file} -->
+</nex:nexml>
+"""
+
+SETTINGS = {
+    "window", "drawer", "radiallabels", "sparselabels", "labelcolor", "nodesize",
+    "nodeshape", "font", "fillcolor",
+}
+# Like Dendroscope, statements only end at a semicolon outside of quotes. A
+# line break is just whitespace, so a statement missing its semicolon runs
+# into the next one
+STATEMENT_RE = re.compile(r"((?:'[^']*'|[^;'])*);")
+
+
+class CommandError(Exception):
+    pass
+
+
+def parse_options(tokens: list) -> dict:
+    options = {}
+
+    for token in tokens:
+        key, _, value = token.partition("=")
+        options[key.lower()] = value
+
+    return options
+
+
+class FakeDendroscope:
+
+    def __init__(self, node_seconds: float = 0):
+        self.node_seconds = node_seconds
+        self.tree_file = None
+        self.n_nodes = 0
+
+    def scan_nodes(self):
+        time.sleep(self.node_seconds * self.n_nodes)
+
+    def require_tree(self, command: str):
+        if self.tree_file is None:
+            raise CommandError(f"{command}: no tree is open")
+
+    def reject_stray_tokens(self, command: str, tokens: list):
+        # These commands only take key=value options, so a bare word is most
+        # likely the start of the next statement
+        stray_tokens = [token for token in tokens[1:] if "=" not in token]
+        if stray_tokens:
+            raise CommandError(f"{command}: unexpected {' '.join(stray_tokens)!r}, missing ';'?")
+
+    def execute(self, statement: str) -> bool:
+        # Returns False once Dendroscope would have quit
+        try:
+            tokens = shlex.split(statement)
+        except ValueError as parse_err:
+            raise CommandError(f"{statement!r}: {parse_err}")
+
+        if not tokens:
+            return True
+
+        command = tokens[0].lower()
+        options = parse_options(tokens[1:])
+
+        if command == "open":
+            tree_file = Path(options.get("file", ""))
+            if not tree_file.is_file():
+                raise CommandError(f"open: no such tree file {tree_file}")
+            self.tree_file = tree_file
+            self.n_nodes = len(compact_tree.Tree.from_newick(tree_file))
+
+        elif command == "set":
+            setting = tokens[1].partition("=")[0].lower() if len(tokens) > 1 else ""
+            if setting not in SETTINGS:
+                raise CommandError(f"set: unknown setting {setting!r}")
+            self.require_tree(command)
+
+        elif command in ("zoom", "deselect") or command.startswith("ladderize="):
+            self.require_tree(command)
+
+        elif command == "find":
+            self.require_tree(command)
+            if "searchtext" not in options:
+                raise CommandError("find: missing searchtext")
+            if options.get("regex") == "true":
+                try:
+                    re.compile(options["searchtext"])
+                except re.error as regex_err:
+                    raise CommandError(f"find: bad regex {options['searchtext']!r}: {regex_err}")
+            self.scan_nodes()
+
+        elif command == "exportimage":
+            self.require_tree(command)
+            self.reject_stray_tokens(command, tokens)
+            if options.get("format", "").upper() != "PNG" or "file" not in options:
+                raise CommandError(f"exportimage: expected file= and format=PNG in {statement!r}")
+            self.scan_nodes()
+            Path(options["file"]).write_bytes(PLACEHOLDER_PNG)
+
+        elif command == "save":
+            self.require_tree(command)
+            self.reject_stray_tokens(command, tokens)
+            if options.get("format", "").lower() != "nexml" or "file" not in options:
+                raise CommandError(f"save: expected format=NeXML and file= in {statement!r}")
+            self.scan_nodes()
+            Path(options["file"]).write_text(PLACEHOLDER_NEXML.format(tree_file=self.tree_file))
+
+        elif command == "close":
+            self.tree_file = None
+            self.n_nodes = 0
+
+        elif command == "quit":
+            return False
+
+        else:
+            raise CommandError(f"unknown command {tokens[0]!r}")
+
+        return True
+
+
+def iter_statements(lines):
+    # Statements can span lines, so text is carried over until its semicolon
+    # turns up. Commands from stdin are run as soon as they are complete
+    pending = ""
+
+    for line in lines:
+        pending += line
+        end = 0
+
+        while match := STATEMENT_RE.match(pending, end):
+            end = match.end()
+            statement = match.group(1).strip()
+            if statement:
+                yield statement
+
+        pending = pending[end:]
+
+    if pending.strip():
+        raise CommandError(f"{pending.strip()!r}: statement not terminated by ';'")
+
+
+def main(command_file: Path | None, startup_seconds: float, node_seconds: float) -> int:
+    time.sleep(startup_seconds)
+    dendroscope = FakeDendroscope(node_seconds)
+
+    lines = open(command_file) if command_file is not None else sys.stdin
+
+    try:
+        for statement in iter_statements(lines):
+            print(f"Executing: {statement}", flush=True)
+            if not dendroscope.execute(statement):
+                return 0
+    except CommandError as command_err:
+        print(f"Error: {command_err}", file=sys.stderr, flush=True)
+        return 1
+    finally:
+        if command_file is not None:
+            lines.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A stand-in for Dendroscope")
+    parser.add_argument("-g", action="store_true", help="No GUI, accepted for compatibility")
+    parser.add_argument("--commandFile", "-c", type=Path, default=None,
+                        help="Command file to run, commands are read from stdin without one")
+    parser.add_argument("--startup-seconds", type=float,
+                        default=float(os.environ.get("FAKE_DENDROSCOPE_STARTUP_SECONDS", 0)),
+                        help="Simulated start up time")
+    parser.add_argument("--node-seconds", type=float,
+                        default=float(os.environ.get("FAKE_DENDROSCOPE_NODE_SECONDS", 0)),
+                        help="Simulated time per node for each search and export")
+
+    args = parser.parse_args()
+
+    sys.exit(main(args.commandFile, args.startup_seconds, args.node_seconds))
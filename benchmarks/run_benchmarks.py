@@ -0,0 +1,207 @@
+# Times each stage of the pipeline on a synthetic cohort and appends the
+# results to a JSON-lines file, so runs can be compared across commits.
+#
+# The stages are timed separately, on every tree of the cohort:
+#     lookup_to_dict, assign_colours_to_patients(_vectorized)   once per cohort
+#     optimise_patient_dict, build_dendro_command, dendroscope    once per tree
+#
+# Dendroscope itself is replaced by fake_dendroscope.py, with no simulated
+# latency, so the dendroscope stage measures the launch overhead of the call
+# and the checking of the command. Pass --dendroscope to time a real binary.
+#
+# main.py refuses to run outside a virtual environment, so neither does this:
+#     venv/bin/python benchmarks/run_benchmarks.py --patients 50 --leaves 2000
+#     venv/bin/python benchmarks/run_benchmarks.py --output results.jsonl
+
+import argparse
+import copy
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import dendro_interface
+import main as pipeline
+import process_colours
+from synthetic import write_cohort
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FAKE_DENDROSCOPE = Path(__file__).resolve().parent / "fake_dendroscope.py"
+
+
+def git_commit() -> str | None:
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def summarise(timings: list) -> dict:
+    return {
+        "calls": len(timings),
+        "total_s": sum(timings),
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "max_s": max(timings),
+    }
+
+
+def time_call(timings: list, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings.append(time.perf_counter() - start)
+
+    return result
+
+
+def run_stages(lookup_file: Path, tree_files: list, output_directory: Path, dendro_path: str) -> dict:
+    """
+    Run every stage of the pipeline once over the cohort and time each call.
+
+    Args:
+        lookup_file (Path): The synthetic lookup CSV
+        tree_files (list): The synthetic trees
+        output_directory (Path): Output directory, set up with do_setup
+        dendro_path (str): Dendroscope binary, or fake_dendroscope.py
+
+    Returns:
+        dict: Lists of timings in seconds, keyed by stage
+    """
+    timings = {
+        "lookup_to_dict": [],
+        "assign_colours_to_patients": [],
+        "assign_colours_to_patients_vectorized": [],
+        "optimise_patient_dict": [],
+        "build_dendro_command": [],
+        "dendroscope": [],
+    }
+
+    # Every run starts without the styles of the runs before it, as a new
+    # process would, or build_dendro_command would time memo hits
+    dendro_interface.STYLE_MEMO = dendro_interface.StyleMemo()
+
+    patients_dict = time_call(timings["lookup_to_dict"], process_colours.lookup_to_dict, lookup_file)
+    time_call(
+        timings["assign_colours_to_patients"],
+        process_colours.assign_colours_to_patients,
+        copy.deepcopy(patients_dict),
+    )
+    patients_dict = time_call(
+        timings["assign_colours_to_patients_vectorized"],
+        process_colours.assign_colours_to_patients_vectorized,
+        patients_dict,
+    )
+
+    for tree_file in tree_files:
+        cap_id = tree_file.stem.split("_")[0]
+        patient_dict = time_call(
+            timings["optimise_patient_dict"],
+            pipeline.optimise_patient_dict,
+            patients_dict[cap_id],
+            tree_file,
+        )
+        dendro_command = time_call(
+            timings["build_dendro_command"],
+            pipeline.build_tree_command,
+            cap_id,
+            tree_file,
+            patient_dict,
+            output_directory,
+        )
+
+        command_file = pipeline.get_command_file(tree_file, output_directory)
+        command_file.write_text(dendro_command)
+        exit_code = time_call(
+            timings["dendroscope"],
+            pipeline.run_dendro_command_file,
+            command_file,
+            pipeline.get_log_file(tree_file, output_directory),
+            dendro_path,
+        )
+
+        if exit_code != 0:
+            print(f"Dendroscope exited with code {exit_code} on {command_file}")
+            sys.exit(1)
+
+    return timings
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        lookup_file, tree_directory = write_cohort(
+            tmp_path / "cohort", args.patients, args.visits, args.leaves, seed=args.seed
+        )
+        tree_files = sorted(tree_directory.glob("*.nwk"))
+
+        output_directory = tmp_path / "output"
+        pipeline.do_setup(output_directory)
+        dendro_path = args.dendroscope or str(FAKE_DENDROSCOPE)
+
+        runs = [
+            run_stages(lookup_file, tree_files, output_directory, dendro_path)
+            for _ in range(args.repeats)
+        ]
+
+    # The run with the fastest total is the least disturbed one, per stage
+    stages = {
+        stage: summarise(min((run[stage] for run in runs), key=sum))
+        for stage in runs[0]
+    }
+
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": {
+            "patients": args.patients,
+            "visits": args.visits,
+            "leaves": args.leaves,
+            "repeats": args.repeats,
+            "seed": args.seed,
+            "dendroscope": "fake" if args.dendroscope is None else args.dendroscope,
+        },
+        "stages": stages,
+    }
+
+    print(f"{'stage':<40} {'calls':>6} {'total s':>9} {'median s':>9}")
+    for stage, summary in stages.items():
+        print(f"{stage:<40} {summary['calls']:>6} {summary['total_s']:>9.3f} {summary['median_s']:>9.4f}")
+
+    with open(args.output, "a") as output_fh:
+        output_fh.write(json.dumps(record) + "\n")
+
+    print(f"Appended the results to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time each pipeline stage on a synthetic cohort"
+    )
+    parser.add_argument("-p", "--patients", type=int, default=50,
+                        help="Number of patients in the synthetic cohort")
+    parser.add_argument("-v", "--visits", type=int, default=10,
+                        help="Number of visits per patient")
+    parser.add_argument("-l", "--leaves", type=int, default=2000,
+                        help="Number of NGS leaves per tree")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of runs over the cohort, the fastest is reported")
+    parser.add_argument("-s", "--seed", type=int, default=336,
+                        help="Seed of the synthetic cohort")
+    parser.add_argument("-d", "--dendroscope", type=str, default=None,
+                        help="Dendroscope binary to time instead of fake_dendroscope.py")
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark_results.jsonl"),
+                        help="JSON-lines file the results are appended to")
+
+    main(parser.parse_args())
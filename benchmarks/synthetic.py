@@ -0,0 +1,164 @@
+# Generators for synthetic cohorts, shared by the benchmarks.
+#
+# A cohort is a lookup CSV with the same columns as the real one and a Newick
+# tree per patient and gene, whose leaves follow the real naming scheme:
+#     CAP336_4210_138WPI_NEF_1_NGS_353_0.001   (an NGS haplotype)
+#     CAP336_xxxx_000WPI_NEF_1_OGV_B-W39       (an OGV sequence, dummy 0 WPI)
+
+import csv
+import random
+from pathlib import Path
+
+WEEKS_IN_YEAR = 52
+LOOKUP_COLUMNS = ["PID", "Visit Code", "Weeks post infection", "Weeks pre-ART"]
+
+
+def join_subtrees(subtrees: list, rng: random.Random) -> str:
+    # Join random pairs until one tree is left, which gives a random topology
+    subtrees = list(subtrees)
+
+    while len(subtrees) > 1:
+        right = subtrees.pop(rng.randrange(len(subtrees)))
+        left = subtrees.pop(rng.randrange(len(subtrees)))
+        subtrees.append(f"({left},{right}):{rng.random():.4f}")
+
+    return subtrees[0] + ";\n"
+
+
+def write_random_tree(tree_file: Path, n_leaves: int, seed: int = 336):
+    # A tree for a single made-up patient, with WPIs picked at random
+    rng = random.Random(seed)
+    subtrees = [
+        f"CAP336_{i}_{rng.randint(1, 300):03d}WPI_NEF_1_NGS_{rng.randint(1, 500)}_0.001:{rng.random():.4f}"
+        for i in range(n_leaves)
+    ]
+
+    with open(tree_file, "w") as tree_fh:
+        tree_fh.write(join_subtrees(subtrees, rng))
+
+
+def make_cohort_visits(n_patients: int, n_visits: int, seed: int = 336) -> dict:
+    """
+    Make up the visits of a cohort.
+
+    Every visit falls within six years of infection, since years two to six are
+    the only ones with a base colour in process_colours.
+
+    Args:
+        n_patients (int): Number of patients
+        n_visits (int): Number of visits per patient
+        seed (int): Seed of the random generator
+
+    Returns:
+        dict: Lists of (visit code, WPI, weeks pre-ART) tuples keyed by CAP id
+    """
+    rng = random.Random(seed)
+    cohort = {}
+
+    for patient in range(n_patients):
+        art_week = rng.randint(60, 6 * WEEKS_IN_YEAR - 1)
+        weeks = sorted(rng.sample(range(1, art_week), min(n_visits, art_week - 1)))
+
+        cohort[f"CAP{patient}"] = [
+            (1000 + 10 * visit, week, art_week - week) for visit, week in enumerate(weeks)
+        ]
+
+    return cohort
+
+
+def write_lookup(lookup_file: Path, cohort: dict):
+    with open(lookup_file, "w", newline="") as lookup_fh:
+        writer = csv.writer(lookup_fh)
+        writer.writerow(LOOKUP_COLUMNS)
+
+        for cap_id, visits in cohort.items():
+            for visit_code, wpi, weeks_pre_art in visits:
+                writer.writerow([cap_id, visit_code, wpi, weeks_pre_art])
+
+
+def write_random_lookup(lookup_file: Path, n_patients: int, n_visits: int, seed: int = 336):
+    write_lookup(lookup_file, make_cohort_visits(n_patients, n_visits, seed))
+
+
+def write_patient_tree(
+    tree_file: Path,
+    cap_id: str,
+    wpis: list,
+    n_leaves: int,
+    gene: str = "NEF",
+    n_ogv: int = 2,
+    seed: int = 336,
+):
+    """
+    Write a tree for one patient and gene, with NGS haplotypes spread over the
+    patient's WPIs and a few OGV sequences.
+
+    Args:
+        tree_file (Path): Where to write the Newick tree
+        cap_id (str): The patient's CAP id, as in the lookup file
+        wpis (list): The patient's WPIs
+        n_leaves (int): Number of NGS leaves
+        gene (str): Gene name used in the leaf names
+        n_ogv (int): Number of OGV leaves
+        seed (int): Seed of the random generator
+    """
+    rng = random.Random(f"{seed}-{cap_id}-{gene}")
+    subtrees = []
+
+    for leaf in range(n_leaves):
+        count = rng.randint(1, 500)
+        subtrees.append(
+            f"{cap_id}_{4000 + leaf}_{rng.choice(wpis):03d}WPI_{gene}_1_NGS_{count}_"
+            f"{count / 1000:.3f}:{rng.random():.4f}"
+        )
+
+    for ogv in range(n_ogv):
+        subtrees.append(f"{cap_id}_xxxx_000WPI_{gene}_1_OGV_B-W{ogv}:{rng.random():.4f}")
+
+    with open(tree_file, "w") as tree_fh:
+        tree_fh.write(join_subtrees(subtrees, rng))
+
+
+def write_cohort(
+    cohort_directory: Path,
+    n_patients: int,
+    n_visits: int,
+    n_leaves: int,
+    genes: tuple = ("NEF",),
+    seed: int = 336,
+) -> tuple:
+    """
+    Write a synthetic cohort: a lookup CSV and a tree per patient and gene.
+
+    Args:
+        cohort_directory (Path): Directory to write the cohort to
+        n_patients (int): Number of patients
+        n_visits (int): Number of visits per patient
+        n_leaves (int): Number of NGS leaves per tree
+        genes (tuple): Genes to write a tree for, per patient
+        seed (int): Seed of the random generator
+
+    Returns:
+        tuple: Path to the lookup CSV and the directory holding the trees
+    """
+    tree_directory = cohort_directory / "trees"
+    tree_directory.mkdir(parents=True, exist_ok=True)
+
+    cohort = make_cohort_visits(n_patients, n_visits, seed)
+    lookup_file = cohort_directory / "lookup.csv"
+    write_lookup(lookup_file, cohort)
+
+    for cap_id, visits in cohort.items():
+        wpis = [wpi for _, wpi, _ in visits]
+
+        for gene in genes:
+            write_patient_tree(
+                tree_directory / f"{cap_id}_{gene}.nwk",
+                cap_id,
+                wpis,
+                n_leaves,
+                gene=gene,
+                seed=seed,
+            )
+
+    return lookup_file, tree_directory
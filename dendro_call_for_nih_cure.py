@@ -1,9 +1,13 @@
 import sys
-from ete3 import Tree
 import subprocess
 import os
 import argparse
 import socket
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent / "src"))
+
+from leaf_index import LeafIndex
 
 
 def get_dendro_call():
@@ -30,21 +34,14 @@ def main(intree_fn):
     out_fn_linear = os.path.splitext(intree_fn)[0] + "_dendro_tree_linear.png"
     nexus_fn = os.path.splitext(intree_fn)[0] + "_dendro_NEXUS.nex"
 
-    t = Tree(intree)
-    root_node = t.get_tree_root()
-    all_leaves = root_node.get_leaves()
-    leaf_names = [node.name for node in all_leaves]
+    # Every label is split once, into columns of CAP, WPI, NGS/OGV etc.
+    leaf_index = LeafIndex.from_newick(intree)
     #OGV_names = [ln for ln in leaf_names if ln.split("_")[5] == "OGV"]
 
 
     # CAP336_4210_138WPI_NEF_1_NGS_353_0.001
-    all_wpis = []
-    for lf in leaf_names:
-        all_wpis.append(int(lf.upper().split("_")[2].replace("WPI", "")))
-    all_wpis = list(set(all_wpis))
-
-    if 0 in all_wpis:  # The OGV seqids include a dummy 000wpi  CAP336_xxxx_000WPI_NEF_1_OGV_B-W39 - no real data is at 0wpi
-        all_wpis.remove(0)
+    # The OGV seqids include a dummy 000wpi  CAP336_xxxx_000WPI_NEF_1_OGV_B-W39 - no real data is at 0wpi
+    all_wpis = leaf_index.sampled_wpis().tolist()
 
     rgbs = [(255, 0, 0), (255, 38, 0), (255, 77, 0), (255, 115, 0), (255, 153, 0), (255, 229, 0), (242, 255, 0),
             (204, 255, 0), (166, 255, 0), (128, 255, 0), (89, 255, 0), (51, 255, 0), (12, 255, 0), (0, 255, 25),
@@ -120,7 +117,7 @@ def main(intree_fn):
     # '''.format(leaf, this_colour, this_freq, this_shape, this_colour)
     dendro_cmd_text += "apply-all-begin "
     ogv_text = ""
-    for leaf in leaf_names:
+    for leaf, this_wpi in zip(leaf_index.names, leaf_index.wpi.tolist()):
         if "OGV" in leaf:
             this_freq = 20
             this_colour = "255 61 240"
@@ -136,7 +133,6 @@ def main(intree_fn):
             '''.format(leaf, this_colour, this_freq, this_shape, this_colour)
         elif "NGS" in leaf:
             this_colour = "255 255 255"
-            this_wpi = int(leaf.split("_")[2].upper().replace("WPI", ""))
             this_colour = wpi_rgb_lookup[this_wpi]
             this_colour = "{} {} {}".format(this_colour[0], this_colour[1], this_colour[2])
             # for k in time_colours.keys():
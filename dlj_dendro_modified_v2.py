@@ -1,9 +1,13 @@
-from ete3 import Tree
+import sys
 import subprocess
 import numpy as np
 import argparse
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent / "src"))
+
+from leaf_index import LeafIndex
+
 
 DENDRO_PATH = "/home/dlejeune/dendroscope/Dendroscope"
 
@@ -86,12 +90,9 @@ def generate_dendro_export_command(main_output_file: Path, linear_output_file: P
 
 
 def build_dendro_command(tree_file: Path, main_output_file: Path, linear_output_file: Path, nexus_output_file: Path) -> str:
-    input_tree = Tree(str(tree_file))
-    
-    root_node = input_tree.get_tree_root()
-    leaf_names = [node.name for node in root_node.get_leaves()]
+    leaf_index = LeafIndex.from_newick(tree_file)
 
-    wpi_list = extract_wpis_from_sample_names(leaf_names)
+    wpi_list = extract_wpis_from_sample_names(leaf_index)
     wpi_gradient_styles = create_gradient_group_styles(wpi_list)
     ogv_style = GroupStyle("OGV", colour="255 61 240", shape="rectangle", size="20", font="arial-bold-16", fillcolour="255 255 255")
 
@@ -107,17 +108,14 @@ def build_dendro_command(tree_file: Path, main_output_file: Path, linear_output_
     return dendro_command
 
 
-def extract_wpis_from_sample_names(sample_names: list) -> list:
-    
-    wpis = []
-
-    for sample_name in sample_names:
-        wpi = int(sample_name.split("_")[2].replace("WPI", ""))
+def extract_wpis_from_sample_names(leaf_index: LeafIndex) -> list:
 
-        if wpi and (wpi not in wpis) and (wpi != 0):
-            wpis.append(wpi)
+    # The distinct WPIs in the order they first appear in the tree, which is
+    # the order the colour gradient is handed out in
+    sampled = leaf_index.wpi[leaf_index.wpi > 0]
+    wpis, first_seen = np.unique(sampled, return_index=True)
 
-    return wpis
+    return wpis[np.argsort(first_seen)].tolist()
 
 
 def create_gradient_group_styles(wpis: list) -> list:
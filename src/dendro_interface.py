@@ -1,5 +1,12 @@
+import re
+import threading
 from pathlib import Path
 
+from leaf_index import LeafIndex
+
+# A run of digits right before "WPI", e.g. the 138 of CAP336_4210_138WPI_NEF
+WPI_TOKEN_RE = re.compile(r"(\d+)WPI")
+
 
 class GroupStyle:
 
@@ -11,9 +18,11 @@ class GroupStyle:
         size: str | None = None,
         font: str | None = None,
         fillcolour: str | None = None,
+        regex: bool = True,
     ):
 
         self.selector = selector
+        self.regex = regex
 
         self.colour: str | None = colour
         self.shape: str | None = shape
@@ -22,7 +31,8 @@ class GroupStyle:
         self.fillcolour: str | None = fillcolour
 
     def to_dendro_string(self) -> str:
-        output_string = f"find searchtext='{self.selector}' target=Nodes regex=true;"
+        search_mode = "regex=true" if self.regex else "wholewords=true"
+        output_string = f"find searchtext='{self.selector}' target=Nodes {search_mode};"
 
         if self.colour:
             output_string += f"set labelcolor={self.colour} 255;\n"
@@ -72,29 +82,50 @@ def generate_dendro_preamble(
 
 
 def generate_dendro_export_command(
-    main_output_file: Path, linear_output_file: Path, nexus_output_file: Path
+    main_output_file: Path,
+    linear_output_file: Path,
+    nexus_output_file: Path,
+    final_command: str = "quit;",
 ) -> str:
     return f"""
         exportimage file='{str(main_output_file)}' format=PNG replace=true;
         set drawer=RectangularPhylogram;
         exportimage file='{str(linear_output_file)}' format=PNG replace=true;
-        save format=NeXML file={str(nexus_output_file)}
-        quit;"""
+        save format=NeXML file='{str(nexus_output_file)}';
+        {final_command}"""
 
 
-def create_wpi_group_styles(patient_visits: dict) -> list:
-    styles = []
+def get_wpi_selector(padded_wpis: list) -> str:
+    return f"(.*({'|'.join(padded_wpis)}))(.*(NGS)).*"
+
+
+def create_wpi_group_styles(patient_visits: dict, grouped: bool = False) -> list:
+    # With grouped=True, visits that end up with an identical style share one
+    # alternation regex, so Dendroscope searches the tree once per style
+    # rather than once per visit
+    wpis_by_style = {}
 
     for visit in patient_visits.values():
 
         padded_wpi = str(visit["WPI"]).rjust(3, "0")
-        regex_selector = f"(.*({padded_wpi}WPI))(.*(NGS)).*"
         colour = visit["colour"]
 
+        style_key = (f"{colour[0]} {colour[1]} {colour[2]}", "arial-italic-8")
+
+        if not grouped:
+            style_key = (len(wpis_by_style),) + style_key
+
+        wpis = wpis_by_style.setdefault(style_key, [])
+        if f"{padded_wpi}WPI" not in wpis:
+            wpis.append(f"{padded_wpi}WPI")
+
+    styles = []
+
+    for style_key, wpis in wpis_by_style.items():
         style = GroupStyle(
-            regex_selector,
-            colour=f"{colour[0]} {colour[1]} {colour[2]}",
-            font="arial-italic-8",
+            get_wpi_selector(wpis),
+            colour=style_key[-2],
+            font=style_key[-1],
         )
 
         styles.append(style)
@@ -120,10 +151,137 @@ def create_other_styles() -> list:
     return styles
 
 
-def generate_dendro_styling_command(patient_visits) -> str:
+def per_leaf_styles(styles: list, leaf_names: list) -> list:
+    # One wholewords search per styled leaf. Styles are applied in order, so
+    # the last style whose selector matches a leaf is the one that sticks
+    compiled = [(re.compile(style.selector), style) for style in styles]
+    leaf_styles = []
+
+    for leaf_name in leaf_names:
+        leaf_style = None
+
+        for selector, style in compiled:
+            if selector.search(leaf_name):
+                leaf_style = style
+
+        if leaf_style is not None:
+            leaf_styles.append(
+                GroupStyle(
+                    leaf_name,
+                    colour=leaf_style.colour,
+                    shape=leaf_style.shape,
+                    size=leaf_style.size,
+                    font=leaf_style.font,
+                    fillcolour=leaf_style.fillcolour,
+                    regex=False,
+                )
+            )
+
+    return leaf_styles
+
+
+def get_leaf_styles(patient_visits: dict, leaf_names: list) -> dict:
+    # The style each leaf ends up with once the styling command has run, keyed
+    # by leaf name. Leaves that no style matches are left out.
+    #
+    # Gives the same styles as per_leaf_styles, without trying every visit's
+    # regex on every leaf. A visit's selector matches the leaves with its
+    # padded WPI right before "WPI" and "NGS" somewhere after that, so the
+    # visit styles are looked up by the WPIs in each leaf name instead.
+    wpi_styles = {}
+
+    for order, (visit, style) in enumerate(
+        zip(patient_visits.values(), create_wpi_group_styles(patient_visits))
+    ):
+        # Later styles win, as they are applied last
+        wpi_styles[str(visit["WPI"]).rjust(3, "0")] = (order, style)
+
+    other_styles = create_other_styles()
+    leaf_styles = {}
+
+    for leaf_name in leaf_names:
+        leaf_order, leaf_style = -1, None
+
+        for match in WPI_TOKEN_RE.finditer(leaf_name):
+            if "NGS" not in leaf_name[match.end():]:
+                continue
+
+            digits = match.group(1)
+
+            # A padded WPI can match the tail of a longer run of digits
+            for start in range(len(digits) - 2):
+                order, style = wpi_styles.get(digits[start:], (-1, None))
+
+                if order > leaf_order:
+                    leaf_order, leaf_style = order, style
+
+        # The other styles select plain words, and come after every visit style
+        for style in other_styles:
+            if style.selector in leaf_name:
+                leaf_style = style
+
+        if leaf_style is not None:
+            leaf_styles[leaf_name] = GroupStyle(
+                leaf_name,
+                colour=leaf_style.colour,
+                shape=leaf_style.shape,
+                size=leaf_style.size,
+                font=leaf_style.font,
+                fillcolour=leaf_style.fillcolour,
+                regex=False,
+            )
+
+    return leaf_styles
+
+
+def compile_styles(patient_visits: dict, leaf_index: LeafIndex) -> list:
+    """
+    Build the styles for a tree using as few Dendroscope search passes as
+    possible. Every `find` scans every node of the tree, so the number of
+    styles returned is the number of passes over the tree.
+
+    Visits whose WPI does not appear in any leaf are dropped. The remaining
+    visits are grouped into one regex per distinct style, unless styling every
+    leaf on its own takes fewer passes (which only happens on tiny trees).
+
+    Args:
+        patient_visits (dict): The patient's visits, keyed by visit code
+        leaf_index (LeafIndex): The parsed leaf labels of the tree
+
+    Returns:
+        list: The GroupStyles to apply, in order
+    """
+    visits_in_tree = leaf_index.visits_in_tree(patient_visits)
+
+    other_styles = create_other_styles()
+
+    grouped = create_wpi_group_styles(visits_in_tree, grouped=True) + other_styles
+
+    # Styling per leaf never takes more passes than there are leaves, so it
+    # is only worth working out on trees smaller than the grouped styles
+    if len(leaf_index) >= len(grouped):
+        return grouped
+
+    per_leaf = per_leaf_styles(
+        create_wpi_group_styles(visits_in_tree) + other_styles, leaf_index.names
+    )
+
+    if len(per_leaf) < len(grouped):
+        return per_leaf
+
+    return grouped
+
+
+def generate_dendro_styling_command(
+    patient_visits, leaf_index: LeafIndex | None = None
+) -> str:
+
+    if leaf_index is None:
+        styles = create_wpi_group_styles(patient_visits)
+        styles.extend(create_other_styles())
+    else:
+        styles = compile_styles(patient_visits, leaf_index)
 
-    styles = create_wpi_group_styles(patient_visits)
-    styles.extend(create_other_styles())
     output_str = ""
 
     for style in styles:
@@ -132,18 +290,120 @@ def generate_dendro_styling_command(patient_visits) -> str:
     return output_str
 
 
+class StyleMemo:
+    """
+    The visits and styling commands already worked out for each CAP, so the
+    other trees of a CAP (NEF, ENV, ...) don't work them out again.
+
+    Both only depend on the patient's visits and on which WPIs are sampled in
+    a tree, so entries are kept per CAP and keyed by the set of WPIs. Each
+    entry remembers the visits it was built from and is only reused for equal
+    visits, so a tree is never styled with the colours of an older lookup
+    table. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.caps = {}
+
+    def get(self, cap_id: str, key: tuple, visits: dict, build):
+        with self.lock:
+            cached = self.caps.get(cap_id, {}).get(key)
+
+        if cached is not None and cached[0] == visits:
+            return cached[1]
+
+        value = build()
+
+        with self.lock:
+            self.caps.setdefault(cap_id, {})[key] = (visits, value)
+
+        return value
+
+    def visits_in_tree(self, cap_id: str, patient_visits: dict, leaf_index: LeafIndex) -> dict:
+        """
+        The patient's visits whose WPI appears in at least one leaf, as
+        LeafIndex.visits_in_tree.
+
+        Args:
+            cap_id (str): The patient's CAP id
+            patient_visits (dict): The patient's visits, keyed by visit code
+            leaf_index (LeafIndex): The parsed leaf labels of the tree
+
+        Returns:
+            dict: The visits that have leaves, in their original order
+        """
+        wpis = frozenset(leaf_index.sampled_wpis().tolist())
+
+        return self.get(
+            cap_id,
+            ("visits", wpis),
+            patient_visits,
+            lambda: leaf_index.visits_in_tree(patient_visits),
+        )
+
+    def styling_command(self, cap_id: str, visits_in_tree: dict, leaf_index: LeafIndex) -> str:
+        """
+        The styling command for a tree, as generate_dendro_styling_command.
+
+        Args:
+            cap_id (str): The patient's CAP id
+            visits_in_tree (dict): The patient's visits that have leaves in the
+                tree, keyed by visit code
+            leaf_index (LeafIndex): The parsed leaf labels of the tree
+
+        Returns:
+            str: The Dendroscope commands that style the tree
+        """
+        wpis = frozenset(visit["WPI"] for visit in visits_in_tree.values())
+
+        def build() -> tuple:
+            styles = create_wpi_group_styles(visits_in_tree, grouped=True)
+            styles.extend(create_other_styles())
+
+            return "".join(style.to_dendro_string() for style in styles), len(styles)
+
+        command, n_styles = self.get(cap_id, ("styles", wpis), visits_in_tree, build)
+
+        # Trees with fewer leaves than styles may be styled a leaf at a time,
+        # which depends on the leaves themselves (see compile_styles)
+        if len(leaf_index) < n_styles:
+            return generate_dendro_styling_command(visits_in_tree, leaf_index)
+
+        return command
+
+
+STYLE_MEMO = StyleMemo()
+
+
 def build_dendro_command(
     input_tree_file: Path,
     patient_visits: dict,
     main_output_file: Path,
     linear_output_file: Path,
     nexus_output_file: Path,
+    final_command: str = "quit;",
+    leaf_index: LeafIndex | None = None,
+    styling_command: str | None = None,
 ) -> str:
 
+    if styling_command is None:
+        styling_command = generate_dendro_styling_command(patient_visits, leaf_index)
+
     output_str = generate_dendro_preamble(str(input_tree_file))
-    output_str += generate_dendro_styling_command(patient_visits)
+    output_str += styling_command
     output_str += generate_dendro_export_command(
-        main_output_file, linear_output_file, nexus_output_file
+        main_output_file, linear_output_file, nexus_output_file, final_command
     )
 
     return output_str
+
+
+def build_dendro_batch_command(tree_commands: list) -> str:
+    # Each tree command should have been built with final_command="close;" so
+    # that its window is closed before the next tree is opened in the same JVM
+    output_str = "".join(tree_commands)
+    output_str += """
+        quit;"""
+
+    return output_str
@@ -0,0 +1,88 @@
+# Runs Dendroscope command files as asyncio subprocesses.
+#
+# The Dendroscope launcher is a shell script that starts a JVM, so each run is
+# started in its own session and a timeout kills the whole process group rather
+# than just the launcher. Both output streams go straight to the tree's log
+# file through its file descriptor, so nothing is buffered in Python however
+# much a run prints.
+
+import asyncio
+import logging
+import os
+import signal
+from pathlib import Path
+from typing import Optional
+
+# Returned instead of an exit code when a run was killed for taking too long,
+# the same code coreutils' timeout uses
+TIMED_OUT = 124
+# How long a timed out run is given to exit after SIGTERM before it is killed
+TERMINATE_GRACE_SECONDS = 5
+
+
+def get_dendro_args(dendro_command_file: Path, dendro_path: str) -> list:
+    return [dendro_path, "-g", "--commandFile", str(dendro_command_file)]
+
+
+def kill_process_group(process: asyncio.subprocess.Process, sig: int):
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def run_dendro_command_file(
+    dendro_command_file: Path,
+    error_log_file: Path,
+    dendro_path: str,
+    timeout: Optional[float] = None,
+) -> int:
+    """
+    Run Dendroscope on a command file, appending its output to a log file.
+
+    Args:
+        dendro_command_file (Path): The Dendroscope command file
+        error_log_file (Path): Log file both output streams are appended to
+        dendro_path (str): Path to the Dendroscope executable
+        timeout (float): Seconds to wait before killing the run, None to wait
+            for as long as it takes
+
+    Returns:
+        int: Dendroscope's exit code, or TIMED_OUT if it was killed
+    """
+    with open(error_log_file, "ab") as error_log:
+        process = await asyncio.create_subprocess_exec(
+            *get_dendro_args(dendro_command_file, dendro_path),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=error_log,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+        try:
+            return await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            kill_process_group(process, signal.SIGKILL)
+            raise
+
+        logging.error(
+            f"Dendroscope ran for more than {timeout}s on {dendro_command_file}, killing it"
+        )
+        kill_process_group(process, signal.SIGTERM)
+
+        try:
+            await asyncio.wait_for(process.wait(), TERMINATE_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            kill_process_group(process, signal.SIGKILL)
+            await process.wait()
+
+        return TIMED_OUT
+
+
+def describe_exit_code(exit_code: int, timeout: Optional[float] = None) -> str:
+    if exit_code == TIMED_OUT and timeout is not None:
+        return f"Dendroscope timed out after {timeout}s"
+
+    return f"Dendroscope exited with code {exit_code}"
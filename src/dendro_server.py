@@ -0,0 +1,276 @@
+# Keeps Dendroscope processes running between trees, so that only the first
+# tree of a run pays for starting the JVM.
+#
+# Each server is a `Dendroscope -g` process reading commands from its stdin.
+# Tree commands are written to it as they are, ending in `close;` rather than
+# `quit;` so the process survives them. Dendroscope doesn't acknowledge
+# commands, and an output file that exists may still be being written, so
+# every tree is followed by a marker: the probe tree, exported to an image of
+# its own. Dendroscope runs its commands one after the other, so once the
+# marker is written the tree's commands have all finished. The tree's outputs
+# are deleted before it is submitted, so ones left over from an earlier run
+# can't pass for new. A server that doesn't write the marker in time is
+# considered wedged: it is killed and started again.
+#
+# Before a server is reused after a failure, or after sitting idle for a while,
+# it renders a two leaf probe tree as a health check.
+
+import logging
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import dendro_runner
+
+STARTUP_TIMEOUT_SECONDS = 120
+SUBMIT_TIMEOUT_SECONDS = 600
+HEALTH_CHECK_INTERVAL_SECONDS = 60
+POLL_INTERVAL_SECONDS = 0.1
+PROBE_TREE = "(probe_a:1,probe_b:1);\n"
+
+
+def get_file_size(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return None
+
+
+class DendroServer:
+    """
+    A single long-lived Dendroscope process fed over its stdin.
+
+    Args:
+        dendro_path (str): Path to the Dendroscope executable
+        work_directory (Path): Directory for the server's probe tree and image
+        log_file (Path): Log file both of the process's output streams go to
+        submit_timeout (float): Seconds a tree may take before the server is
+            considered wedged
+    """
+
+    def __init__(
+        self,
+        dendro_path: str,
+        work_directory: Path,
+        log_file: Path,
+        submit_timeout: float = SUBMIT_TIMEOUT_SECONDS,
+    ):
+        self.dendro_path = dendro_path
+        self.work_directory = work_directory
+        self.log_file = log_file
+        self.submit_timeout = submit_timeout
+        self.process = None
+        self.last_used = 0.0
+        self.jobs_run = 0
+        self.healthy = False
+        self.lock = threading.Lock()
+
+        self.work_directory.mkdir(parents=True, exist_ok=True)
+        self.probe_tree_file = self.work_directory / "probe.nwk"
+        self.probe_tree_file.write_text(PROBE_TREE)
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def launch(self):
+        with open(self.log_file, "ab") as log_fh:
+            self.process = subprocess.Popen(
+                [self.dendro_path, "-g"],
+                stdin=subprocess.PIPE,
+                stdout=log_fh,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+
+        logging.info(f"Started Dendroscope server {self.process.pid}")
+
+    def wait_until_ready(self):
+        # The first probe also covers the JVM starting up
+        self.healthy = self.health_check(STARTUP_TIMEOUT_SECONDS)
+
+        if not self.healthy:
+            logging.error(f"Dendroscope server {self.process.pid} failed its first health check")
+
+    def start(self):
+        self.launch()
+        self.wait_until_ready()
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        if self.is_alive():
+            try:
+                self.send("quit;\n")
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+
+        if self.is_alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+
+        self.process = None
+
+    def restart(self):
+        logging.warning(f"Restarting the Dendroscope server logging to {self.log_file}")
+        self.stop()
+        self.start()
+
+    def send(self, command: str):
+        self.process.stdin.write(command.encode("utf-8"))
+        self.process.stdin.flush()
+
+    def get_probe_command(self, image_file: Path) -> str:
+        return (
+            f"open file='{self.probe_tree_file}';\n"
+            f"exportimage file='{image_file}' format=PNG replace=true;\n"
+            "close;\n"
+        )
+
+    def wait_for_marker(self, marker_file: Path, timeout: float) -> int:
+        # The marker has to keep its size over two polls, so it isn't taken
+        # for written while Dendroscope is still writing it
+        deadline = time.monotonic() + timeout
+        last_size = None
+
+        while time.monotonic() < deadline:
+            size = get_file_size(marker_file)
+
+            if size and size == last_size:
+                return 0
+            if not self.is_alive():
+                return 1
+
+            last_size = size
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+        return dendro_runner.TIMED_OUT
+
+    def health_check(self, timeout: float = 30) -> bool:
+        probe_image = self.work_directory / "probe.png"
+
+        return self.run(self.get_probe_command(probe_image), [probe_image], timeout) == 0
+
+    def run(self, command: str, output_files: list, timeout: float) -> int:
+        if not self.is_alive():
+            return 1
+
+        self.jobs_run += 1
+        marker_file = self.work_directory / f"job{self.jobs_run}.done.png"
+
+        for stale_file in [*output_files, marker_file]:
+            stale_file.unlink(missing_ok=True)
+
+        try:
+            self.send(command + "\n" + self.get_probe_command(marker_file))
+        except OSError:
+            return 1
+
+        exit_code = self.wait_for_marker(marker_file, timeout)
+        self.last_used = time.monotonic()
+        marker_file.unlink(missing_ok=True)
+
+        # Dendroscope carries on past a command that fails, so a tree can get
+        # to its marker without writing everything
+        if exit_code == 0 and not all(output_file.exists() for output_file in output_files):
+            return 1
+
+        return exit_code
+
+    def submit(self, command: str, output_files: list) -> int:
+        """
+        Render a tree on this server and wait for its outputs.
+
+        Args:
+            command (str): Dendroscope command block for the tree, ending in
+                `close;`
+            output_files (list): Paths of the files the command writes
+
+        Returns:
+            int: 0 once all outputs are written, dendro_runner.TIMED_OUT if the
+                server was wedged, or 1 if it died, could not be started or
+                finished the tree without writing all of its outputs
+        """
+        with self.lock:
+            idle = time.monotonic() - self.last_used > HEALTH_CHECK_INTERVAL_SECONDS
+
+            if not self.is_alive() or not self.healthy or (idle and not self.health_check()):
+                self.restart()
+
+            if not self.healthy:
+                return 1
+
+            exit_code = self.run(command, output_files, self.submit_timeout)
+
+            if exit_code == 0:
+                return 0
+
+            # Whatever state the process is in now, it may still be working
+            # through this tree, so it is replaced before taking the next one
+            self.restart()
+
+            return exit_code
+
+
+class DendroServerPool:
+    """
+    A fixed number of Dendroscope servers shared by the threads of a run.
+
+    Args:
+        size (int): Number of Dendroscope processes to keep running
+        dendro_path (str): Path to the Dendroscope executable
+        output_directory (Path): The run's output directory, whose tmp and
+            logs directories the servers use
+        submit_timeout (float): Seconds a tree may take before its server is
+            considered wedged
+    """
+
+    def __init__(
+        self,
+        size: int,
+        dendro_path: str,
+        output_directory: Path,
+        submit_timeout: Optional[float] = None,
+    ):
+        self.servers = [
+            DendroServer(
+                dendro_path,
+                output_directory / "tmp" / f"server{server_id}",
+                output_directory / "logs" / f"server{server_id}.dendro.log",
+                submit_timeout or SUBMIT_TIMEOUT_SECONDS,
+            )
+            for server_id in range(size)
+        ]
+        self.idle_servers = queue.Queue()
+
+    def __enter__(self):
+        # Start every JVM before waiting on any of them
+        for server in self.servers:
+            server.launch()
+
+        for server in self.servers:
+            server.wait_until_ready()
+            self.idle_servers.put(server)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        for server in self.servers:
+            server.stop()
+
+    def submit(self, command: str, output_files: list) -> int:
+        server = self.idle_servers.get()
+
+        try:
+            return server.submit(command, output_files)
+        finally:
+            self.idle_servers.put(server)
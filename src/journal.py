@@ -0,0 +1,160 @@
+# An append-only record of each tree's progress through a process-dir run, so
+# a run that dies part way (node preemption, a Dendroscope crash taking the
+# session down) can be picked up with --resume instead of started over.
+#
+# The journal lives in output_directory/tmp, one JSON object per line:
+#     {"event": "started", "cap_id": "CAP336", "tree": "CAP336_NEF.nwk", "time": ...}
+#     {"event": "finished", ..., "fingerprint": {...}}
+#     {"event": "failed", ..., "reason": "Dendroscope exited with code 1"}
+# Every line goes out in a single append and is fsynced before anything else is
+# recorded, so a crash can at most tear the line being written. A torn line is
+# skipped when the journal is read back, and a resumed run starts a new line
+# after it.
+#
+# The manifest is only written once a run completes. The fingerprint of each
+# finished tree is kept in the journal, so the trees a crashed run got through
+# are recognised as up to date and added to the manifest by the resumed run.
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+
+STARTED = "started"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+def get_journal_path(output_directory: Path, shard_name: Optional[str] = None) -> Path:
+    if shard_name is not None:
+        return output_directory / "tmp" / f"journal.{shard_name}.jsonl"
+
+    return output_directory / "tmp" / JOURNAL_FILE_NAME
+
+
+def load_journal(output_directory: Path, shard_name: Optional[str] = None) -> dict:
+    # The last event of each tree, keyed by tree file name
+    journal_path = get_journal_path(output_directory, shard_name)
+    last_events = {}
+
+    if not journal_path.exists():
+        return last_events
+
+    with open(journal_path, "rb") as journal_fh:
+        for line in journal_fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+
+            if isinstance(entry, dict) and "tree" in entry:
+                last_events[entry["tree"]] = entry
+
+    return last_events
+
+
+def get_finished_fingerprints(output_directory: Path, shard_name: Optional[str] = None) -> dict:
+    return {
+        tree_name: entry.get("fingerprint")
+        for tree_name, entry in load_journal(output_directory, shard_name).items()
+        if entry["event"] == FINISHED
+    }
+
+
+class Journal:
+    """
+    The journal of a process-dir run, safe to record to from several threads.
+
+    Args:
+        output_directory (Path): The run's output directory
+        fingerprints (dict): Manifest fingerprints of the run's trees, keyed by
+            tree file, recorded with each finished tree
+        resume (bool): Append to the existing journal rather than starting a
+            new one
+        shard_name (str): The shard of a sharded run, which has a journal of
+            its own
+    """
+
+    def __init__(
+        self,
+        output_directory: Path,
+        fingerprints: dict,
+        resume: bool = False,
+        shard_name: Optional[str] = None,
+    ):
+        self.path = get_journal_path(output_directory, shard_name)
+        self.fingerprints = fingerprints
+        self.lock = threading.Lock()
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | (0 if resume else os.O_TRUNC)
+        self.fd = os.open(self.path, flags, 0o644)
+
+        # Make sure the journal itself survives a crash, not just its contents
+        directory_fd = os.open(self.path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+        if resume and not self.ends_with_newline():
+            self.write(b"\n")
+
+    def ends_with_newline(self) -> bool:
+        if self.path.stat().st_size == 0:
+            return True
+
+        with open(self.path, "rb") as journal_fh:
+            journal_fh.seek(-1, os.SEEK_END)
+            return journal_fh.read(1) == b"\n"
+
+    def write(self, data: bytes):
+        with self.lock:
+            while data:
+                data = data[os.write(self.fd, data) :]
+            os.fsync(self.fd)
+
+    def record(self, event: str, tree_file: Path, cap_id: str, **fields):
+        entry = {
+            "event": event,
+            "cap_id": cap_id,
+            "tree": tree_file.name,
+            "time": round(time.time(), 3),
+            **fields,
+        }
+        self.write((json.dumps(entry) + "\n").encode("utf-8"))
+
+    def started(self, trees: list):
+        for tree_file, cap_id, _, _ in trees:
+            self.record(STARTED, tree_file, cap_id)
+
+    def finished(self, trees: list, failures: list):
+        """
+        Record how each of a job's trees ended.
+
+        Args:
+            trees (list): The job's (tree file, CAP id, patient dict, LeafIndex)
+                tuples
+            failures (list): (tree file, reason) tuples of the trees that failed
+        """
+        reasons = {str(tree_file): reason for tree_file, reason in failures}
+
+        for tree_file, cap_id, _, _ in trees:
+            if str(tree_file) in reasons:
+                self.record(FAILED, tree_file, cap_id, reason=reasons[str(tree_file)])
+            else:
+                self.record(
+                    FINISHED, tree_file, cap_id, fingerprint=self.fingerprints.get(tree_file)
+                )
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,38 @@
+# Defers importing a module until one of its attributes is first used.
+#
+# Most invocations of main.py only need part of what it imports: --help and
+# a bad argument need typer and nothing else, and numpy, asyncio and the XML
+# writer are only needed by the commands that use them. Their import time is
+# a sizeable share of a short process-file job, so main.py binds them to
+# LazyModule proxies rather than importing them up front.
+#
+# importlib.util.LazyLoader does the same thing, but before Python 3.12 two
+# threads touching the module at once can see it half initialised. The proxy
+# goes through importlib.import_module instead, which holds the import lock.
+
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """
+    A stand-in for a module that imports it on first attribute access.
+
+    Args:
+        name (str): The module's name, as given to import
+    """
+
+    def __init__(self, name: str):
+        if importlib.util.find_spec(name) is None:
+            raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attribute: str):
+        if "_module" not in self.__dict__:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+
+        return getattr(self._module, attribute)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}>"
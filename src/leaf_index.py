@@ -0,0 +1,182 @@
+# A columnar index of the fields in a tree's leaf labels.
+#
+# Leaf labels follow the naming scheme
+#     CAP336_4210_138WPI_NEF_1_NGS_353_0.001   (an NGS haplotype)
+#     CAP336_xxxx_000WPI_NEF_1_OGV_B-W39       (an OGV sequence, dummy 0 WPI)
+# i.e. CAP, sample id, WPI, gene, replicate, NGS/OGV, then for NGS leaves the
+# read count and frequency. Each label is split once, into one NumPy array per
+# field, so the stages that need to know which WPIs are in a tree can join
+# against the patient's visits with set and array operations instead of
+# splitting every label again.
+#
+# Labels that don't follow the scheme (e.g. a reference like
+# CONSENSUS_C_ENV_2004LANL) get empty fields and a WPI of -1.
+
+from pathlib import Path
+
+import numpy as np
+
+import newick
+
+MISSING_WPI = -1
+MISSING_COUNT = -1
+
+
+def parse_wpi(field: str) -> int:
+    field = field.upper()
+
+    if not field.endswith("WPI"):
+        return MISSING_WPI
+
+    try:
+        return int(field[:-3])
+    except ValueError:
+        return MISSING_WPI
+
+
+def parse_frequency(field: str) -> float:
+    try:
+        return float(field)
+    except ValueError:
+        return np.nan
+
+
+class LeafIndex:
+    """
+    The fields of every leaf label of a tree, as parallel NumPy arrays in leaf
+    order.
+
+    The WPI column, which every stage joins on, is parsed straight away. The
+    other columns are only needed for reporting, so they are parsed together
+    the first time one of them is used.
+
+    Args:
+        leaf_names (list): The leaf labels, in the order they appear in the tree
+    """
+
+    __slots__ = ("names", "wpi", "_columns")
+
+    def __init__(self, leaf_names):
+        self.names = list(leaf_names)
+        self._columns = None
+
+        # Trees have thousands of leaves but only a handful of distinct WPI
+        # fields, so each distinct field is only converted once
+        wpi_fields = {}
+        self.wpi = np.fromiter(
+            (
+                wpi_fields[field]
+                if field in wpi_fields
+                else wpi_fields.setdefault(field, parse_wpi(field))
+                for field in (
+                    parts[2] if len(parts) > 2 else ""
+                    for parts in (name.split("_", 3) for name in self.names)
+                )
+            ),
+            dtype=np.int32,
+            count=len(self.names),
+        )
+
+    def columns(self) -> dict:
+        if self._columns is not None:
+            return self._columns
+
+        rows = [(name.split("_") + [""] * 8)[:8] for name in self.names]
+        caps, samples, _, genes, replicates, kinds, counts, frequencies = (
+            zip(*rows) if rows else ([],) * 8
+        )
+        kinds = np.char.upper(np.array(kinds, dtype=str))
+        is_ngs = kinds == "NGS"
+
+        self._columns = {
+            "cap": np.array(caps, dtype=str),
+            "sample": np.array(samples, dtype=str),
+            "gene": np.array(genes, dtype=str),
+            "replicate": np.array(replicates, dtype=str),
+            "is_ngs": is_ngs,
+            "is_ogv": kinds == "OGV",
+            "count": np.array(
+                [
+                    int(count) if ngs and count.isdigit() else MISSING_COUNT
+                    for count, ngs in zip(counts, is_ngs)
+                ],
+                dtype=np.int32,
+            ),
+            "frequency": np.array(
+                [
+                    parse_frequency(frequency) if ngs else np.nan
+                    for frequency, ngs in zip(frequencies, is_ngs)
+                ],
+                dtype=np.float64,
+            ),
+        }
+
+        return self._columns
+
+    @property
+    def cap(self) -> np.ndarray:
+        return self.columns()["cap"]
+
+    @property
+    def sample(self) -> np.ndarray:
+        return self.columns()["sample"]
+
+    @property
+    def gene(self) -> np.ndarray:
+        return self.columns()["gene"]
+
+    @property
+    def replicate(self) -> np.ndarray:
+        return self.columns()["replicate"]
+
+    @property
+    def is_ngs(self) -> np.ndarray:
+        return self.columns()["is_ngs"]
+
+    @property
+    def is_ogv(self) -> np.ndarray:
+        return self.columns()["is_ogv"]
+
+    @property
+    def count(self) -> np.ndarray:
+        return self.columns()["count"]
+
+    @property
+    def frequency(self) -> np.ndarray:
+        return self.columns()["frequency"]
+
+    @classmethod
+    def from_newick(cls, tree_file: Path) -> "LeafIndex":
+        return cls(newick.iter_leaf_names(tree_file))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def sampled_wpis(self) -> np.ndarray:
+        # The sorted, distinct WPIs of real samples. OGV leaves carry a dummy
+        # 000WPI, which is never a visit
+        return np.unique(self.wpi[self.wpi > 0])
+
+    def visits_in_tree(self, patient_visits: dict) -> dict:
+        """
+        The patient's visits whose WPI appears in at least one leaf.
+
+        Args:
+            patient_visits (dict): The patient's visits, keyed by visit code
+
+        Returns:
+            dict: The visits that have leaves, in their original order
+        """
+        visit_ids = list(patient_visits)
+        visit_wpis = np.fromiter(
+            (patient_visits[visit_id]["WPI"] for visit_id in visit_ids),
+            dtype=np.int64,
+            count=len(visit_ids),
+        )
+        in_tree = np.isin(visit_wpis, self.sampled_wpis())
+
+        return {
+            visit_id: patient_visits[visit_id]
+            for visit_id, keep in zip(visit_ids, in_tree)
+            if keep
+        }
@@ -0,0 +1,128 @@
+# A persistent cache of the parsed and coloured lookup table.
+#
+# Parsing the cohort CSV and assigning colours is cheap once, but adds up when
+# a scheduler launches thousands of single-file jobs against the same table.
+# Each cache entry is a pickle of the result of get_patients_dict, named after:
+#     1) A hash of the lookup file's path, so older entries for the same file
+#        can be found and removed once its contents change
+#     2) A hash of the lookup file's contents and the colouring algorithm
+#        version, so an entry is never served for a table it wasn't built from
+# The cache directory is kept under a size limit by evicting the least recently
+# used entries.
+
+import contextlib
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+from manifest import hash_file
+
+DEFAULT_MAX_CACHE_BYTES = 256 * 2**20
+CACHE_SUFFIX = ".patients.pickle"
+
+
+def get_cache_key(lookup_fp: Path, algorithm_version: int) -> str:
+    return hashlib.sha256(
+        f"{hash_file(lookup_fp)}:{algorithm_version}".encode("utf-8")
+    ).hexdigest()
+
+
+def get_path_key(lookup_fp: Path) -> str:
+    return hashlib.sha256(str(lookup_fp.resolve()).encode("utf-8")).hexdigest()[:16]
+
+
+def evict_entries(cache_dir: Path, max_cache_bytes: int, keep: Path | None = None):
+    entries = []
+
+    for entry in cache_dir.glob(f"*{CACHE_SUFFIX}"):
+        try:
+            entry_stat = entry.stat()
+        except FileNotFoundError:
+            # Another job evicted it first
+            continue
+        entries.append((entry_stat.st_mtime, entry_stat.st_size, entry))
+
+    total_bytes = sum(size for _, size, _ in entries)
+
+    # Oldest access first
+    for _, size, entry in sorted(entries):
+        if total_bytes <= max_cache_bytes:
+            break
+
+        if entry == keep:
+            continue
+
+        entry.unlink(missing_ok=True)
+        total_bytes -= size
+        logging.debug(f"Evicted {entry} from the lookup cache")
+
+
+def load_patients_dict(
+    lookup_fp: Path,
+    cache_dir: Path,
+    build_patients_dict: Callable[[Path], dict],
+    algorithm_version: int,
+    max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+) -> dict:
+    """
+    Load the coloured patients dict for a lookup file from the cache, building
+    and caching it on a miss.
+
+    Args:
+        lookup_fp (Path): Path to the lookup CSV
+        cache_dir (Path): Directory holding the cache entries
+        build_patients_dict (Callable): Builds the patients dict on a cache miss
+        algorithm_version (int): Version of the colouring algorithm
+        max_cache_bytes (int): Size the cache directory is trimmed down to
+
+    Returns:
+        dict: The patients dict, as returned by build_patients_dict
+    """
+    cache_dir.mkdir(exist_ok=True, parents=True)
+
+    path_key = get_path_key(lookup_fp)
+    cache_file = (
+        cache_dir
+        / f"{path_key}-{get_cache_key(lookup_fp, algorithm_version)}{CACHE_SUFFIX}"
+    )
+
+    try:
+        with open(cache_file, "rb") as cache_fh:
+            patients_dict = pickle.load(cache_fh)
+    except FileNotFoundError:
+        pass
+    except (pickle.UnpicklingError, EOFError) as cache_err:
+        logging.warning(f"Ignoring the unreadable lookup cache entry {cache_file}: {cache_err}")
+    else:
+        # Refresh the access time used for eviction. Another job may have
+        # evicted or replaced the entry since it was read, which is fine, the
+        # data is already loaded
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(cache_file)
+        logging.info(f"Loaded the lookup table from the cache {cache_file}")
+        return patients_dict
+
+    patients_dict = build_patients_dict(lookup_fp)
+
+    # Entries for older versions of the same lookup file can never be hit again
+    for stale_entry in cache_dir.glob(f"{path_key}-*{CACHE_SUFFIX}"):
+        if stale_entry != cache_file:
+            stale_entry.unlink(missing_ok=True)
+
+    # Concurrent jobs may build the same entry, so write it under a unique name
+    # and swap it in
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=cache_dir, suffix=".partial", delete=False
+    ) as partial_fh:
+        pickle.dump(patients_dict, partial_fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(partial_fh.name, cache_file)
+    logging.info(f"Cached the lookup table in {cache_file}")
+
+    evict_entries(cache_dir, max_cache_bytes, keep=cache_file)
+
+    return patients_dict
@@ -0,0 +1,283 @@
+# An indexed SQLite copy of the coloured lookup table, so a job can fetch the
+# visits of the one CAP it renders without reading the whole cohort.
+#
+# Colours depend on every visit in the cohort, so the store is compiled from
+# the full CSV once, with the colours already assigned, and then only read.
+# It remembers the size, modification time and hash of the CSV it was built
+# from and the colouring algorithm version, and is rebuilt when either changes.
+# Checking the size and modification time is enough when neither has changed,
+# so opening an up to date store doesn't read the CSV at all.
+#
+# The store also keeps each yearly visit's rank within its year. Rebuilding it
+# incrementally keeps those ranks, so visits added to the CSV don't change the
+# colours of the visits already in it (see assign_colours_incrementally), and
+# reports the CAPs whose colours did change.
+
+import logging
+import os
+import sqlite3
+import tempfile
+from collections.abc import Mapping
+from contextlib import closing
+from pathlib import Path
+
+import process_colours
+from manifest import hash_file
+
+# Bump this whenever the schema changes, so older stores are rebuilt
+STORE_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE visits (
+    cap TEXT NOT NULL,
+    code INTEGER NOT NULL,
+    wpi INTEGER NOT NULL,
+    yoi INTEGER NOT NULL,
+    wpa INTEGER NOT NULL,
+    ypa INTEGER NOT NULL,
+    red INTEGER,
+    green INTEGER,
+    blue INTEGER,
+    rank REAL,
+    PRIMARY KEY (cap, code)
+);
+"""
+
+
+def get_lookup_stat(lookup_fp: Path) -> dict:
+    lookup_stat = lookup_fp.stat()
+
+    return {"lookup_size": str(lookup_stat.st_size), "lookup_mtime": str(lookup_stat.st_mtime_ns)}
+
+
+def read_meta(store_fp: Path) -> dict:
+    try:
+        with closing(sqlite3.connect(f"file:{store_fp}?mode=ro", uri=True)) as connection:
+            return dict(connection.execute("SELECT key, value FROM meta"))
+    except sqlite3.Error:
+        return {}
+
+
+def is_compatible(meta: dict) -> bool:
+    return meta.get("algorithm_version") == str(
+        process_colours.COLOUR_ALGORITHM_VERSION
+    ) and meta.get("store_version") == str(STORE_VERSION)
+
+
+def is_up_to_date(store_fp: Path, lookup_fp: Path) -> bool:
+    if not store_fp.exists():
+        return False
+
+    meta = read_meta(store_fp)
+
+    if not is_compatible(meta):
+        return False
+
+    lookup_stat = get_lookup_stat(lookup_fp)
+
+    if all(meta.get(key) == value for key, value in lookup_stat.items()):
+        return True
+
+    # Touched but maybe not changed, e.g. after a copy
+    return meta.get("lookup_hash") == hash_file(lookup_fp)
+
+
+def read_previous_assignment(store_fp: Path) -> tuple:
+    # The ranks and colours of a compatible store, to colour incrementally from
+    meta = read_meta(store_fp) if store_fp.exists() else {}
+
+    if not is_compatible(meta):
+        return None, None, {}
+
+    previous_ranks = {}
+    previous_colours = {}
+
+    with closing(sqlite3.connect(f"file:{store_fp}?mode=ro", uri=True)) as connection:
+        for cap_id, code, wpi, red, green, blue, rank in connection.execute(
+            "SELECT cap, code, wpi, red, green, blue, rank FROM visits"
+        ):
+            if rank is not None:
+                previous_ranks[(cap_id, code)] = (wpi, rank)
+
+            previous_colours.setdefault(cap_id, {})[code] = (
+                None if red is None else (red, green, blue)
+            )
+
+    return previous_ranks, float(meta["n_minus_one_rank"]), previous_colours
+
+
+def get_changed_caps(patients_dict: dict, previous_colours: dict) -> list:
+    changed_caps = []
+
+    for cap_id, visits in patients_dict.items():
+        colours = {code: visit["colour"] for code, visit in visits.items()}
+
+        if colours != previous_colours.get(cap_id):
+            changed_caps.append(cap_id)
+
+    # CAPs that were dropped from the table altogether
+    changed_caps.extend(sorted(set(previous_colours) - set(patients_dict)))
+
+    return changed_caps
+
+
+def compile_store(lookup_fp: Path, store_fp: Path, incremental: bool = False) -> list:
+    """
+    Build the SQLite store of a lookup file, with its colours assigned.
+
+    Args:
+        lookup_fp (Path): Path to the lookup CSV
+        store_fp (Path): Path of the SQLite store to write
+        incremental (bool): Keep the colours of the visits already in the
+            store at store_fp, rather than recolouring the whole cohort
+
+    Returns:
+        list: The CAPs whose visits or colours differ from the previous store,
+            every CAP if there was none
+    """
+    previous_ranks, n_minus_one_rank, previous_colours = read_previous_assignment(store_fp)
+
+    if not incremental:
+        previous_ranks, n_minus_one_rank = None, None
+
+    patients_dict, ranks, n_minus_one_rank = process_colours.assign_colours_incrementally(
+        process_colours.lookup_to_dict(lookup_fp), previous_ranks, n_minus_one_rank
+    )
+    changed_caps = get_changed_caps(patients_dict, previous_colours)
+    store_fp.parent.mkdir(parents=True, exist_ok=True)
+
+    meta = {
+        "lookup_hash": hash_file(lookup_fp),
+        "algorithm_version": str(process_colours.COLOUR_ALGORITHM_VERSION),
+        "store_version": str(STORE_VERSION),
+        "n_minus_one_rank": repr(n_minus_one_rank),
+        **get_lookup_stat(lookup_fp),
+    }
+
+    # Jobs may be reading the old store, so the new one is built next to it and
+    # swapped in
+    partial_fd, partial_name = tempfile.mkstemp(
+        dir=store_fp.parent, suffix=".sqlite.partial"
+    )
+    os.close(partial_fd)
+
+    with closing(sqlite3.connect(partial_name)) as connection, connection:
+        connection.executescript(SCHEMA)
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        connection.executemany(
+            "INSERT INTO visits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    cap_id,
+                    visit["code"],
+                    visit["WPI"],
+                    visit["YOI"],
+                    visit["WPA"],
+                    visit["YPA"],
+                    *(visit["colour"] or (None, None, None)),
+                    ranks.get((cap_id, visit["code"]), (None, None))[1],
+                )
+                for cap_id, visits in patients_dict.items()
+                for visit in visits.values()
+            ),
+        )
+
+    os.replace(partial_name, store_fp)
+    logging.info(
+        f"Compiled {lookup_fp} into the lookup store {store_fp}, "
+        f"{len(changed_caps)} CAPs changed colour"
+    )
+
+    return changed_caps
+
+
+class LookupStore(Mapping):
+    """
+    A read-only, lazily loaded patients dict backed by a SQLite store. Each
+    CAP's visits are fetched the first time they are looked up, in the same
+    format as get_patients_dict returns them.
+
+    Args:
+        store_fp (Path): Path to the SQLite store
+    """
+
+    def __init__(self, store_fp: Path):
+        self.store_fp = store_fp
+        self.connection = sqlite3.connect(
+            f"file:{store_fp}?mode=ro", uri=True, check_same_thread=False
+        )
+        self.patients = {}
+
+    def __getitem__(self, cap_id: str) -> dict:
+        if cap_id in self.patients:
+            return self.patients[cap_id]
+
+        rows = self.connection.execute(
+            "SELECT code, wpi, yoi, wpa, ypa, red, green, blue FROM visits "
+            "WHERE cap = ? ORDER BY rowid",
+            (cap_id,),
+        ).fetchall()
+
+        if not rows:
+            raise KeyError(cap_id)
+
+        self.patients[cap_id] = {
+            code: {
+                "code": code,
+                "CAP": cap_id,
+                "WPI": wpi,
+                "YOI": yoi,
+                "WPA": wpa,
+                "YPA": ypa,
+                "colour": None if red is None else (red, green, blue),
+            }
+            for code, wpi, yoi, wpa, ypa, red, green, blue in rows
+        }
+
+        return self.patients[cap_id]
+
+    def __contains__(self, cap_id) -> bool:
+        if cap_id in self.patients:
+            return True
+
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM visits WHERE cap = ? LIMIT 1", (cap_id,)
+            ).fetchone()
+            is not None
+        )
+
+    def __iter__(self):
+        for (cap_id,) in self.connection.execute(
+            "SELECT DISTINCT cap FROM visits ORDER BY cap"
+        ):
+            yield cap_id
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(DISTINCT cap) FROM visits").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def open_store(lookup_fp: Path, store_fp: Path, incremental: bool = False) -> LookupStore:
+    """
+    Open the lookup store of a lookup file, compiling it first if it is missing
+    or out of date.
+
+    Args:
+        lookup_fp (Path): Path to the lookup CSV
+        store_fp (Path): Path to the SQLite store
+        incremental (bool): Keep the colours already in an out of date store
+
+    Returns:
+        LookupStore: The store, as a read-only patients dict
+    """
+    if not is_up_to_date(store_fp, lookup_fp):
+        changed_caps = compile_store(lookup_fp, store_fp, incremental)
+
+        for cap_id in changed_caps:
+            logging.info(f"The colours of {cap_id} changed", extra={"patient_id": cap_id})
+
+    return LookupStore(store_fp)
@@ -8,20 +8,48 @@ if sys.prefix == sys.base_prefix:
     sys.exit(1)
 
 try:
-    import dendro_interface as dendroscope
-    import process_colours as preprocessing
+    from lazy_module import LazyModule
+
+    # Only needed by the commands that render, colour or export, and slow to
+    # import, so they are loaded on first use rather than on every invocation
+    dendroscope = LazyModule("dendro_interface")
+    dendro_runner = LazyModule("dendro_runner")
+    dendro_server = LazyModule("dendro_server")
+    preprocessing = LazyModule("process_colours")
+    lookup_cache = LazyModule("lookup_cache")
+    lookup_store = LazyModule("lookup_store")
+    leaf_labels = LazyModule("leaf_index")
+    nexml = LazyModule("nexml")
+    simplify = LazyModule("simplify")
+    render = LazyModule("render")
+    tree_watcher = LazyModule("tree_watcher")
+    render_service = LazyModule("render_service")
+    asyncio = LazyModule("asyncio")
+
+    # The lazy modules need these, so check for them before anything starts
+    for dependency in ("numpy", "colour", "matplotlib"):
+        if importlib.util.find_spec(dependency) is None:
+            raise ModuleNotFoundError(f"No module named {dependency!r}", name=dependency)
+
+    import manifest as incremental
+    import journal as checkpoint
+    import shards
+    import metrics
     from pathlib import Path
-    import colour
     import typer
-    import re
     from typing_extensions import Annotated
-    from typing import Optional
-    import glob
+    from typing import Iterable, Iterator, Optional
     import json
+    import os
     import subprocess
     import logging
-    import shlex
-    from ete3 import Tree
+    import time
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+    from enum import Enum
+    from functools import partial
+    from itertools import islice
+    from contextlib import nullcontext
 
 
 except ImportError as imp_err:
@@ -29,7 +57,10 @@ except ImportError as imp_err:
     print(imp_err)
 
     print(
-        "You are missing some dependencies. You should run 'pip install typer rich typing-extensions colour ete3 matplotlib' before trying again."
+        "You are missing some dependencies. You should run 'pip install typer rich typing-extensions colour matplotlib numpy' before trying again."
+    )
+    print(
+        "inotify_simple is optional: with it installed, the watch command hears about new trees instead of polling for them."
     )
 
     sys.exit(1)
@@ -37,34 +68,112 @@ except ImportError as imp_err:
 
 app = typer.Typer(pretty_exceptions_enable=True)
 DENDRO_PATH = "/home/dlejeune/dendroscope/Dendroscope"
+# How many jobs per worker are taken from the tree directory ahead of the renders
+QUEUED_JOBS_PER_WORKER = 2
+# How long a tree has to go unchanged before watch renders it, and how often
+# watch lists the directory when it can't use inotify
+WATCH_SETTLE_SECONDS = 1.0
+WATCH_POLL_INTERVAL_SECONDS = 2.0
+# Where serve listens by default, only reachable from this machine
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8336
 
 
-def run_dendro_command(
-    cap_id: str, output_directory: Path, dendro_path: str = DENDRO_PATH
+class Backend(str, Enum):
+    dendroscope = "dendroscope"
+    matplotlib = "matplotlib"
+
+
+# A CAP usually has several trees (NEF, ENV, ...), so every file made for a
+# tree is named after the tree rather than the CAP
+def get_output_files(tree_file: Path, output_directory: Path) -> tuple:
+    main_output_file = output_directory / f"{tree_file.stem}.dendrotree.png"
+    linear_output_file = output_directory / f"{tree_file.stem}.linear.dendrotree.png"
+    nexus_output_file = output_directory / f"{tree_file.stem}.dendro_nexus.nexus"
+
+    return main_output_file, linear_output_file, nexus_output_file
+
+
+def get_command_file(tree_file: Path, output_directory: Path) -> Path:
+    return output_directory / "tmp" / f"{tree_file.stem}.dendrocmd.txt"
+
+
+def get_log_file(tree_file: Path, output_directory: Path) -> Path:
+    return output_directory / "logs" / f"{tree_file.stem}.dendro.log"
+
+
+def outputs_exist(tree_file: Path, output_directory: Path, newer_than: float = 0) -> bool:
+    for output_file in get_output_files(tree_file, output_directory):
+        if not output_file.exists() or output_file.stat().st_mtime < newer_than:
+            return False
+
+    return True
+
+
+def run_dendro_command_file(
+    dendro_command_file: Path, error_log_file: Path, dendro_path: str = DENDRO_PATH
 ):
-    dendro_command_file = output_directory / "tmp" / f"CAP{cap_id}.dendrocmd.txt"
-    error_log_file = output_directory / "logs" / f"CAP{cap_id}.dendro.log"
+    command = dendro_runner.get_dendro_args(dendro_command_file, dendro_path)
+    # command = f"xvfb-run --auto-servernum --server-num=1 {dendro_path} +g --commandFile {str(dendro_command_file)} 2>&1 | tee -a {error_log_file}"
+    with open(error_log_file, "a") as error_log:
+        result = subprocess.run(command, stdout=error_log, stderr=subprocess.STDOUT)
+
+    return result.returncode
+
+
+def run_dendro_command(
+    tree_file: Path, output_directory: Path, dendro_path: str = DENDRO_PATH
+) -> int:
+    dendro_command_file = get_command_file(tree_file, output_directory)
+    error_log_file = get_log_file(tree_file, output_directory)
 
     # dendro_path_obj = Path(dendro_path)
 
-    command = f"{dendro_path} -g --commandFile {str(dendro_command_file)}"
-    # command = f"xvfb-run --auto-servernum --server-num=1 {dendro_path} +g --commandFile {str(dendro_command_file)} 2>&1 | tee -a {error_log_file}"
-    subprocess.run(command, shell=True)
+    return run_dendro_command_file(dendro_command_file, error_log_file, dendro_path)
+
+
+def build_tree_command(
+    cap_id: str,
+    tree_fp: Path,
+    patient_dict: dict,
+    output_directory: Path,
+    final_command: str = "quit;",
+    leaf_index: Optional["leaf_labels.LeafIndex"] = None,
+) -> str:
+    main_output_file, linear_output_file, nexus_output_file = get_output_files(
+        tree_fp, output_directory
+    )
+
+    if leaf_index is None:
+        leaf_index = leaf_labels.LeafIndex.from_newick(tree_fp)
+
+    return dendroscope.build_dendro_command(
+        tree_fp,
+        patient_dict,
+        main_output_file,
+        linear_output_file,
+        nexus_output_file,
+        final_command=final_command,
+        leaf_index=leaf_index,
+        styling_command=dendroscope.STYLE_MEMO.styling_command(
+            cap_id, patient_dict, leaf_index
+        ),
+    )
 
 
 def construct_dendro_command(
-    cap_id: str, tree_fp: Path, patient_dict: dict, output_directory: Path
+    cap_id: str,
+    tree_fp: Path,
+    patient_dict: dict,
+    output_directory: Path,
+    leaf_index: Optional["leaf_labels.LeafIndex"] = None,
 ):
-    main_output_file = output_directory / f"CAP{cap_id}.dendrotree.png"
-    linear_output_file = output_directory / f"CAP{cap_id}.linear.dendrotree.png"
-    nexus_output_file = output_directory / f"CAP{cap_id}.dendro_nexus.nexus"
-
     logging.info("Building the dendroscope command", extra={"patient_id": cap_id})
-    dendro_command = dendroscope.build_dendro_command(
-        tree_fp, patient_dict, main_output_file, linear_output_file, nexus_output_file
+    dendro_command = build_tree_command(
+        cap_id, tree_fp, patient_dict, output_directory, leaf_index=leaf_index
     )
 
-    dendro_out_cmd_file = output_directory / "tmp" / f"CAP{cap_id}.dendrocmd.txt"
+    dendro_out_cmd_file = get_command_file(tree_fp, output_directory)
 
     with open(dendro_out_cmd_file, "w") as output_file:
         output_file.write(dendro_command)
@@ -75,13 +184,74 @@ def construct_dendro_command(
     )
 
 
-def get_patients_dict(lookup_fp: Path) -> dict:
+def construct_dendro_batch_command(
+    batch_id: int,
+    batch: list,
+    output_directory: Path,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+) -> Path:
+    tree_commands = []
+
+    for tree_file, cap_id, patient_dict, leaf_index in batch:
+        tree_file, patient_dict, leaf_index = prepare_tree(
+            tree_file,
+            cap_id,
+            patient_dict,
+            output_directory,
+            simplify_options=simplify_options,
+            leaf_index=leaf_index,
+        )
+
+        tree_commands.append(
+            build_tree_command(
+                cap_id,
+                tree_file,
+                patient_dict,
+                output_directory,
+                final_command="close;",
+                leaf_index=leaf_index,
+            )
+        )
+
+    dendro_out_cmd_file = output_directory / "tmp" / f"batch{batch_id}.dendrocmd.txt"
+
+    with open(dendro_out_cmd_file, "w") as output_file:
+        output_file.write(dendroscope.build_dendro_batch_command(tree_commands))
+
+    logging.info(f"Wrote the batch {batch_id} dendroscope command to {dendro_out_cmd_file}")
+
+    return dendro_out_cmd_file
+
+
+def build_patients_dict(lookup_fp: Path) -> dict:
     patients_dict = preprocessing.lookup_to_dict(lookup_fp)
-    patients_dict = preprocessing.assign_colours_to_patients(patients_dict)
+    patients_dict = preprocessing.assign_colours_to_patients_vectorized(patients_dict)
 
     return patients_dict
 
 
+def get_patients_dict(
+    lookup_fp: Path,
+    cache_dir: Optional[Path] = None,
+    store_fp: Optional[Path] = None,
+    incremental_colours: bool = False,
+) -> dict:
+    # The store is read one CAP at a time, so it takes precedence over loading
+    # the whole table from the cache
+    if store_fp is not None:
+        return lookup_store.open_store(lookup_fp, store_fp, incremental_colours)
+
+    if cache_dir is None:
+        return build_patients_dict(lookup_fp)
+
+    return lookup_cache.load_patients_dict(
+        lookup_fp,
+        cache_dir,
+        build_patients_dict,
+        preprocessing.COLOUR_ALGORITHM_VERSION,
+    )
+
+
 def do_setup(output_directory: Path):
     temp_dir: Path = output_directory / "tmp"
     temp_dir.mkdir(exist_ok=True, parents=True)
@@ -91,25 +261,90 @@ def do_setup(output_directory: Path):
     log_dir.mkdir(exist_ok=True, parents=True)
 
 
-def optimise_patient_dict(patient_dict: dict, tree_file: Path) -> dict:
+def optimise_patient_dict(
+    patient_dict: dict,
+    tree_file: Path,
+    leaf_index: Optional["leaf_labels.LeafIndex"] = None,
+    cap_id: Optional[str] = None,
+) -> dict:
 
-    tree_obj = Tree(str(tree_file))
+    # Only the leaf labels are needed here, so there is no point building a tree
+    if leaf_index is None:
+        leaf_index = leaf_labels.LeafIndex.from_newick(tree_file)
 
-    wpis_in_tree = []
+    if cap_id is None:
+        return leaf_index.visits_in_tree(patient_dict)
 
-    new_dict = dict(patient_dict)
+    return dendroscope.STYLE_MEMO.visits_in_tree(cap_id, patient_dict, leaf_index)
 
-    for leaf in tree_obj.get_tree_root().get_leaves():
-        leaf_wpi = int(leaf.name.split("_")[2].replace("WPI", ""))
 
-        if leaf_wpi and (leaf_wpi not in wpis_in_tree) and (leaf_wpi != 0):
-            wpis_in_tree.append(leaf_wpi)
+def parse_tree(
+    tree_file: Path, cap_id: str, metrics_file: Optional[Path] = None
+) -> "leaf_labels.LeafIndex":
+    with metrics.timed(
+        metrics_file, "parse", cap_id=cap_id, tree=tree_file.name
+    ) as parse_metric:
+        leaf_index = leaf_labels.LeafIndex.from_newick(tree_file)
+        parse_metric["leaves"] = len(leaf_index)
 
-    for visit_id, visit in patient_dict.items():
-        if visit["WPI"] not in wpis_in_tree:
-            new_dict.pop(visit_id)
+    return leaf_index
 
-    return new_dict
+
+def prepare_tree(
+    tree_file: Path,
+    cap_id: str,
+    patient_dict: dict,
+    output_directory: Path,
+    metrics_file: Optional[Path] = None,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+    leaf_index: Optional["leaf_labels.LeafIndex"] = None,
+) -> tuple:
+    """
+    Parse a tree's leaves and narrow the patient's visits down to the ones in
+    it, simplifying the tree first if simplify_options asks for it.
+
+    A tree that went through the manifest check was parsed and had its visits
+    narrowed there already, so its leaf_index is passed in and neither is done
+    again.
+
+    Args:
+        tree_file (Path): Path to the Newick file
+        cap_id (str): The patient's CAP id
+        patient_dict (dict): The patient's visits, keyed by visit code
+        output_directory (Path): The run's output directory
+        metrics_file (Path): The run's metrics file, or None to record nothing
+        simplify_options (SimplifyOptions): Reductions to apply before rendering
+        leaf_index (LeafIndex): The tree's leaves when they were parsed already,
+            in which case patient_dict only holds the visits in the tree
+
+    Returns:
+        tuple: The tree file to render, the visits in it and its LeafIndex
+    """
+    if leaf_index is None:
+        leaf_index = parse_tree(tree_file, cap_id, metrics_file)
+
+        with metrics.timed(metrics_file, "optimise", cap_id=cap_id, tree=tree_file.name):
+            patient_dict = optimise_patient_dict(patient_dict, tree_file, leaf_index, cap_id)
+
+    if simplify_options is None or not simplify_options.is_enabled():
+        return tree_file, patient_dict, leaf_index
+
+    with metrics.timed(
+        metrics_file, "simplify", cap_id=cap_id, tree=tree_file.name
+    ) as simplify_metric:
+        tree_file, leaf_index, report = simplify.write_simplified_tree(
+            tree_file, output_directory, simplify_options
+        )
+        simplify_metric["leaves"] = len(leaf_index)
+
+    logging.info(
+        f"Simplified {report['tree']} from {report['leaves']} to {len(leaf_index)} leaves, "
+        f"dropping {len(report['dropped'])} and collapsing {len(report['collapsed'])} clades",
+        extra={"patient_id": cap_id},
+    )
+
+    # Visits whose haplotypes were all dropped have nothing left to style
+    return tree_file, leaf_index.visits_in_tree(patient_dict), leaf_index
 
 
 def workflow(
@@ -120,17 +355,839 @@ def workflow(
     create_separate_output_folders: bool = False,
     create_intermediary_files: bool = False,
     dendro_path: str = DENDRO_PATH,
-):
+    backend: str = Backend.dendroscope,
+    metrics_file: Optional[Path] = None,
+    server: Optional["dendro_server.DendroServerPool"] = None,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+    leaf_index: Optional["leaf_labels.LeafIndex"] = None,
+) -> int:
+
+    with metrics.timed(
+        metrics_file, metrics.TREE_STAGE, cap_id=cap_id, tree=tree_file.name
+    ) as tree_metric:
+        render_tree_file, patient_dict, leaf_index = prepare_tree(
+            tree_file,
+            cap_id,
+            patient_dict,
+            output_directory,
+            metrics_file,
+            simplify_options,
+            leaf_index,
+        )
+        tree_metric["leaves"] = len(leaf_index)
+
+        exit_code = render_patient_tree(
+            render_tree_file,
+            cap_id,
+            patient_dict,
+            output_directory,
+            leaf_index,
+            dendro_path,
+            backend,
+            metrics_file,
+            server,
+        )
+        tree_metric["exit_code"] = exit_code
+
+    logging.info(f"Finished with patient {cap_id}", extra={"patient_id": cap_id})
+
+    return exit_code
+
+
+def render_patient_tree(
+    tree_file: Path,
+    cap_id: str,
+    patient_dict: dict,
+    output_directory: Path,
+    leaf_index: "leaf_labels.LeafIndex",
+    dendro_path: str = DENDRO_PATH,
+    backend: str = Backend.dendroscope,
+    metrics_file: Optional[Path] = None,
+    server: Optional["dendro_server.DendroServerPool"] = None,
+) -> int:
+    if backend == Backend.matplotlib:
+        main_output_file, linear_output_file, nexus_output_file = get_output_files(
+            tree_file, output_directory
+        )
+
+        logging.info(f"Rendering {tree_file} natively", extra={"patient_id": cap_id})
+        with metrics.timed(metrics_file, "render", cap_id=cap_id, tree=tree_file.name):
+            render.render_tree(
+                tree_file, patient_dict, main_output_file, linear_output_file
+            )
+        with metrics.timed(metrics_file, "nexml", cap_id=cap_id, tree=tree_file.name):
+            nexml.export_nexml(tree_file, patient_dict, nexus_output_file)
 
-    patient_dict = optimise_patient_dict(patient_dict, tree_file)
+        return 0
+
+    if server is not None:
+        return submit_to_server(
+            tree_file, cap_id, patient_dict, output_directory, leaf_index, server, metrics_file
+        )
 
     logging.info("Starting the dendro build command", extra={"patient_id": cap_id})
-    construct_dendro_command(cap_id, tree_file, patient_dict, output_directory)
+    with metrics.timed(metrics_file, "build_command", cap_id=cap_id, tree=tree_file.name):
+        construct_dendro_command(
+            cap_id, tree_file, patient_dict, output_directory, leaf_index
+        )
 
     logging.info(f"Running dendroscope for {cap_id}", extra={"patient_id": cap_id})
-    run_dendro_command(cap_id, output_directory, dendro_path)
+    with metrics.timed(
+        metrics_file, "dendroscope", cap_id=cap_id, tree=tree_file.name
+    ) as dendro_metric:
+        exit_code = run_dendro_command(tree_file, output_directory, dendro_path)
+        dendro_metric["exit_code"] = exit_code
 
-    logging.info(f"Finished with patient {cap_id}", extra={"patient_id": cap_id})
+    if exit_code != 0:
+        logging.error(
+            f"Dendroscope exited with code {exit_code} for {tree_file}",
+            extra={"patient_id": cap_id},
+        )
+
+    return exit_code
+
+
+def submit_to_server(
+    tree_file: Path,
+    cap_id: str,
+    patient_dict: dict,
+    output_directory: Path,
+    leaf_index: "leaf_labels.LeafIndex",
+    server: "dendro_server.DendroServerPool",
+    metrics_file: Optional[Path] = None,
+) -> int:
+    with metrics.timed(metrics_file, "build_command", cap_id=cap_id, tree=tree_file.name):
+        dendro_command = build_tree_command(
+            cap_id,
+            tree_file,
+            patient_dict,
+            output_directory,
+            final_command="close;",
+            leaf_index=leaf_index,
+        )
+
+    logging.info(f"Submitting {tree_file} to a Dendroscope server", extra={"patient_id": cap_id})
+    with metrics.timed(
+        metrics_file, "dendroscope", cap_id=cap_id, tree=tree_file.name
+    ) as dendro_metric:
+        exit_code = server.submit(
+            dendro_command, list(get_output_files(tree_file, output_directory))
+        )
+        dendro_metric["exit_code"] = exit_code
+
+    if exit_code != 0:
+        logging.error(
+            f"{dendro_runner.describe_exit_code(exit_code)} on the server for {tree_file}",
+            extra={"patient_id": cap_id},
+        )
+
+    return exit_code
+
+
+def cap_workflow(
+    trees: list,
+    output_directory: Path,
+    dendro_path: str = DENDRO_PATH,
+    backend: str = Backend.dendroscope,
+    metrics_file: Optional[Path] = None,
+    server: Optional["dendro_server.DendroServerPool"] = None,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+) -> list:
+    failures = []
+
+    for tree_file, cap_id, patient_dict, leaf_index in trees:
+        exit_code = workflow(
+            tree_file,
+            cap_id,
+            patient_dict,
+            output_directory,
+            dendro_path=dendro_path,
+            backend=backend,
+            metrics_file=metrics_file,
+            server=server,
+            simplify_options=simplify_options,
+            leaf_index=leaf_index,
+        )
+
+        if exit_code != 0:
+            failures.append((tree_file, f"Dendroscope exited with code {exit_code}"))
+
+    return failures
+
+
+def batch_workflow(
+    batch_id: int,
+    batch: list,
+    output_directory: Path,
+    dendro_path: str = DENDRO_PATH,
+    metrics_file: Optional[Path] = None,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+) -> list:
+    """
+    Render a batch of trees in a single Dendroscope session.
+
+    Any tree whose outputs were not written by the batched session is re-run on
+    its own with `workflow`, so one bad tree does not cost the whole batch.
+
+    The trees the session rendered are each recorded as a tree stage, with a
+    share of the batch's time in proportion to their leaves, so the slowest
+    CAPs of a batched run can be ranked like those of any other.
+
+    Args:
+        batch_id (int): Number used to name the batch command and log files
+        batch (list): List of (tree file, CAP id, patient dict, LeafIndex)
+            tuples
+        output_directory (Path): Directory the images and NeXML files go to
+        dendro_path (str): Path to the Dendroscope executable
+        metrics_file (Path): The run's metrics file, or None to record nothing
+        simplify_options (SimplifyOptions): Reductions to apply before rendering
+
+    Returns:
+        list: (tree file, reason) tuples for the trees that failed on their own
+    """
+    batch_start = time.time()
+    batch_timer = time.perf_counter()
+    failures = []
+
+    logging.info(f"Starting batch {batch_id} with {len(batch)} trees")
+    with metrics.timed(metrics_file, "build_batch_command", batch=batch_id, trees=len(batch)):
+        dendro_command_file = construct_dendro_batch_command(
+            batch_id, batch, output_directory, simplify_options
+        )
+
+    with metrics.timed(
+        metrics_file, "dendroscope_batch", batch=batch_id, trees=len(batch)
+    ) as dendro_metric:
+        dendro_metric["exit_code"] = run_dendro_command_file(
+            dendro_command_file,
+            output_directory / "logs" / f"batch{batch_id}.dendro.log",
+            dendro_path,
+        )
+
+    batch_duration = time.perf_counter() - batch_timer
+    batch_leaves = {
+        tree_file: len(leaf_index) if leaf_index is not None else 1
+        for tree_file, _, _, leaf_index in batch
+    }
+
+    for tree_file, cap_id, patient_dict, leaf_index in batch:
+        if outputs_exist(tree_file, output_directory, newer_than=batch_start):
+            metrics.record(
+                metrics_file,
+                metrics.TREE_STAGE,
+                batch_duration * batch_leaves[tree_file] / sum(batch_leaves.values()),
+                cap_id=cap_id,
+                tree=tree_file.name,
+                batch=batch_id,
+                leaves=batch_leaves[tree_file],
+                exit_code=0,
+            )
+            logging.info(f"Finished with patient {cap_id}", extra={"patient_id": cap_id})
+            continue
+
+        logging.warning(
+            f"Batch {batch_id} did not produce the outputs for {tree_file}, re-running it on its own",
+            extra={"patient_id": cap_id},
+        )
+        failures.extend(
+            cap_workflow(
+                [(tree_file, cap_id, patient_dict, leaf_index)],
+                output_directory,
+                dendro_path,
+                metrics_file=metrics_file,
+                simplify_options=simplify_options,
+            )
+        )
+
+    return failures
+
+
+async def async_cap_workflow(
+    trees: list,
+    output_directory: Path,
+    semaphore: "asyncio.Semaphore",
+    dendro_path: str = DENDRO_PATH,
+    timeout: Optional[float] = None,
+    metrics_file: Optional[Path] = None,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+) -> list:
+    # Only the Dendroscope runs count against the semaphore, the commands are
+    # built in a thread so they don't hold up the event loop
+    failures = []
+
+    for tree_file, cap_id, patient_dict, leaf_index in trees:
+        tree_start = time.perf_counter()
+        render_tree_file, patient_dict, leaf_index = await asyncio.to_thread(
+            prepare_tree,
+            tree_file,
+            cap_id,
+            patient_dict,
+            output_directory,
+            metrics_file,
+            simplify_options,
+            leaf_index,
+        )
+
+        with metrics.timed(metrics_file, "build_command", cap_id=cap_id, tree=tree_file.name):
+            await asyncio.to_thread(
+                construct_dendro_command,
+                cap_id,
+                render_tree_file,
+                patient_dict,
+                output_directory,
+                leaf_index,
+            )
+
+        async with semaphore:
+            logging.info(f"Running dendroscope for {cap_id}", extra={"patient_id": cap_id})
+
+            with metrics.timed(
+                metrics_file, "dendroscope", cap_id=cap_id, tree=tree_file.name
+            ) as dendro_metric:
+                exit_code = await dendro_runner.run_dendro_command_file(
+                    get_command_file(render_tree_file, output_directory),
+                    get_log_file(render_tree_file, output_directory),
+                    dendro_path,
+                    timeout,
+                )
+                dendro_metric["exit_code"] = exit_code
+
+        metrics.record(
+            metrics_file,
+            metrics.TREE_STAGE,
+            time.perf_counter() - tree_start,
+            cap_id=cap_id,
+            tree=tree_file.name,
+            leaves=len(leaf_index),
+            exit_code=exit_code,
+        )
+
+        if exit_code != 0:
+            reason = dendro_runner.describe_exit_code(exit_code, timeout)
+            logging.error(f"{reason} for {tree_file}", extra={"patient_id": cap_id})
+            failures.append((tree_file, reason))
+            continue
+
+        logging.info(f"Finished with patient {cap_id}", extra={"patient_id": cap_id})
+
+    return failures
+
+
+async def run_async_jobs(
+    trees: Iterable,
+    output_directory: Path,
+    workers: int = 1,
+    dendro_path: str = DENDRO_PATH,
+    timeout: Optional[float] = None,
+    metrics_file: Optional[Path] = None,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+    run_journal: Optional[checkpoint.Journal] = None,
+) -> list:
+    """
+    Render trees with asyncio, running at most `workers` Dendroscope processes
+    at a time. Trees are taken from `trees` as they come, so rendering starts
+    before the whole directory has been listed and checked.
+
+    Args:
+        trees (Iterable): (tree file, CAP id, patient dict, LeafIndex) tuples
+        output_directory (Path): Directory the images and NeXML files go to
+        workers (int): Number of Dendroscope processes to run at the same time
+        dendro_path (str): Path to the Dendroscope executable
+        timeout (float): Seconds after which a Dendroscope run is killed
+        metrics_file (Path): The run's metrics file, or None to record nothing
+        simplify_options (SimplifyOptions): Reductions to apply before rendering
+        run_journal (Journal): The run's journal, or None to record nothing
+
+    Returns:
+        list: (tree file, reason) tuples for every failure
+    """
+    semaphore = asyncio.Semaphore(max(workers, 1))
+    # Bounds how far ahead of the renders the listing and checking gets
+    lookahead = asyncio.Semaphore(QUEUED_JOBS_PER_WORKER * max(workers, 1))
+
+    async def render_tree(tree: tuple) -> list:
+        try:
+            if run_journal is not None:
+                await asyncio.to_thread(run_journal.started, [tree])
+
+            try:
+                tree_failures = await async_cap_workflow(
+                    [tree],
+                    output_directory,
+                    semaphore,
+                    dendro_path,
+                    timeout,
+                    metrics_file,
+                    simplify_options,
+                )
+            except Exception as tree_err:
+                tree_failures = [(tree[0], repr(tree_err))]
+
+            if run_journal is not None:
+                await asyncio.to_thread(run_journal.finished, [tree], tree_failures)
+
+            return tree_failures
+        finally:
+            lookahead.release()
+
+    tasks = []
+    tree_iterator = iter(trees)
+
+    while True:
+        await lookahead.acquire()
+        # Checking a tree parses it, so it is done off the event loop
+        tree = await asyncio.to_thread(next, tree_iterator, None)
+
+        if tree is None:
+            break
+
+        tasks.append(asyncio.create_task(render_tree(tree)))
+
+    failures = []
+
+    for tree_failures in await asyncio.gather(*tasks):
+        failures.extend(tree_failures)
+
+    return failures
+
+
+def run_jobs(
+    jobs: Iterable,
+    workers: int = 1,
+    use_processes: bool = False,
+    run_journal: Optional[checkpoint.Journal] = None,
+) -> list:
+    """
+    Run independent rendering jobs, in parallel when more than one worker is
+    requested.
+
+    Jobs are taken from `jobs` as workers free up, so they can be produced
+    while the first ones run. Jobs that share a key are run one after the
+    other, in the order they came in.
+
+    Args:
+        jobs (Iterable): (key, trees, callable) tuples. Each callable renders
+            its (tree file, CAP id, patient dict, LeafIndex) trees and returns
+            a list of (tree file, reason) failures
+        workers (int): Number of jobs to run at the same time
+        use_processes (bool): Run the jobs in worker processes rather than
+            threads, for jobs that do their work in Python
+        run_journal (Journal): The run's journal, or None to record nothing
+
+    Returns:
+        list: (tree file, reason) tuples for every failure across all jobs
+    """
+    failures = []
+
+    def job_started(trees: list):
+        if run_journal is not None:
+            run_journal.started(trees)
+
+    def job_done(key: str, trees: list, job_failures: list):
+        failures.extend(job_failures)
+
+        if run_journal is not None:
+            run_journal.finished(trees, job_failures)
+
+    def get_job_failures(key: str, trees: list, job_err: Exception) -> list:
+        # Whatever the job got through, none of it can be trusted
+        return [(tree_file, repr(job_err)) for tree_file, _, _, _ in trees] or [
+            (key, repr(job_err))
+        ]
+
+    if workers <= 1:
+        for key, trees, job in jobs:
+            job_started(trees)
+
+            try:
+                job_failures = job()
+            except Exception as job_err:
+                job_failures = get_job_failures(key, trees, job_err)
+
+            job_done(key, trees, job_failures)
+
+        return failures
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    max_queued = QUEUED_JOBS_PER_WORKER * workers
+    # Jobs waiting for an earlier job with the same key, keyed by key
+    waiting = {}
+    running = {}
+    queued = 0
+    jobs = iter(jobs)
+    jobs_left = True
+
+    with executor_class(max_workers=workers) as executor:
+
+        def submit(key: str, trees: list, job):
+            job_started(trees)
+            running[executor.submit(job)] = (key, trees)
+
+        while True:
+            while jobs_left and queued < max_queued:
+                next_job = next(jobs, None)
+
+                if next_job is None:
+                    jobs_left = False
+                    break
+
+                key, trees, job = next_job
+                queued += 1
+
+                if key in waiting:
+                    waiting[key].append((trees, job))
+                else:
+                    waiting[key] = deque()
+                    submit(key, trees, job)
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                key, trees = running.pop(future)
+                queued -= 1
+
+                try:
+                    job_failures = future.result()
+                except Exception as job_err:
+                    job_failures = get_job_failures(key, trees, job_err)
+
+                job_done(key, trees, job_failures)
+
+                if waiting[key]:
+                    submit(key, *waiting[key].popleft())
+                else:
+                    del waiting[key]
+
+    return failures
+
+
+def report_failures(failures: list):
+    if not failures:
+        logging.info("All trees were rendered successfully")
+        return
+
+    logging.error(f"{len(failures)} trees failed to render")
+
+    for tree_file, reason in failures:
+        logging.error(f"{tree_file}: {reason}")
+
+
+def check_tree_directory(tree_directory: Path):
+    # The trees are listed lazily, once the output directories exist, so a
+    # wrong path is caught before anything is set up
+    if not tree_directory.is_dir():
+        raise typer.BadParameter(f"--tree-directory {tree_directory} is not a directory")
+
+
+def iter_tree_files(tree_directory: Path) -> Iterator[Path]:
+    # Path.glob lists the whole directory before returning the first match,
+    # os.scandir hands the entries over as it reads them
+    with os.scandir(tree_directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".nwk") and entry.is_file():
+                yield Path(entry.path)
+
+
+def iter_patient_trees(tree_files: Iterable, patients_dict: dict) -> Iterator[tuple]:
+    # The trees are parsed by the manifest check, so they have no LeafIndex yet
+    for file in tree_files:
+        file_cap_id = file.stem.split("_")[0]
+
+        if file_cap_id in patients_dict:
+            yield file, file_cap_id, patients_dict[file_cap_id], None
+        else:
+            logging.error(
+                f"Failed to find the CAP_ID {file_cap_id} in the provided lookup table"
+            )
+
+
+def iter_batches(trees: Iterable, batch_size: int) -> Iterator[list]:
+    trees = iter(trees)
+
+    while batch := list(islice(trees, batch_size)):
+        yield batch
+
+
+def iter_trees_to_render(
+    trees: Iterable,
+    output_directory: Path,
+    fingerprints: dict,
+    carried_over: dict,
+    skipped: list,
+    force: bool = False,
+    backend: str = Backend.dendroscope,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+    finished: Optional[dict] = None,
+    metrics_file: Optional[Path] = None,
+    shard_name: Optional[str] = None,
+) -> Iterator[tuple]:
+    """
+    Pass on the trees whose outputs are not up to date according to the
+    manifest, or, when resuming, to the journal of the interrupted run.
+
+    Checking a tree means parsing it and narrowing its patient's visits down
+    to the ones in it, so the trees are passed on with their LeafIndex and
+    narrowed visits for rendering to start from.
+
+    Args:
+        trees (Iterable): (tree file, CAP id, patient dict, LeafIndex) tuples
+        output_directory (Path): Directory holding the outputs and the manifest
+        fingerprints (dict): Filled in with the fingerprints of the trees that
+            are passed on, keyed by tree file
+        carried_over (dict): Filled in with the fingerprints of the trees the
+            interrupted run finished, keyed by tree file
+        skipped (list): Filled in with the tree files that were up to date
+        force (bool): Ignore the manifest
+        backend (str): Renderer the trees will be drawn with
+        simplify_options (SimplifyOptions): Reductions the trees will get
+            before rendering
+        finished (dict): Fingerprints of the trees the interrupted run
+            finished, keyed by tree file name, or None when not resuming
+        metrics_file (Path): The run's metrics file, or None to record nothing
+        shard_name (str): The shard of a sharded run, whose own manifest is used
+
+    Returns:
+        Iterator[tuple]: The (tree file, CAP id, visits in the tree, LeafIndex)
+            tuples of the trees that need rendering
+    """
+    manifest = incremental.load_manifest(output_directory, shard_name)
+    simplification = (
+        simplify_options.describe()
+        if simplify_options is not None and simplify_options.is_enabled()
+        else None
+    )
+
+    for tree_file, cap_id, patient_dict, leaf_index in trees:
+        if leaf_index is None:
+            leaf_index = parse_tree(tree_file, cap_id, metrics_file)
+
+        with metrics.timed(metrics_file, "manifest_check", cap_id=cap_id, tree=tree_file.name):
+            visits = optimise_patient_dict(patient_dict, tree_file, leaf_index, cap_id)
+            dendro_command = build_tree_command(
+                cap_id, tree_file, visits, output_directory, leaf_index=leaf_index
+            )
+            fingerprint = incremental.tree_fingerprint(
+                tree_file,
+                cap_id,
+                patient_dict,
+                dendro_command,
+                Backend(backend).value,
+                simplification,
+            )
+            output_files = get_output_files(tree_file, output_directory)
+
+        if not force and incremental.is_up_to_date(
+            manifest, tree_file, fingerprint, output_files
+        ):
+            logging.info(
+                f"Skipping {tree_file}, its outputs are up to date",
+                extra={"patient_id": cap_id},
+            )
+            skipped.append(tree_file)
+            continue
+
+        if finished is not None and incremental.is_up_to_date(
+            finished, tree_file, fingerprint, output_files
+        ):
+            logging.info(
+                f"Skipping {tree_file}, the interrupted run finished it",
+                extra={"patient_id": cap_id},
+            )
+            carried_over[tree_file] = fingerprint
+            continue
+
+        fingerprints[tree_file] = fingerprint
+        yield tree_file, cap_id, visits, leaf_index
+
+
+def update_manifest(
+    fingerprints: dict,
+    failures: list,
+    output_directory: Path,
+    run_start: float,
+    carried_over: Optional[dict] = None,
+    shard_name: Optional[str] = None,
+):
+    manifest = incremental.load_manifest(output_directory, shard_name)
+    failed_trees = {str(tree_file) for tree_file, _ in failures}
+
+    for tree_file, fingerprint in fingerprints.items():
+        if str(tree_file) in failed_trees or not outputs_exist(
+            tree_file, output_directory, newer_than=run_start
+        ):
+            manifest.pop(tree_file.name, None)
+            continue
+
+        manifest[tree_file.name] = fingerprint
+
+    for tree_file, fingerprint in (carried_over or {}).items():
+        manifest[tree_file.name] = fingerprint
+
+    incremental.save_manifest(output_directory, manifest, shard_name)
+
+
+def watch_trees(
+    watcher: "tree_watcher.TreeWatcher",
+    lookup_fp: Path,
+    patients_dict: dict,
+    output_directory: Path,
+    workers: int = 1,
+    dendro_path: str = DENDRO_PATH,
+    backend: str = Backend.dendroscope,
+    metrics_file: Optional[Path] = None,
+    simplify_options: Optional["simplify.SimplifyOptions"] = None,
+    reload_patients_dict=None,
+    exit_when_idle: Optional[float] = None,
+) -> list:
+    """
+    Render the trees the watcher hands out as they land, until interrupted.
+
+    Each tree is checked against the manifest, so a tree that is touched but
+    not changed is not rendered again, and the manifest is updated as soon as
+    a tree is done. A tree that changes while it is being rendered is
+    rendered again once the first render is done. When the lookup table
+    changes, it is reloaded and every tree is checked again, so new colours
+    and new CAPs are picked up.
+
+    Args:
+        watcher (TreeWatcher): Hands out the trees of the watched directory
+        lookup_fp (Path): Path to the lookup table, watched for changes
+        patients_dict (dict): The lookup table's patients, keyed by CAP id
+        output_directory (Path): Directory the images and NeXML files go to
+        workers (int): Number of trees to render at the same time
+        dendro_path (str): Path to the Dendroscope executable
+        backend (str): Renderer to draw the trees with
+        metrics_file (Path): The run's metrics file, or None to record nothing
+        simplify_options (SimplifyOptions): Reductions to apply before rendering
+        reload_patients_dict (Callable): Reads the lookup table again
+        exit_when_idle (float): Stop once nothing has happened for this many
+            seconds, or None to keep watching
+
+    Returns:
+        list: (tree file, reason) tuples for every failure
+    """
+    failures = []
+    # Trees waiting for a worker, as (tree, fingerprint) tuples
+    waiting = deque()
+    # (tree, fingerprint, start time) of each submitted tree, by future
+    running = {}
+    max_queued = QUEUED_JOBS_PER_WORKER * max(workers, 1)
+    lookup_signature = tree_watcher.get_signature(lookup_fp)
+    new_lookup_signature = lookup_signature
+    last_activity = time.monotonic()
+
+    def collect(futures: list):
+        for future in futures:
+            tree, fingerprint, start = running.pop(future)
+
+            if future.cancelled():
+                continue
+
+            try:
+                tree_failures = future.result()
+            except Exception as tree_err:
+                tree_failures = [(tree[0], repr(tree_err))]
+
+            report_failures(tree_failures)
+            failures.extend(tree_failures)
+            update_manifest({tree[0]: fingerprint}, tree_failures, output_directory, start)
+
+    executor_class = ProcessPoolExecutor if backend == Backend.matplotlib else ThreadPoolExecutor
+
+    with executor_class(max_workers=max(workers, 1)) as executor:
+        try:
+            while True:
+                ready = watcher.poll()
+
+                # The lookup table is only reloaded once it has held still for
+                # a poll, so one that is still being written isn't read
+                signature = tree_watcher.get_signature(lookup_fp)
+
+                if (
+                    reload_patients_dict is not None
+                    and signature != lookup_signature
+                    and signature == new_lookup_signature
+                ):
+                    try:
+                        patients_dict = reload_patients_dict()
+                        logging.info(f"Reloaded {lookup_fp}, checking every tree again")
+                        watcher.forget()
+                    except Exception as lookup_err:
+                        logging.error(f"Failed to reload {lookup_fp}: {lookup_err!r}")
+
+                    lookup_signature = signature
+
+                new_lookup_signature = signature
+                fingerprints = {}
+
+                for tree in iter_trees_to_render(
+                    iter_patient_trees(ready, patients_dict),
+                    output_directory,
+                    fingerprints,
+                    {},
+                    [],
+                    backend=backend,
+                    simplify_options=simplify_options,
+                    metrics_file=metrics_file,
+                ):
+                    logging.info(f"Queued {tree[0]}", extra={"patient_id": tree[1]})
+                    waiting.append((tree, fingerprints[tree[0]]))
+
+                done = [future for future in running if future.done()]
+                collect(done)
+
+                if ready or done:
+                    last_activity = time.monotonic()
+
+                # A tree that changed while it was being rendered waits for
+                # that render to finish, so its outputs aren't written twice
+                # at once
+                rendering = {tree[0] for tree, _, _ in running.values()}
+
+                for _ in range(len(waiting)):
+                    if len(running) >= max_queued:
+                        break
+
+                    tree, fingerprint = waiting.popleft()
+
+                    if tree[0] in rendering:
+                        waiting.append((tree, fingerprint))
+                        continue
+
+                    future = executor.submit(
+                        partial(
+                            cap_workflow,
+                            [tree],
+                            output_directory,
+                            dendro_path=dendro_path,
+                            backend=backend,
+                            metrics_file=metrics_file,
+                            simplify_options=simplify_options,
+                        )
+                    )
+                    running[future] = (tree, fingerprint, time.time())
+                    rendering.add(tree[0])
+
+                if (
+                    exit_when_idle is not None
+                    and not (waiting or running or watcher.settling)
+                    and time.monotonic() - last_activity >= exit_when_idle
+                ):
+                    logging.info(f"Nothing new for {exit_when_idle:g} seconds, stopping")
+                    break
+        except KeyboardInterrupt:
+            logging.info(f"Stopping once the {len(running)} trees being rendered are done")
+
+            for future in running:
+                future.cancel()
+
+    # Leaving the executor waited for the trees that were being rendered
+    collect(list(running))
+
+    return failures
 
 
 @app.command("process-dir")
@@ -139,30 +1196,218 @@ def cli_process_directory(
     lookup_file: Annotated[Path, typer.Option()],
     output_directory: Annotated[Path, typer.Option()],
     dendroscope_bin: Annotated[str, typer.Option()] = DENDRO_PATH,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Directory to cache the parsed and coloured lookup table in"),
+    ] = None,
+    lookup_store_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="SQLite store to compile the lookup table into and read each CAP from"
+        ),
+    ] = None,
+    incremental_colours: Annotated[
+        bool,
+        typer.Option(
+            help="Keep the colours already in the lookup store when visits are added, "
+            "so only the CAPs with new visits are re-rendered"
+        ),
+    ] = False,
+    batch_size: Annotated[
+        int,
+        typer.Option(help="Number of trees to render per Dendroscope session"),
+    ] = 1,
+    workers: Annotated[
+        int, typer.Option(help="Number of trees or batches to render in parallel")
+    ] = 1,
+    force: Annotated[
+        bool, typer.Option(help="Rebuild trees even if their outputs are up to date")
+    ] = False,
+    backend: Annotated[
+        Backend, typer.Option(help="Renderer to draw the trees with")
+    ] = Backend.dendroscope,
+    prometheus_file: Annotated[
+        Optional[Path],
+        typer.Option(help="Also write the run summary to this Prometheus textfile"),
+    ] = None,
+    use_asyncio: Annotated[
+        bool,
+        typer.Option(help="Run Dendroscope as asyncio subprocesses, one tree at a time"),
+    ] = False,
+    timeout: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Seconds after which a Dendroscope run is killed, with --use-asyncio or --servers"
+        ),
+    ] = None,
+    servers: Annotated[
+        int,
+        typer.Option(help="Number of long-lived Dendroscope processes to feed the trees to"),
+    ] = 0,
+    collapse_same_wpi: Annotated[
+        bool,
+        typer.Option(help="Collapse clades of haplotypes from one visit before rendering"),
+    ] = False,
+    min_count: Annotated[
+        int, typer.Option(help="Drop haplotypes with fewer reads than this before rendering")
+    ] = 0,
+    min_frequency: Annotated[
+        float, typer.Option(help="Drop haplotypes below this frequency before rendering")
+    ] = 0.0,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            help="Carry on an interrupted run, skipping the trees its journal says finished"
+        ),
+    ] = False,
+    shard: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Only render the CAPs of shard i/N, with i from 0 to N-1"
+        ),
+    ] = None,
 ):
 
+    if use_asyncio and (batch_size > 1 or backend != Backend.dendroscope):
+        raise typer.BadParameter(
+            "--use-asyncio only runs Dendroscope on single trees, it can't be combined "
+            "with --batch-size or the matplotlib backend"
+        )
+
+    if servers > 0 and (batch_size > 1 or use_asyncio or backend != Backend.dendroscope):
+        raise typer.BadParameter(
+            "--servers can't be combined with --batch-size, --use-asyncio or the "
+            "matplotlib backend"
+        )
+
+    if incremental_colours and lookup_store_file is None:
+        raise typer.BadParameter("--incremental-colours needs a --lookup-store-file")
+
+    try:
+        shard_name = shards.get_shard_name(shards.parse_shard(shard)) if shard else None
+    except ValueError as shard_err:
+        raise typer.BadParameter(str(shard_err))
+
+    check_tree_directory(tree_directory)
     do_setup(output_directory)
-    patients_dict = get_patients_dict(lookup_file)
+    metrics_file = metrics.get_metrics_path(output_directory, time.time(), shard_name)
+    simplify_options = simplify.SimplifyOptions(collapse_same_wpi, min_count, min_frequency)
 
-    files = tree_directory.glob("*.nwk")
+    with metrics.timed(metrics_file, "lookup"):
+        patients_dict = get_patients_dict(
+            lookup_file, cache_dir, lookup_store_file, incremental_colours
+        )
 
-    for file in files:
-        file_cap_id = file.stem.split("_")[0]
+    # Trees stream from the directory listing through the manifest check to the
+    # workers, so the first trees render while the rest are still being found
+    run_start = time.time()
+    fingerprints = {}
+    carried_over = {}
+    skipped = []
+    tree_files = iter_tree_files(tree_directory)
 
-        if file_cap_id in patients_dict:
-            patient_dict = patients_dict[file_cap_id]
+    if shard:
+        tree_files = shards.iter_shard_tree_files(tree_files, shards.parse_shard(shard))
 
-            workflow(
-                file,
-                file_cap_id,
-                patient_dict,
-                output_directory,
-                dendro_path=str(dendroscope_bin),
+    trees = iter_trees_to_render(
+        iter_patient_trees(tree_files, patients_dict),
+        output_directory,
+        fingerprints,
+        carried_over,
+        skipped,
+        force,
+        backend,
+        simplify_options,
+        checkpoint.get_finished_fingerprints(output_directory, shard_name) if resume else None,
+        metrics_file,
+        shard_name,
+    )
+    server_pool = (
+        dendro_server.DendroServerPool(
+            servers, str(dendroscope_bin), output_directory, timeout
+        )
+        if servers > 0
+        else None
+    )
+
+    if batch_size > 1 and backend == Backend.dendroscope:
+        jobs = (
+            (
+                f"batch {batch_id}",
+                batch,
+                partial(
+                    batch_workflow,
+                    batch_id,
+                    batch,
+                    output_directory,
+                    dendro_path=str(dendroscope_bin),
+                    metrics_file=metrics_file,
+                    simplify_options=simplify_options,
+                ),
+            )
+            for batch_id, batch in enumerate(iter_batches(trees, batch_size))
+        )
+    else:
+        # Every tree has files of its own, so trees of the same CAP can render
+        # at the same time
+        jobs = (
+            (
+                tree[0].name,
+                [tree],
+                partial(
+                    cap_workflow,
+                    [tree],
+                    output_directory,
+                    dendro_path=str(dendroscope_bin),
+                    backend=backend,
+                    metrics_file=metrics_file,
+                    server=server_pool,
+                    simplify_options=simplify_options,
+                ),
+            )
+            for tree in trees
+        )
+
+    # The native renderer does its work in Python, so it needs processes to
+    # make use of more than one core
+    with (
+        checkpoint.Journal(output_directory, fingerprints, resume, shard_name) as run_journal,
+        metrics.timed(metrics_file, "render_all", workers=workers) as render_metric,
+        server_pool or nullcontext(),
+    ):
+        if use_asyncio:
+            failures = asyncio.run(
+                run_async_jobs(
+                    trees,
+                    output_directory,
+                    workers,
+                    dendro_path=str(dendroscope_bin),
+                    timeout=timeout,
+                    metrics_file=metrics_file,
+                    simplify_options=simplify_options,
+                    run_journal=run_journal,
+                )
             )
         else:
-            logging.error(
-                f"Failed to find the CAP_ID {file_cap_id} in the provided lookup table"
+            failures = run_jobs(
+                jobs,
+                workers,
+                use_processes=backend == Backend.matplotlib,
+                run_journal=run_journal,
             )
+        render_metric["trees"] = len(fingerprints)
+    report_failures(failures)
+
+    update_manifest(
+        fingerprints, failures, output_directory, run_start, carried_over, shard_name
+    )
+    logging.info(
+        f"Skipped {len(skipped)} up to date trees and rebuilt {len(fingerprints)} trees"
+    )
+
+    if resume:
+        logging.info(f"Carried over {len(carried_over)} trees the interrupted run finished")
+    metrics.write_summary(metrics_file, prometheus_file)
 
 
 @app.command("process-file")
@@ -171,13 +1416,42 @@ def cli_process_file(
     lookup_file: Annotated[Path, typer.Option()],
     output_directory: Annotated[Path, typer.Option()],
     dendroscope_bin: Annotated[str, typer.Option()] = DENDRO_PATH,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Directory to cache the parsed and coloured lookup table in"),
+    ] = None,
+    lookup_store_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="SQLite store to compile the lookup table into and read each CAP from"
+        ),
+    ] = None,
+    backend: Annotated[
+        Backend, typer.Option(help="Renderer to draw the tree with")
+    ] = Backend.dendroscope,
+    collapse_same_wpi: Annotated[
+        bool,
+        typer.Option(help="Collapse clades of haplotypes from one visit before rendering"),
+    ] = False,
+    min_count: Annotated[
+        int, typer.Option(help="Drop haplotypes with fewer reads than this before rendering")
+    ] = 0,
+    min_frequency: Annotated[
+        float, typer.Option(help="Drop haplotypes below this frequency before rendering")
+    ] = 0.0,
 ):
 
     do_setup(output_directory)
-    patients_dict = get_patients_dict(lookup_file)
-    json.dump(
-        patients_dict, open(output_directory / "tmp" / "patients.json", "w"), indent=4
-    )
+    patients_dict = get_patients_dict(lookup_file, cache_dir, lookup_store_file)
+
+    # The cache and the store already hold the parsed table, no need to dump it
+    # for every job
+    if cache_dir is None and lookup_store_file is None:
+        json.dump(
+            patients_dict,
+            open(output_directory / "tmp" / "patients.json", "w"),
+            indent=4,
+        )
 
     file_cap_id = tree_file.stem.split("_")[0]
 
@@ -191,6 +1465,10 @@ def cli_process_file(
             patient_dict,
             output_directory,
             dendro_path=str(dendroscope_bin),
+            backend=backend,
+            simplify_options=simplify.SimplifyOptions(
+                collapse_same_wpi, min_count, min_frequency
+            ),
         )
 
     else:
@@ -199,6 +1477,293 @@ def cli_process_file(
         )
 
 
+@app.command("compile-lookup")
+def cli_compile_lookup(
+    lookup_file: Annotated[Path, typer.Option()],
+    lookup_store_file: Annotated[Path, typer.Option(help="SQLite store to write")],
+    incremental_colours: Annotated[
+        bool,
+        typer.Option(help="Keep the colours of the visits already in the store"),
+    ] = False,
+):
+    """
+    Compile the lookup table, colours included, into a SQLite store that jobs
+    can read a single CAP from, and print the CAPs whose colours changed.
+    """
+    changed_caps = lookup_store.compile_store(
+        lookup_file, lookup_store_file, incremental_colours
+    )
+
+    for cap_id in changed_caps:
+        print(cap_id)
+
+
+@app.command("merge-shards")
+def cli_merge_shards(
+    output_directory: Annotated[Path, typer.Option()],
+    shard_count: Annotated[int, typer.Option(help="Number of shards the run was split into")],
+    tree_directory: Annotated[
+        Optional[Path],
+        typer.Option(help="The directory the shards were given, to find the CAPs none rendered"),
+    ] = None,
+    partial: Annotated[
+        bool,
+        typer.Option(
+            help="Merge the shards that are done into the existing manifest, "
+            "even if others left no manifest behind"
+        ),
+    ] = False,
+):
+    """
+    Combine the manifests of a sharded process-dir run into one, and report
+    the CAPs that were rendered by no shard or by more than one.
+    """
+    if tree_directory is not None:
+        check_tree_directory(tree_directory)
+
+    report = shards.merge_shard_manifests(
+        output_directory,
+        shard_count,
+        iter_tree_files(tree_directory) if tree_directory is not None else None,
+        partial,
+    )
+
+    for index in report["missing_shards"]:
+        if partial:
+            logging.warning(f"Shard {index}/{shard_count} left no manifest behind")
+        else:
+            logging.error(f"Shard {index}/{shard_count} left no manifest behind")
+
+    # Shards that aren't done yet are expected in a partial merge
+    if partial:
+        report["missing_shards"] = []
+
+    for cap_id, shard_indices in report["duplicated_caps"].items():
+        logging.error(
+            f"{cap_id} was rendered by shards {', '.join(map(str, shard_indices))}",
+            extra={"patient_id": cap_id},
+        )
+
+    for cap_id in report["missing_caps"]:
+        logging.error(f"{cap_id} was not rendered by any shard", extra={"patient_id": cap_id})
+
+    if any(report.values()):
+        raise typer.Exit(code=1)
+
+
+@app.command("export-nexml")
+def cli_export_nexml(
+    lookup_file: Annotated[Path, typer.Option()],
+    output_directory: Annotated[Path, typer.Option()],
+    tree_directory: Annotated[
+        Optional[Path], typer.Option(help="Export every tree in this directory")
+    ] = None,
+    tree_file: Annotated[Optional[Path], typer.Option(help="Export a single tree")] = None,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Directory to cache the parsed and coloured lookup table in"),
+    ] = None,
+    lookup_store_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="SQLite store to compile the lookup table into and read each CAP from"
+        ),
+    ] = None,
+):
+    """
+    Write the styled NeXML file of each tree without launching Dendroscope.
+    """
+    if (tree_directory is None) == (tree_file is None):
+        raise typer.BadParameter("Give exactly one of --tree-directory or --tree-file")
+
+    if tree_directory is not None:
+        check_tree_directory(tree_directory)
+
+    do_setup(output_directory)
+    patients_dict = get_patients_dict(lookup_file, cache_dir, lookup_store_file)
+
+    files = [tree_file] if tree_file is not None else iter_tree_files(tree_directory)
+
+    for file in files:
+        file_cap_id = file.stem.split("_")[0]
+
+        if file_cap_id not in patients_dict:
+            logging.error(
+                f"Failed to find the CAP_ID {file_cap_id} in the provided lookup table"
+            )
+            continue
+
+        _, _, nexus_output_file = get_output_files(file, output_directory)
+        nexml.export_nexml(
+            file,
+            optimise_patient_dict(patients_dict[file_cap_id], file, cap_id=file_cap_id),
+            nexus_output_file,
+        )
+
+        logging.info(
+            f"Wrote {nexus_output_file}", extra={"patient_id": file_cap_id}
+        )
+
+
+@app.command("watch")
+def cli_watch(
+    tree_directory: Annotated[Path, typer.Option(help="The directory to watch")],
+    lookup_file: Annotated[Path, typer.Option()],
+    output_directory: Annotated[Path, typer.Option()],
+    dendroscope_bin: Annotated[str, typer.Option()] = DENDRO_PATH,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Directory to cache the parsed and coloured lookup table in"),
+    ] = None,
+    lookup_store_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="SQLite store to compile the lookup table into and read each CAP from"
+        ),
+    ] = None,
+    workers: Annotated[int, typer.Option(help="Number of trees to render at the same time")] = 1,
+    backend: Annotated[
+        Backend, typer.Option(help="Renderer to draw the trees with")
+    ] = Backend.dendroscope,
+    settle_seconds: Annotated[
+        float,
+        typer.Option(help="Seconds a tree has to go unchanged before it is rendered"),
+    ] = WATCH_SETTLE_SECONDS,
+    poll_interval: Annotated[
+        float, typer.Option(help="Seconds between listings of the directory when polling")
+    ] = WATCH_POLL_INTERVAL_SECONDS,
+    poll: Annotated[
+        bool,
+        typer.Option(
+            help="List the directory instead of using inotify, e.g. on NFS, where writes from other hosts raise no events"
+        ),
+    ] = False,
+    exit_when_idle: Annotated[
+        Optional[float],
+        typer.Option(help="Stop once nothing new has landed for this many seconds"),
+    ] = None,
+    collapse_same_wpi: Annotated[
+        bool,
+        typer.Option(help="Collapse clades of haplotypes from one visit before rendering"),
+    ] = False,
+    min_count: Annotated[
+        int, typer.Option(help="Drop haplotypes with fewer reads than this before rendering")
+    ] = 0,
+    min_frequency: Annotated[
+        float, typer.Option(help="Drop haplotypes below this frequency before rendering")
+    ] = 0.0,
+):
+    """
+    Render the trees in a directory, then keep rendering new and changed trees
+    as they land in it, until interrupted.
+    """
+    check_tree_directory(tree_directory)
+    do_setup(output_directory)
+    metrics_file = metrics.get_metrics_path(output_directory, time.time())
+    reload_patients_dict = partial(get_patients_dict, lookup_file, cache_dir, lookup_store_file)
+
+    with tree_watcher.TreeWatcher(
+        tree_directory, poll_interval, settle_seconds, use_inotify=not poll
+    ) as watcher:
+        failures = watch_trees(
+            watcher,
+            lookup_file,
+            reload_patients_dict(),
+            output_directory,
+            workers,
+            dendro_path=str(dendroscope_bin),
+            backend=backend,
+            metrics_file=metrics_file,
+            simplify_options=simplify.SimplifyOptions(
+                collapse_same_wpi, min_count, min_frequency
+            ),
+            reload_patients_dict=reload_patients_dict,
+            exit_when_idle=exit_when_idle,
+        )
+
+    logging.info(f"Stopped watching {tree_directory}, {len(failures)} trees failed to render")
+    metrics.write_summary(metrics_file)
+
+
+@app.command("serve")
+def cli_serve(
+    lookup_file: Annotated[Path, typer.Option()],
+    output_directory: Annotated[Path, typer.Option()],
+    dendroscope_bin: Annotated[str, typer.Option()] = DENDRO_PATH,
+    cache_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Directory to cache the parsed and coloured lookup table in"),
+    ] = None,
+    lookup_store_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="SQLite store to compile the lookup table into and read each CAP from"
+        ),
+    ] = None,
+    host: Annotated[str, typer.Option(help="Address to listen on")] = SERVE_HOST,
+    port: Annotated[int, typer.Option(help="Port to listen on")] = SERVE_PORT,
+    workers: Annotated[int, typer.Option(help="Number of trees to render at the same time")] = 1,
+    backend: Annotated[
+        Backend, typer.Option(help="Renderer to draw the trees with")
+    ] = Backend.dendroscope,
+    servers: Annotated[
+        int,
+        typer.Option(help="Number of long-lived Dendroscope processes to feed the trees to"),
+    ] = 0,
+    timeout: Annotated[
+        Optional[float],
+        typer.Option(help="Seconds after which a Dendroscope run is killed, with --servers"),
+    ] = None,
+):
+    """
+    Load the lookup table once and render the trees posted to a local HTTP
+    service, each in its own directory under output_directory/jobs.
+    """
+    if servers > 0 and backend != Backend.dendroscope:
+        raise typer.BadParameter("--servers only works with the dendroscope backend")
+
+    do_setup(output_directory)
+    metrics_file = metrics.get_metrics_path(output_directory, time.time())
+    patients_dict = get_patients_dict(lookup_file, cache_dir, lookup_store_file)
+    server_pool = (
+        dendro_server.DendroServerPool(
+            servers, str(dendroscope_bin), output_directory, timeout
+        )
+        if servers > 0
+        else None
+    )
+
+    # The native renderer does its work in Python, so it needs processes to
+    # make use of more than one core
+    executor_class = ProcessPoolExecutor if backend == Backend.matplotlib else ThreadPoolExecutor
+
+    with (
+        executor_class(max_workers=max(workers, 1)) as executor,
+        server_pool or nullcontext(),
+    ):
+        render_service.serve(
+            render_service.RenderService(
+                patients_dict,
+                output_directory,
+                executor,
+                partial(
+                    workflow,
+                    dendro_path=str(dendroscope_bin),
+                    backend=backend,
+                    metrics_file=metrics_file,
+                    server=server_pool,
+                ),
+                get_output_files,
+            ),
+            host,
+            port,
+        )
+
+        executor.shutdown(cancel_futures=True)
+
+    metrics.write_summary(metrics_file)
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     app()
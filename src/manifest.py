@@ -0,0 +1,98 @@
+# Keeps track of which trees have already been rendered, so that re-running
+# process-dir over a cohort only rebuilds the trees whose inputs changed.
+#
+# The manifest lives in output_directory/tmp and maps each tree file name to
+# the hashes of everything that went into rendering it:
+#     1) The tree file itself
+#     2) The patient's lookup rows after get_patients_dict (colours included)
+#     3) The generated Dendroscope command text
+# along with the backend the tree was rendered with and, if it was simplified
+# before rendering, the simplification settings.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def hash_file(file_path: Path) -> str:
+    file_hash = hashlib.sha256()
+
+    with open(file_path, "rb") as file_fh:
+        for chunk in iter(lambda: file_fh.read(1 << 20), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_patient_dict(patient_dict: dict) -> str:
+    return hash_text(json.dumps(patient_dict, sort_keys=True))
+
+
+def get_manifest_path(output_directory: Path, shard_name: Optional[str] = None) -> Path:
+    # Each shard of a sharded run keeps its own manifest, see shards.py
+    if shard_name is not None:
+        return output_directory / "tmp" / f"manifest.{shard_name}.json"
+
+    return output_directory / "tmp" / MANIFEST_FILE_NAME
+
+
+def load_manifest(output_directory: Path, shard_name: Optional[str] = None) -> dict:
+    manifest_path = get_manifest_path(output_directory, shard_name)
+
+    if not manifest_path.exists():
+        return {}
+
+    with open(manifest_path, "r") as manifest_fh:
+        return json.load(manifest_fh)
+
+
+def save_manifest(output_directory: Path, manifest: dict, shard_name: Optional[str] = None):
+    manifest_path = get_manifest_path(output_directory, shard_name)
+    partial_path = manifest_path.with_suffix(".json.partial")
+
+    # Write next to the real manifest and swap it in, so an interrupted run
+    # never leaves a truncated manifest behind
+    with open(partial_path, "w") as manifest_fh:
+        json.dump(manifest, manifest_fh, indent=4, sort_keys=True)
+
+    os.replace(partial_path, manifest_path)
+
+
+def tree_fingerprint(
+    tree_file: Path,
+    cap_id: str,
+    patient_dict: dict,
+    dendro_command: str,
+    backend: str = "dendroscope",
+    simplification: str | None = None,
+) -> dict:
+    fingerprint = {
+        "CAP": cap_id,
+        "backend": backend,
+        "tree": hash_file(tree_file),
+        "lookup": hash_patient_dict(patient_dict),
+        "command": hash_text(dendro_command),
+    }
+
+    # Only there when the tree was simplified, so older manifests still match
+    if simplification is not None:
+        fingerprint["simplification"] = simplification
+
+    return fingerprint
+
+
+def is_up_to_date(
+    manifest: dict, tree_file: Path, fingerprint: dict, output_files: tuple
+) -> bool:
+    if manifest.get(tree_file.name) != fingerprint:
+        return False
+
+    return all(output_file.exists() for output_file in output_files)
@@ -0,0 +1,206 @@
+# Per-stage timings of a process-dir run.
+#
+# Every timed stage appends one JSON line to the run's metrics file in
+# output_directory/logs, e.g.
+#     {"stage": "dendroscope", "duration": 41.2, "cap_id": "CAP336",
+#      "tree": "CAP336_NEF.nwk", "leaves": 20412, "exit_code": 0}
+# Lines are written with a single append each, so threads and worker processes
+# can share the file. At the end of the run the records are summarised into
+# per-stage p50/p95/max and the slowest CAPs, written as JSON and, optionally,
+# as a Prometheus textfile for the node exporter's textfile collector.
+
+import json
+import logging
+import math
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+# Stage whose records cover a whole tree, used to rank the slowest CAPs
+TREE_STAGE = "tree"
+PROMETHEUS_PREFIX = "dendroscope_script"
+
+
+def get_metrics_path(
+    output_directory: Path, run_start: float, shard_name: Optional[str] = None
+) -> Path:
+    run_stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(run_start))
+
+    # The shards of an array job start at the same time
+    if shard_name is not None:
+        run_stamp = f"{run_stamp}.{shard_name}"
+
+    return output_directory / "logs" / f"metrics-{run_stamp}.jsonl"
+
+
+def record(metrics_file: Optional[Path], stage: str, duration: float, **fields):
+    if metrics_file is None:
+        return
+
+    line = json.dumps({"stage": stage, "duration": duration, **fields}) + "\n"
+
+    with open(metrics_file, "a") as metrics_fh:
+        metrics_fh.write(line)
+
+
+@contextmanager
+def timed(metrics_file: Optional[Path], stage: str, **fields):
+    """
+    Time the body of a with block and record it as a stage.
+
+    The yielded dict is written out with the record, so the body can add fields
+    that are only known once the stage has run, such as an exit code.
+
+    Args:
+        metrics_file (Path): The run's metrics file, or None to record nothing
+        stage (str): Name of the stage
+        **fields: Extra fields of the record, e.g. cap_id and tree
+    """
+    start = time.perf_counter()
+
+    try:
+        yield fields
+    finally:
+        record(metrics_file, stage, time.perf_counter() - start, **fields)
+
+
+def load_records(metrics_file: Path) -> list:
+    if not metrics_file.exists():
+        return []
+
+    with open(metrics_file, "r") as metrics_fh:
+        return [json.loads(line) for line in metrics_fh if line.strip()]
+
+
+def percentile(values: list, quantile: float) -> float:
+    # Nearest rank, so the value reported is always one that was measured
+    ordered = sorted(values)
+    rank = max(math.ceil(quantile * len(ordered)), 1)
+
+    return ordered[rank - 1]
+
+
+def summarise(records: list, n_slowest: int = 10) -> dict:
+    """
+    Summarise the records of a run.
+
+    Args:
+        records (list): Records as returned by load_records
+        n_slowest (int): Number of CAPs to list as the slowest
+
+    Returns:
+        dict: Per-stage count, total, p50, p95 and max durations, and the CAPs
+            that took longest over all their trees
+    """
+    stage_durations = {}
+    cap_durations = {}
+
+    for metric in records:
+        stage_durations.setdefault(metric["stage"], []).append(metric["duration"])
+
+        if metric["stage"] == TREE_STAGE and metric.get("cap_id"):
+            cap_durations[metric["cap_id"]] = (
+                cap_durations.get(metric["cap_id"], 0) + metric["duration"]
+            )
+
+    stages = {
+        stage: {
+            "count": len(durations),
+            "total": sum(durations),
+            "p50": percentile(durations, 0.5),
+            "p95": percentile(durations, 0.95),
+            "max": max(durations),
+        }
+        for stage, durations in stage_durations.items()
+    }
+    slowest_caps = sorted(cap_durations.items(), key=lambda item: item[1], reverse=True)
+
+    return {
+        "stages": stages,
+        "slowest_caps": [
+            {"cap_id": cap_id, "duration": duration}
+            for cap_id, duration in slowest_caps[:n_slowest]
+        ],
+    }
+
+
+def write_atomically(output_file: Path, text: str):
+    # The textfile collector may read at any moment, so never expose a
+    # half-written file
+    partial_path = output_file.with_name(output_file.name + ".partial")
+
+    with open(partial_path, "w") as output_fh:
+        output_fh.write(text)
+
+    os.replace(partial_path, output_file)
+
+
+def to_prometheus(summary: dict, run_end: float) -> str:
+    duration_metric = f"{PROMETHEUS_PREFIX}_stage_duration_seconds"
+    cap_metric = f"{PROMETHEUS_PREFIX}_cap_duration_seconds"
+    lines = [
+        f"# HELP {duration_metric} Duration of each pipeline stage in the last run.",
+        f"# TYPE {duration_metric} summary",
+    ]
+
+    for stage, stats in summary["stages"].items():
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("1", "max")):
+            lines.append(
+                f'{duration_metric}{{stage="{stage}",quantile="{quantile}"}} {stats[key]}'
+            )
+        lines.append(f'{duration_metric}_sum{{stage="{stage}"}} {stats["total"]}')
+        lines.append(f'{duration_metric}_count{{stage="{stage}"}} {stats["count"]}')
+
+    lines.append(f"# HELP {cap_metric} Time spent on the slowest CAPs in the last run.")
+    lines.append(f"# TYPE {cap_metric} gauge")
+
+    for cap in summary["slowest_caps"]:
+        lines.append(f'{cap_metric}{{cap_id="{cap["cap_id"]}"}} {cap["duration"]}')
+
+    lines.append(f"# HELP {PROMETHEUS_PREFIX}_last_run_timestamp_seconds End of the last run.")
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {run_end}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_summary(
+    metrics_file: Path,
+    prometheus_file: Optional[Path] = None,
+    n_slowest: int = 10,
+) -> dict:
+    """
+    Summarise a run's metrics file, log the summary and write it next to the
+    metrics file as JSON and, if asked, as a Prometheus textfile.
+
+    Args:
+        metrics_file (Path): The run's metrics file
+        prometheus_file (Path): Where to write the Prometheus textfile
+        n_slowest (int): Number of CAPs to list as the slowest
+
+    Returns:
+        dict: The summary, as returned by summarise
+    """
+    summary = summarise(load_records(metrics_file), n_slowest)
+    write_atomically(
+        metrics_file.with_suffix(".summary.json"), json.dumps(summary, indent=4)
+    )
+
+    for stage, stats in summary["stages"].items():
+        logging.info(
+            f"{stage}: {stats['count']} runs, p50 {stats['p50']:.2f}s, "
+            f"p95 {stats['p95']:.2f}s, max {stats['max']:.2f}s"
+        )
+
+    for cap in summary["slowest_caps"]:
+        logging.info(
+            f"Slow CAP {cap['cap_id']}: {cap['duration']:.2f}s",
+            extra={"patient_id": cap["cap_id"]},
+        )
+
+    if prometheus_file is not None:
+        write_atomically(prometheus_file, to_prometheus(summary, time.time()))
+
+    return summary
@@ -0,0 +1,96 @@
+# A streaming Newick scanner for the code paths that only need the leaf names.
+#
+# Building an ete3.Tree creates a Python object per node, which on NGS trees
+# with tens of thousands of haplotypes costs far more time and memory than the
+# rest of the pipeline. The scanner below reads the file in chunks and yields
+# the leaf labels as it finds them, without building any nodes.
+
+import re
+from pathlib import Path
+from typing import Iterator
+
+CHUNK_SIZE = 1 << 16
+STRUCTURAL_TOKENS = ("(", ")", ",", ":", ";")
+
+# Quoted labels, comments, the structural characters and bare labels (which may
+# contain an apostrophe, just not start with one). The single "'" and "["
+# alternatives only match when a quoted label or comment is cut off at the end
+# of a chunk.
+_TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'(?!')|\[[^\]]*\]|[(),:;]|[^(),:;\[\]'\s][^(),:;\[\]\s]*|'|\["
+)
+
+
+def label_from_token(token: str) -> str:
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+
+    return token
+
+
+def iter_tokens(tree_file: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yield the tokens of a Newick file: structural characters, labels (still
+    quoted if they were quoted in the file), branch lengths and [comments].
+
+    Args:
+        tree_file (Path): Path to the Newick file
+        chunk_size (int): Number of characters to read at a time
+
+    Returns:
+        Iterator[str]: The tokens
+    """
+    leftover = ""
+
+    with open(tree_file, "r") as tree_fh:
+        while True:
+            chunk = tree_fh.read(chunk_size)
+            at_end = not chunk
+            buffer = leftover + chunk
+            leftover = ""
+
+            for match in _TOKEN_RE.finditer(buffer):
+                token = match.group()
+
+                # The token might carry on in the next chunk, so hold it back
+                if not at_end and (
+                    match.end() == len(buffer) or token in ("'", "[")
+                ):
+                    leftover = buffer[match.start() :]
+                    break
+
+                yield token
+
+            if at_end:
+                break
+
+
+def iter_leaf_names(tree_file: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yield the leaf labels of a Newick file in the order they appear.
+
+    Labels that follow a ")" belong to internal nodes and are skipped, as are
+    branch lengths and [comments]. Leaves without a label are not yielded.
+
+    Args:
+        tree_file (Path): Path to the Newick file
+        chunk_size (int): Number of characters to read at a time
+
+    Returns:
+        Iterator[str]: The leaf labels
+    """
+    # A label is a leaf label when the structural token before it is "(" or ","
+    previous = "("
+
+    for token in iter_tokens(tree_file, chunk_size):
+        if token in STRUCTURAL_TOKENS:
+            previous = token
+        elif token.startswith("["):
+            continue
+        else:
+            if previous in ("(", ","):
+                yield label_from_token(token)
+
+            # Anything after a label or length up to the next structural
+            # character is not a label
+            previous = "label"
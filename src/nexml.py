@@ -0,0 +1,127 @@
+# Writes NeXML files directly, for the jobs that only launched Dendroscope to
+# get the CAP*.dendro_nexus.nexus file out of `save format=NeXML`.
+#
+# The file is written element by element as the tree is walked, so no XML
+# document is ever built in memory. Each styled leaf carries the style the
+# Dendroscope command would have given it as LiteralMeta annotations:
+#     <meta xsi:type="nex:LiteralMeta" property="dendro:labelcolor" content="255 0 0"/>
+
+from pathlib import Path
+from typing import TextIO
+from xml.sax.saxutils import quoteattr
+
+import dendro_interface as dendroscope
+import tree as compact_tree
+
+NEXML_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<nex:nexml xmlns:nex="http://www.nexml.org/2009" xmlns="http://www.nexml.org/2009" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xmlns:dendro="http://dendroscope.org/nexml#" version="0.9">
+"""
+NEXML_FOOTER = "</nex:nexml>\n"
+
+# GroupStyle attribute and the Dendroscope `set` command it corresponds to
+STYLE_PROPERTIES = (
+    ("colour", "labelcolor"),
+    ("size", "nodesize"),
+    ("shape", "nodeshape"),
+    ("font", "font"),
+    ("fillcolour", "fillcolor"),
+)
+
+
+def write_style_meta(output_fh: TextIO, style: dendroscope.GroupStyle):
+    for attribute, dendro_property in STYLE_PROPERTIES:
+        value = getattr(style, attribute)
+
+        if value:
+            output_fh.write(
+                f'        <meta xsi:type="nex:LiteralMeta" property="dendro:{dendro_property}" '
+                f"content={quoteattr(value)}/>\n"
+            )
+
+
+def write_nexml(
+    tree_obj: compact_tree.Tree,
+    leaf_styles: dict,
+    output_fh: TextIO,
+    tree_label: str = "tree",
+):
+    """
+    Write a tree and the per-leaf styles to an open file as NeXML.
+
+    Args:
+        tree_obj (Tree): The tree to write
+        leaf_styles (dict): GroupStyles keyed by leaf name, as returned by
+            dendro_interface.get_leaf_styles
+        output_fh (TextIO): File to write to
+        tree_label (str): Label of the tree element
+    """
+    output_fh.write(NEXML_HEADER)
+
+    output_fh.write('  <otus id="otus1">\n')
+    for leaf in tree_obj.leaf_indices():
+        output_fh.write(
+            f'    <otu id="t{leaf}" label={quoteattr(tree_obj.label(leaf))}/>\n'
+        )
+    output_fh.write("  </otus>\n")
+
+    output_fh.write('  <trees otus="otus1" id="trees1">\n')
+    output_fh.write(
+        f'    <tree id="tree1" xsi:type="nex:FloatTree" label={quoteattr(tree_label)}>\n'
+    )
+
+    for node in range(len(tree_obj)):
+        label = tree_obj.label(node)
+        attributes = f'id="n{node}"'
+
+        if label:
+            attributes += f" label={quoteattr(label)}"
+        if tree_obj.is_leaf(node):
+            attributes += f' otu="t{node}"'
+        if tree_obj.parent(node) < 0:
+            attributes += ' root="true"'
+
+        style = leaf_styles.get(label) if tree_obj.is_leaf(node) else None
+
+        if style is None:
+            output_fh.write(f"      <node {attributes}/>\n")
+            continue
+
+        output_fh.write(f"      <node {attributes}>\n")
+        write_style_meta(output_fh, style)
+        output_fh.write("      </node>\n")
+
+    for node in range(len(tree_obj)):
+        parent = tree_obj.parent(node)
+
+        if parent < 0:
+            continue
+
+        branch_length = tree_obj.branch_length(node)
+        # nan != nan, so unset lengths are left off the edge
+        length = f' length="{branch_length!r}"' if branch_length == branch_length else ""
+        output_fh.write(
+            f'      <edge id="e{node}" source="n{parent}" target="n{node}"{length}/>\n'
+        )
+
+    output_fh.write("    </tree>\n")
+    output_fh.write("  </trees>\n")
+    output_fh.write(NEXML_FOOTER)
+
+
+def export_nexml(tree_file: Path, patient_visits: dict, nexus_output_file: Path):
+    """
+    Write the NeXML file for a Newick tree, styled for a patient's visits, the
+    way Dendroscope's `save format=NeXML` would.
+
+    Args:
+        tree_file (Path): Path to the Newick tree
+        patient_visits (dict): The patient's visits, keyed by visit code
+        nexus_output_file (Path): Where to write the NeXML file
+    """
+    tree_obj = compact_tree.Tree.from_newick(tree_file)
+    leaf_styles = dendroscope.get_leaf_styles(patient_visits, tree_obj.leaf_names())
+
+    with open(nexus_output_file, "w") as output_fh:
+        write_nexml(tree_obj, leaf_styles, output_fh, tree_label=tree_file.stem)
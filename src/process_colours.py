@@ -14,15 +14,19 @@
 #         iii) For each year between 1 and n-1, assign that year a colour and assign shades to the varying samples in that year
 
 import csv
+from bisect import bisect_right
 import json
 from pathlib import Path
 from operator import itemgetter
 import colour
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+import numpy as np
 
 WEEKS_IN_YEAR = 52
 
+# Bump this whenever lookup_to_dict or assign_colours_to_patients change the
+# colours they produce, so that cached lookup tables are rebuilt
+COLOUR_ALGORITHM_VERSION = 1
+
 YEAR_ONE = "#ff0000"  # RED
 YEAR_N_MINUS_ONE = "#0000ff"  # Blue
 colour_lookup = {
@@ -41,6 +45,13 @@ colour_lookup_hex = {
     6: "#87CEEB",  # Light Blue
 }
 
+# HSL of the fixed base colours, so they are only parsed once
+colour_lookup_hsl = {
+    year: tuple(colour.Color(hex_colour).hsl)
+    for year, hex_colour in colour_lookup_hex.items()
+}
+YEAR_N_MINUS_ONE_HSL = tuple(colour.Color(YEAR_N_MINUS_ONE).hsl)
+
 
 def rgbfloat2rgbint(rgb):
     """
@@ -55,6 +66,63 @@ def rgbfloat2rgbint(rgb):
     return tuple([int(255 * i) for i in rgb])
 
 
+RED_RGB = rgbfloat2rgbint(colour.Color("red").rgb)
+BLUE_RGB = rgbfloat2rgbint(colour.Color("blue").rgb)
+
+
+def _hue2rgb_array(v1: float, v2: float, hue: np.ndarray) -> np.ndarray:
+    # Mirrors colour._hue2rgb element-wise, including its order of operations,
+    # so that the results are bit-for-bit the same
+    hue = hue.copy()
+
+    while (hue < 0).any():
+        hue = np.where(hue < 0, hue + 1, hue)
+    while (hue > 1).any():
+        hue = np.where(hue > 1, hue - 1, hue)
+
+    return np.select(
+        [6 * hue < 1, 2 * hue < 1, 3 * hue < 2],
+        [v1 + (v2 - v1) * 6 * hue, np.full_like(hue, v2), v1 + (v2 - v1) * ((2.0 / 3) - hue) * 6],
+        default=v1,
+    )
+
+
+def hsl2rgbint_array(hue: np.ndarray, saturation: float, lightness: float) -> np.ndarray:
+    """
+    Convert an array of hues sharing one saturation and lightness to rgb
+    integer values (0-255), exactly as colour.Color(hsl=...).rgb followed by
+    rgbfloat2rgbint would.
+
+    Args:
+        hue (np.ndarray): Array of hues
+        saturation (float): Saturation shared by all the colours
+        lightness (float): Lightness shared by all the colours
+
+    Returns:
+        np.ndarray: Array of shape (len(hue), 3) of integer values from 0 to 255
+    """
+    if saturation == 0:
+        rgb = np.full((len(hue), 3), float(lightness))
+    else:
+        if lightness < 0.5:
+            v2 = lightness * (1.0 + saturation)
+        else:
+            v2 = (lightness + saturation) - (saturation * lightness)
+
+        v1 = 2.0 * lightness - v2
+
+        rgb = np.stack(
+            [
+                _hue2rgb_array(v1, v2, hue + (1.0 / 3)),
+                _hue2rgb_array(v1, v2, hue),
+                _hue2rgb_array(v1, v2, hue - (1.0 / 3)),
+            ],
+            axis=1,
+        )
+
+    return (255 * rgb).astype(int)
+
+
 def lookup_to_dict(lookup_path: Path) -> dict:
     patient_dict = {}
 
@@ -73,9 +141,9 @@ def lookup_to_dict(lookup_path: Path) -> dict:
             visit_colour = None
 
             if year_of_infection == 1:
-                visit_colour = rgbfloat2rgbint(colour.Color("red").rgb)
+                visit_colour = RED_RGB
             elif years_pre_art == 0:
-                visit_colour = rgbfloat2rgbint(colour.Color("blue").rgb)
+                visit_colour = BLUE_RGB
 
             patient_dict[line["PID"]][int(line["Visit Code"])] = {
                 "code": int(line["Visit Code"]),
@@ -170,3 +238,186 @@ def assign_colours_to_patients(patient_dict: dict) -> dict:
         patient_dict[visit_cap][visit_id]["colour"] = rgbfloat2rgbint(new_colour.rgb)
 
     return patient_dict
+
+
+def assign_colours_to_patients_vectorized(patient_dict: dict) -> dict:
+    """
+    NumPy version of assign_colours_to_patients, producing the same colours.
+
+    Visits are flattened into arrays once, the year buckets and the WPI rank
+    within each year are worked out with a single sort, and the hue offsets
+    are converted to RGB a whole year at a time.
+
+    Args:
+        patient_dict (dict): Patients dict, as returned by lookup_to_dict
+
+    Returns:
+        dict: The same patients dict, with the colours filled in
+    """
+    visits = [visit for visits in patient_dict.values() for visit in visits.values()]
+
+    if not visits:
+        return patient_dict
+
+    yoi = np.fromiter((visit["YOI"] for visit in visits), dtype=np.int64, count=len(visits))
+    ypa = np.fromiter((visit["YPA"] for visit in visits), dtype=np.int64, count=len(visits))
+    wpi = np.fromiter((visit["WPI"] for visit in visits), dtype=np.int64, count=len(visits))
+
+    yearly = (yoi != 1) & (ypa != 0)
+    n_minus_one = (yoi != 1) & (ypa == 0)
+
+    # Years are coloured in the order they are first seen, like the year_dict
+    # of assign_colours_to_patients
+    yearly_idx = np.flatnonzero(yearly)
+    years, first_seen = np.unique(yoi[yearly_idx], return_index=True)
+    years = years[np.argsort(first_seen)]
+
+    # The last rank of the last year sets the hue offset of the n-1 visits.
+    # assign_colours_to_patients fails outright when there are n-1 visits but
+    # no yearly ones, here they get the base blue instead
+    idx = 0
+
+    for year in years:
+        year_idx = yearly_idx[yoi[yearly_idx] == year]
+        # A stable sort keeps visits with equal WPIs in their original order
+        year_idx = year_idx[np.argsort(wpi[year_idx], kind="stable")]
+
+        year_base_hsl = colour_lookup_hsl[year]
+        ranks = np.arange(len(year_idx))
+        rgb = hsl2rgbint_array(
+            year_base_hsl[0] + ranks * (0.001), year_base_hsl[1], year_base_hsl[2]
+        ).tolist()
+
+        for visit_idx, visit_rgb in zip(year_idx.tolist(), rgb):
+            visits[visit_idx]["colour"] = tuple(visit_rgb)
+
+        idx = len(year_idx) - 1
+
+    n_minus_one_idx = np.flatnonzero(n_minus_one)
+
+    if len(n_minus_one_idx):
+        visit_rgb = tuple(
+            hsl2rgbint_array(
+                np.array([YEAR_N_MINUS_ONE_HSL[0] - idx * (0.001)]),
+                YEAR_N_MINUS_ONE_HSL[1],
+                YEAR_N_MINUS_ONE_HSL[2],
+            )[0].tolist()
+        )
+
+        for visit_idx in n_minus_one_idx.tolist():
+            visits[visit_idx]["colour"] = visit_rgb
+
+    return patient_dict
+
+
+def rank_new_visits(kept_ranks: list, kept_wpis: list, new_visits: list) -> list:
+    # New visits are slotted in between the kept visits with the neighbouring
+    # WPIs, so none of the kept ranks (and colours) have to move. Visits after
+    # the last kept one continue its ranks one by one, as a full recompute
+    # would have numbered them
+    gaps = {}
+
+    for visit in sorted(new_visits, key=itemgetter("WPI")):
+        gaps.setdefault(bisect_right(kept_wpis, visit["WPI"]), []).append(visit)
+
+    ranked = []
+
+    for position, gap_visits in gaps.items():
+        n_new = len(gap_visits)
+
+        if not kept_ranks:
+            new_ranks = [float(i) for i in range(n_new)]
+        elif position == len(kept_ranks):
+            new_ranks = [kept_ranks[-1] + i + 1 for i in range(n_new)]
+        elif position == 0:
+            new_ranks = [kept_ranks[0] - n_new + i for i in range(n_new)]
+        else:
+            low, high = kept_ranks[position - 1], kept_ranks[position]
+            new_ranks = [low + (high - low) * (i + 1) / (n_new + 1) for i in range(n_new)]
+
+        ranked.extend(zip(new_ranks, gap_visits))
+
+    return ranked
+
+
+def assign_colours_incrementally(
+    patient_dict: dict,
+    previous_ranks: dict | None = None,
+    n_minus_one_rank: float | None = None,
+) -> tuple:
+    """
+    Assign colours like assign_colours_to_patients, but keep the colours of
+    the visits that were already coloured in a previous assignment.
+
+    A visit's colour within its year comes from its rank in the year's WPI
+    order. Visits whose WPI is unchanged keep their previous rank and any new
+    visits are given ranks between those of their neighbours, so adding visits
+    never changes the colours of the others. Without a previous assignment the
+    ranks, and so the colours, are the same as assign_colours_to_patients'.
+
+    Args:
+        patient_dict (dict): Patients dict, as returned by lookup_to_dict
+        previous_ranks (dict): (WPI, rank) of each previously coloured yearly
+            visit, keyed by (CAP, visit code)
+        n_minus_one_rank (float): Rank the previous n-1 colour was made from
+
+    Returns:
+        tuple: The patients dict with its colours filled in, the new
+            previous_ranks and the new n_minus_one_rank
+    """
+    previous_ranks = previous_ranks or {}
+    years = {}
+    n_minus_one_visits = []
+
+    for patient_id, visits in patient_dict.items():
+        for visit in visits.values():
+            if visit["YOI"] != 1 and visit["YPA"] != 0:
+                kept, new = years.setdefault(visit["YOI"], ([], []))
+                previous = previous_ranks.get((patient_id, visit["code"]))
+
+                if previous is not None and previous[0] == visit["WPI"]:
+                    kept.append((previous[1], visit))
+                else:
+                    new.append(visit)
+
+            elif visit["YOI"] != 1 and visit["YPA"] == 0:
+                n_minus_one_visits.append(visit)
+
+    ranks = {}
+    idx = 0
+
+    for year, (kept, new) in years.items():
+        kept.sort(key=itemgetter(0))
+        ranked = kept + rank_new_visits(
+            [rank for rank, _ in kept], [visit["WPI"] for _, visit in kept], new
+        )
+
+        year_base_hsl = colour_lookup_hsl[year]
+        year_ranks = np.array([rank for rank, _ in ranked], dtype=np.float64)
+        rgb = hsl2rgbint_array(
+            year_base_hsl[0] + year_ranks * (0.001), year_base_hsl[1], year_base_hsl[2]
+        ).tolist()
+
+        for (rank, visit), visit_rgb in zip(ranked, rgb):
+            visit["colour"] = tuple(visit_rgb)
+            ranks[(visit["CAP"], visit["code"])] = (visit["WPI"], rank)
+
+        # Same leftover index as assign_colours_to_patients uses for n-1 visits
+        idx = len(ranked) - 1
+
+    if n_minus_one_rank is None:
+        n_minus_one_rank = idx
+
+    if n_minus_one_visits:
+        visit_rgb = tuple(
+            hsl2rgbint_array(
+                np.array([YEAR_N_MINUS_ONE_HSL[0] - n_minus_one_rank * (0.001)]),
+                YEAR_N_MINUS_ONE_HSL[1],
+                YEAR_N_MINUS_ONE_HSL[2],
+            )[0].tolist()
+        )
+
+        for visit in n_minus_one_visits:
+            visit["colour"] = visit_rgb
+
+    return patient_dict, ranks, n_minus_one_rank
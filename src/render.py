@@ -0,0 +1,315 @@
+# A native renderer for routine QC images, drawing the same circular and
+# rectangular phylograms as Dendroscope without a JVM or an X server.
+#
+# The layout follows the Dendroscope command we generate:
+#     1) Children are ladderized to the right (smaller clades first)
+#     2) Leaves are spread evenly, internal nodes sit between their children
+#     3) Node depth is the sum of the branch lengths from the root
+# Leaves are styled with the same GroupStyles that dendro_interface generates,
+# so the colours, fonts and OGV node shapes match the Dendroscope output.
+
+import math
+from pathlib import Path
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+import dendro_interface as dendroscope
+import tree as compact_tree
+
+WIDTH = 1920
+HEIGHT = 1080
+DPI = 100
+ARC_POINTS_PER_TURN = 360
+# Dendroscope sets fill colours with an alpha of 150 out of 255
+FILL_ALPHA = 150 / 255
+# Past this many leaves the labels overlap on a 1080 pixel image anyway, and
+# drawing a text artist per leaf takes most of the render, so the leaves are
+# drawn as dots in their label colour instead
+MAX_LABELLED_LEAVES = 100
+LEAF_DOT_SIZE = 4
+
+
+def layout_tree(tree_obj: compact_tree.Tree) -> tuple:
+    """
+    Work out the position of every node of a tree.
+
+    Args:
+        tree_obj (Tree): The tree to lay out
+
+    Returns:
+        tuple: Lists of the x (depth) and y (leaf rank) of each node, the
+            ladderized preorder of the nodes, and the number of leaves
+    """
+    n_nodes = len(tree_obj)
+    root = tree_obj.root.index
+
+    # Preorder with the file's child order, to count the leaves under each node
+    preorder = []
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+        preorder.append(node)
+        stack.extend(tree_obj.children(node))
+
+    leaf_counts = [0] * n_nodes
+
+    for node in reversed(preorder):
+        children = tree_obj.children(node)
+        leaf_counts[node] = (
+            1 if not children else sum(leaf_counts[child] for child in children)
+        )
+
+    x = [0.0] * n_nodes
+    y = [0.0] * n_nodes
+    ladderized = []
+    next_leaf = 0
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+        ladderized.append(node)
+        parent = tree_obj.parent(node)
+
+        if parent >= 0:
+            branch_length = tree_obj.branch_length(node)
+            x[node] = x[parent] + (0.0 if math.isnan(branch_length) else branch_length)
+
+        children = tree_obj.children(node)
+
+        if not children:
+            y[node] = next_leaf
+            next_leaf += 1
+            continue
+
+        # Pushed largest first, so the smallest clade is drawn first
+        stack.extend(sorted(children, key=lambda child: -leaf_counts[child]))
+
+    for node in reversed(ladderized):
+        children = tree_obj.children(node)
+        if children:
+            y[node] = (
+                min(y[child] for child in children) + max(y[child] for child in children)
+            ) / 2
+
+    return x, y, ladderized, next_leaf
+
+
+def parse_colour(dendro_colour: str) -> tuple:
+    return tuple(int(channel) / 255 for channel in dendro_colour.split())
+
+
+def parse_font(dendro_font: str) -> dict:
+    # Dendroscope fonts look like "arial-italic-8" or "arial-bold-16"
+    _, font_style, font_size = dendro_font.split("-")
+
+    return {
+        "family": "sans-serif",
+        "fontsize": int(font_size),
+        "fontstyle": "italic" if "italic" in font_style else "normal",
+        "fontweight": "bold" if "bold" in font_style else "normal",
+    }
+
+
+def get_leaf_styles(tree_obj: compact_tree.Tree, patient_visits: dict) -> dict:
+    leaf_indices = list(tree_obj.leaf_indices())
+    leaf_style_by_name = dendroscope.get_leaf_styles(
+        patient_visits, [tree_obj.label(leaf) for leaf in leaf_indices]
+    )
+
+    return {
+        leaf: leaf_style_by_name[tree_obj.label(leaf)]
+        for leaf in leaf_indices
+        if tree_obj.label(leaf) in leaf_style_by_name
+    }
+
+
+def get_label_colour(style) -> tuple:
+    if style is not None and style.colour:
+        return parse_colour(style.colour)
+
+    return (0, 0, 0)
+
+
+def draw_label(axes, position: tuple, label: str, style, rotation: float = 0, align: str = "left"):
+    text_kwargs = {"fontsize": 8, "family": "sans-serif"}
+
+    if style is not None and style.font:
+        text_kwargs = parse_font(style.font)
+
+    axes.text(
+        position[0],
+        position[1],
+        f" {label} ",
+        color=get_label_colour(style),
+        rotation=rotation,
+        rotation_mode="anchor",
+        horizontalalignment=align,
+        verticalalignment="center",
+        **text_kwargs,
+    )
+
+
+def draw_leaf_dots(axes, leaf_styles: dict, positions: dict):
+    # One artist for all the leaves, rather than a label each
+    leaves = list(positions)
+
+    axes.scatter(
+        [positions[leaf][0] for leaf in leaves],
+        [positions[leaf][1] for leaf in leaves],
+        s=LEAF_DOT_SIZE,
+        c=[get_label_colour(leaf_styles.get(leaf)) for leaf in leaves],
+        marker="o",
+        linewidths=0,
+        zorder=2,
+    )
+
+
+def draw_node_shapes(axes, leaf_styles: dict, positions: dict):
+    # One scatter per marker, rather than one per leaf
+    shapes = {}
+
+    for leaf, style in leaf_styles.items():
+        if not style.shape:
+            continue
+
+        shape = shapes.setdefault(
+            "s" if style.shape == "rectangle" else "o",
+            {"x": [], "y": [], "s": [], "facecolors": [], "edgecolors": []},
+        )
+        fill = parse_colour(style.fillcolour) if style.fillcolour else (1, 1, 1)
+        shape["x"].append(positions[leaf][0])
+        shape["y"].append(positions[leaf][1])
+        shape["s"].append(int(style.size or 5) ** 2 / 2)
+        shape["facecolors"].append(fill + (FILL_ALPHA,))
+        shape["edgecolors"].append(get_label_colour(style))
+
+    for marker, shape in shapes.items():
+        axes.scatter(marker=marker, zorder=3, **shape)
+
+
+def new_axes() -> tuple:
+    figure = Figure(figsize=(WIDTH / DPI, HEIGHT / DPI), dpi=DPI)
+    FigureCanvasAgg(figure)
+    axes = figure.add_axes((0.02, 0.02, 0.96, 0.96))
+    axes.set_axis_off()
+
+    return figure, axes
+
+
+def render_rectangular(tree_obj: compact_tree.Tree, leaf_styles: dict, output_file: Path):
+    x, y, ladderized, n_leaves = layout_tree(tree_obj)
+    figure, axes = new_axes()
+    segments = []
+
+    for node in ladderized:
+        parent = tree_obj.parent(node)
+        if parent >= 0:
+            segments.append(((x[parent], y[node]), (x[node], y[node])))
+
+        children = tree_obj.children(node)
+        if children:
+            child_ys = [y[child] for child in children]
+            segments.append(((x[node], min(child_ys)), (x[node], max(child_ys))))
+
+    axes.add_collection(LineCollection(segments, colors="black", linewidths=0.5))
+
+    positions = {node: (x[node], y[node]) for node in ladderized if tree_obj.is_leaf(node)}
+
+    if n_leaves > MAX_LABELLED_LEAVES:
+        draw_leaf_dots(axes, leaf_styles, positions)
+    else:
+        for node, position in positions.items():
+            draw_label(axes, position, tree_obj.label(node), leaf_styles.get(node))
+
+    draw_node_shapes(axes, leaf_styles, positions)
+
+    max_depth = max(x) or 1.0
+    axes.set_xlim(-0.01 * max_depth, max_depth * 1.3)
+    # Dendroscope draws the first leaf at the top
+    axes.set_ylim(n_leaves, -1)
+
+    figure.savefig(output_file, format="png")
+
+
+def render_circular(tree_obj: compact_tree.Tree, leaf_styles: dict, output_file: Path):
+    x, y, ladderized, n_leaves = layout_tree(tree_obj)
+    figure, axes = new_axes()
+    segments = []
+
+    def angle(node: int) -> float:
+        return 2 * math.pi * y[node] / max(n_leaves, 1)
+
+    def polar(radius: float, theta: float) -> tuple:
+        return (radius * math.cos(theta), radius * math.sin(theta))
+
+    for node in ladderized:
+        parent = tree_obj.parent(node)
+        if parent >= 0:
+            segments.append((polar(x[parent], angle(node)), polar(x[node], angle(node))))
+
+        children = tree_obj.children(node)
+        if children:
+            start = min(angle(child) for child in children)
+            end = max(angle(child) for child in children)
+            n_points = max(2, int((end - start) / (2 * math.pi) * ARC_POINTS_PER_TURN))
+            segments.append(
+                [
+                    polar(x[node], start + (end - start) * step / (n_points - 1))
+                    for step in range(n_points)
+                ]
+            )
+
+    axes.add_collection(LineCollection(segments, colors="black", linewidths=0.5))
+
+    positions = {
+        node: polar(x[node], angle(node)) for node in ladderized if tree_obj.is_leaf(node)
+    }
+
+    if n_leaves > MAX_LABELLED_LEAVES:
+        draw_leaf_dots(axes, leaf_styles, positions)
+    else:
+        for node, position in positions.items():
+            rotation = math.degrees(angle(node))
+
+            # Keep the labels on the left half readable
+            if 90 < rotation < 270:
+                draw_label(axes, position, tree_obj.label(node), leaf_styles.get(node),
+                           rotation=rotation - 180, align="right")
+            else:
+                draw_label(axes, position, tree_obj.label(node), leaf_styles.get(node),
+                           rotation=rotation)
+
+    draw_node_shapes(axes, leaf_styles, positions)
+
+    max_depth = max(x) or 1.0
+    axes.set_aspect("equal")
+    axes.set_xlim(-max_depth * 1.4, max_depth * 1.4)
+    axes.set_ylim(-max_depth * 1.4, max_depth * 1.4)
+
+    figure.savefig(output_file, format="png")
+
+
+def render_tree(
+    tree_file: Path,
+    patient_visits: dict,
+    main_output_file: Path,
+    linear_output_file: Path,
+):
+    """
+    Render the circular and rectangular phylograms of a tree, styled for a
+    patient's visits, without Dendroscope.
+
+    Args:
+        tree_file (Path): Path to the Newick tree
+        patient_visits (dict): The patient's visits, keyed by visit code
+        main_output_file (Path): Where to write the circular phylogram
+        linear_output_file (Path): Where to write the rectangular phylogram
+    """
+    tree_obj = compact_tree.Tree.from_newick(tree_file)
+    leaf_styles = get_leaf_styles(tree_obj, patient_visits)
+
+    render_circular(tree_obj, leaf_styles, main_output_file)
+    render_rectangular(tree_obj, leaf_styles, linear_output_file)
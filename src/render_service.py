@@ -0,0 +1,363 @@
+# A local HTTP service that renders trees on request, for notebooks that
+# would otherwise call process-file once per tree and pay for starting Python
+# and parsing the lookup table every time.
+#
+# The lookup table is loaded once, when the service starts. Trees are queued
+# into a pool of workers and every tree is a job, rendered into a directory of
+# its own under output_directory/jobs, so the same tree can be submitted
+# twice without the renders writing over each other.
+#
+#     POST /jobs         {"tree_file": "/data/trees/CAP336_NEF.nwk"}
+#                        {"name": "CAP336_NEF.nwk", "newick": "((...));"}
+#                        or a list of these, to queue several trees at once
+#     GET  /jobs/<id>    the job's status and output files. With ?wait=30,
+#                        waits up to 30 seconds for the job to finish first
+#     GET  /status       how many jobs are queued, running, done and failed
+#
+# Only the standard library is used, so the service runs wherever main.py
+# does. It listens on localhost unless told otherwise, and takes paths to any
+# file the service can read, so it is not meant to be exposed further.
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+# Jobs waiting for a worker beyond this are turned away with a 503
+MAX_QUEUED_JOBS = 10000
+# Finished jobs are forgotten, oldest first, past this many
+MAX_FINISHED_JOBS = 10000
+# Longest a GET /jobs/<id>?wait= request waits for
+MAX_WAIT_SECONDS = 300
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobError(Exception):
+    """A request the service can't act on, with the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def run_job(
+    render_tree: Callable,
+    tree_file: Path,
+    cap_id: str,
+    patient_dict: dict,
+    job_directory: Path,
+) -> int:
+    (job_directory / "tmp").mkdir(parents=True, exist_ok=True)
+    (job_directory / "logs").mkdir(exist_ok=True)
+
+    return render_tree(tree_file, cap_id, patient_dict, job_directory)
+
+
+class Job:
+    def __init__(
+        self,
+        job_id: str,
+        tree_file: Path,
+        cap_id: str,
+        job_directory: Path,
+        future: Future,
+    ):
+        self.job_id = job_id
+        self.tree_file = tree_file
+        self.cap_id = cap_id
+        self.job_directory = job_directory
+        self.future = future
+        self.submitted = time.time()
+        self.finished = None
+
+        future.add_done_callback(self.set_finished)
+
+    def set_finished(self, _future: Future):
+        self.finished = time.time()
+
+    def status(self) -> str:
+        if not self.future.done():
+            return RUNNING if self.future.running() else QUEUED
+
+        if self.future.cancelled() or self.future.exception() is not None:
+            return FAILED
+
+        return DONE if self.future.result() == 0 else FAILED
+
+    def describe(self, get_output_files: Callable) -> dict:
+        status = self.status()
+        description = {
+            "id": self.job_id,
+            "status": status,
+            "tree_file": str(self.tree_file),
+            "cap_id": self.cap_id,
+            "job_directory": str(self.job_directory),
+            "submitted": self.submitted,
+            "finished": self.finished,
+        }
+
+        if status == DONE:
+            description["outputs"] = [
+                str(output_file)
+                for output_file in get_output_files(self.tree_file, self.job_directory)
+            ]
+        elif status == FAILED:
+            if self.future.cancelled():
+                description["error"] = "Cancelled"
+            elif self.future.exception() is not None:
+                description["error"] = repr(self.future.exception())
+            else:
+                description["error"] = f"Dendroscope exited with code {self.future.result()}"
+
+        return description
+
+
+class RenderService:
+    """
+    The jobs of the service and the worker pool that renders them.
+
+    Args:
+        patients_dict (dict): The lookup table's patients, keyed by CAP id
+        output_directory (Path): Directory the job directories are made in
+        executor (Executor): The worker pool to render the trees in
+        render_tree (Callable): Renders a (tree file, CAP id, patient dict,
+            output directory) and returns Dendroscope's exit code
+        get_output_files (Callable): The output files of a (tree file, output
+            directory)
+        max_queued (int): Number of jobs that may wait for a worker
+    """
+
+    def __init__(
+        self,
+        patients_dict: dict,
+        output_directory: Path,
+        executor,
+        render_tree: Callable,
+        get_output_files: Callable,
+        max_queued: int = MAX_QUEUED_JOBS,
+    ):
+        self.patients_dict = patients_dict
+        self.jobs_directory = output_directory / "jobs"
+        self.executor = executor
+        self.render_tree = render_tree
+        self.get_output_files = get_output_files
+        self.max_queued = max_queued
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def counts(self) -> dict:
+        with self.lock:
+            jobs = list(self.jobs.values())
+
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+
+        for job in jobs:
+            counts[job.status()] += 1
+
+        return counts
+
+    def read_request(self, request: dict, job_directory: Path) -> tuple:
+        # The tree file of a request, and the Newick text to write to it when
+        # the text was sent rather than the path
+        if not isinstance(request, dict):
+            raise JobError("Each tree must be a JSON object")
+
+        if "tree_file" in request:
+            tree_file = Path(request["tree_file"])
+
+            if not tree_file.is_file():
+                raise JobError(f"No tree file at {tree_file}")
+
+            return tree_file, None
+
+        if "name" in request and "newick" in request:
+            name = Path(str(request["name"])).name
+
+            if not name.endswith(".nwk"):
+                raise JobError(f"Tree names must end in .nwk, got {name!r}")
+
+            return job_directory / name, str(request["newick"])
+
+        raise JobError('Give either "tree_file", or "name" and "newick"')
+
+    def submit(self, requests: list) -> list:
+        """
+        Queue a tree for each request, or none of them if any is invalid.
+
+        Args:
+            requests (list): Requests as described at the top of this module
+
+        Returns:
+            list: The queued jobs
+        """
+        trees = []
+
+        for request in requests:
+            job_id = uuid.uuid4().hex
+            job_directory = self.jobs_directory / job_id
+            tree_file, newick_text = self.read_request(request, job_directory)
+            cap_id = tree_file.stem.split("_")[0]
+
+            # The store reads a CAP at a time through one connection
+            with self.lock:
+                patient_dict = self.patients_dict.get(cap_id)
+
+            if patient_dict is None:
+                raise JobError(
+                    f"Failed to find the CAP_ID {cap_id} in the provided lookup table"
+                )
+
+            trees.append((job_id, tree_file, newick_text, cap_id, patient_dict, job_directory))
+
+        if self.counts()[QUEUED] + len(trees) > self.max_queued:
+            raise JobError("The queue is full, try again later", status=503)
+
+        jobs = []
+
+        for job_id, tree_file, newick_text, cap_id, patient_dict, job_directory in trees:
+            if newick_text is not None:
+                job_directory.mkdir(parents=True, exist_ok=True)
+                tree_file.write_text(newick_text)
+
+            future = self.executor.submit(
+                run_job, self.render_tree, tree_file, cap_id, patient_dict, job_directory
+            )
+            job = Job(job_id, tree_file, cap_id, job_directory, future)
+            jobs.append(job)
+
+            logging.info(f"Queued job {job_id} for {tree_file}", extra={"patient_id": cap_id})
+
+        with self.lock:
+            for job in jobs:
+                self.jobs[job.job_id] = job
+
+            self.forget_finished_jobs()
+
+        return jobs
+
+    def forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.future.done()]
+
+        for job_id in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id: str, wait_seconds: float = 0) -> Job:
+        with self.lock:
+            job = self.jobs.get(job_id)
+
+        if job is None:
+            raise JobError(f"No job {job_id}", status=404)
+
+        if wait_seconds > 0:
+            wait([job.future], timeout=min(wait_seconds, MAX_WAIT_SECONDS))
+
+        return job
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server_version = "DendroRenderService/1.0"
+
+    @property
+    def service(self) -> RenderService:
+        return self.server.service
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+
+        if status == 503:
+            self.send_header("Retry-After", "1")
+
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, respond: Callable):
+        try:
+            self.send_json(*respond())
+        except JobError as job_err:
+            self.send_json(job_err.status, {"error": str(job_err)})
+        except Exception as request_err:
+            logging.exception(f"Failed to answer {self.command} {self.path}")
+            self.send_json(500, {"error": repr(request_err)})
+
+    def do_GET(self):
+        self.handle_request(self.respond_to_get)
+
+    def do_POST(self):
+        self.handle_request(self.respond_to_post)
+
+    def respond_to_get(self) -> tuple:
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts == ["status"]:
+            return 200, self.service.counts()
+
+        if len(parts) == 2 and parts[0] == "jobs":
+            try:
+                wait_seconds = float(parse_qs(url.query).get("wait", ["0"])[0])
+            except ValueError:
+                raise JobError("wait must be a number of seconds")
+
+            job = self.service.get(parts[1], wait_seconds)
+
+            return 200, job.describe(self.service.get_output_files)
+
+        raise JobError(f"No such resource {url.path}", status=404)
+
+    def respond_to_post(self) -> tuple:
+        if urlsplit(self.path).path.strip("/") != "jobs":
+            raise JobError(f"No such resource {self.path}", status=404)
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            raise JobError("The request body must be JSON")
+
+        jobs = self.service.submit(body if isinstance(body, list) else [body])
+        descriptions = [job.describe(self.service.get_output_files) for job in jobs]
+
+        if isinstance(body, list):
+            return 202, {"jobs": descriptions}
+
+        return 202, descriptions[0]
+
+    def log_message(self, format: str, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(service: RenderService, host: str, port: int):
+    """
+    Answer requests until interrupted.
+
+    Args:
+        service (RenderService): The service to answer requests with
+        host (str): Address to listen on
+        port (int): Port to listen on
+    """
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+
+    logging.info(f"Serving renders on http://{host}:{server.server_port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stopping the render service")
+    finally:
+        server.server_close()
@@ -0,0 +1,139 @@
+# Splits a process-dir run across the tasks of a cluster array job.
+#
+# Each task is given --shard i/N and only renders the trees of the CAPs that
+# hash to shard i, so every tree of a CAP is rendered by the same task and
+# each task only needs the lookup rows of its own CAPs. The hash is a SHA-256
+# of the CAP id rather than Python's hash(), which is salted per process, so a
+# CAP lands on the same shard in every task and every run.
+#
+# Shards share the output directory but keep their own manifest, journal and
+# metrics file, named after the shard (manifest.shard-3-of-10.json), since the
+# tasks write them at the same time. Once every task is done, merge-shards
+# combines the shard manifests into the directory's manifest.json and reports
+# the CAPs that no shard rendered or that more than one shard did.
+#
+# A merge replaces manifest.json, so it is only done once every shard has left
+# a manifest behind: merging the shards of a run that is still going, or given
+# the wrong shard count, would drop the trees of the missing shards from it and
+# the next run would render them all again. A partial merge adds the shards
+# there are to the existing manifest instead.
+
+import hashlib
+import logging
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import manifest as incremental
+
+
+def parse_shard(shard: str) -> tuple:
+    """
+    Parse a shard given as i/N, with i counted from 0.
+
+    Args:
+        shard (str): The shard, e.g. "3/10"
+
+    Returns:
+        tuple: The shard's index and the number of shards
+    """
+    index, _, n_shards = shard.partition("/")
+
+    try:
+        index, n_shards = int(index), int(n_shards)
+    except ValueError:
+        raise ValueError(f"Expected a shard like 3/10, got {shard!r}")
+
+    if not 0 <= index < n_shards:
+        raise ValueError(f"The shard index must be between 0 and {n_shards - 1}, got {index}")
+
+    return index, n_shards
+
+
+def get_shard_name(shard: tuple) -> str:
+    index, n_shards = shard
+
+    return f"shard-{index}-of-{n_shards}"
+
+
+def get_shard_index(cap_id: str, n_shards: int) -> int:
+    cap_hash = hashlib.sha256(cap_id.encode("utf-8")).digest()
+
+    return int.from_bytes(cap_hash[:8], "big") % n_shards
+
+
+def iter_shard_tree_files(tree_files: Iterable, shard: tuple) -> Iterator[Path]:
+    index, n_shards = shard
+
+    for tree_file in tree_files:
+        if get_shard_index(tree_file.stem.split("_")[0], n_shards) == index:
+            yield tree_file
+
+
+def merge_shard_manifests(
+    output_directory: Path,
+    n_shards: int,
+    tree_files: Iterable | None = None,
+    partial: bool = False,
+) -> dict:
+    """
+    Combine the manifests of every shard of a run into the output directory's
+    manifest. If a shard has no manifest, the output directory's manifest is
+    left alone, unless partial is set.
+
+    Args:
+        output_directory (Path): The output directory the shards shared
+        n_shards (int): Number of shards the run was split into
+        tree_files (Iterable): The trees the run was given, to report the CAPs
+            none of the shards rendered
+        partial (bool): Merge the shards that have a manifest into the
+            existing manifest, rather than replace it with all of them
+
+    Returns:
+        dict: The shards without a manifest, the CAPs more than one shard
+            rendered with the shards that did, and the CAPs with trees that no
+            shard rendered
+    """
+    merged = incremental.load_manifest(output_directory) if partial else {}
+    cap_shards = {}
+    missing_shards = []
+
+    for index in range(n_shards):
+        shard_name = get_shard_name((index, n_shards))
+
+        if not incremental.get_manifest_path(output_directory, shard_name).exists():
+            missing_shards.append(index)
+            continue
+
+        for tree_name, fingerprint in incremental.load_manifest(
+            output_directory, shard_name
+        ).items():
+            merged[tree_name] = fingerprint
+            cap_shards.setdefault(fingerprint["CAP"], set()).add(index)
+
+    missing_caps = set()
+
+    for tree_file in tree_files or ():
+        if tree_file.name not in merged:
+            missing_caps.add(tree_file.stem.split("_")[0])
+
+    if missing_shards and not partial:
+        logging.warning(
+            f"{len(missing_shards)} of {n_shards} shards have no manifest, "
+            f"leaving {incremental.get_manifest_path(output_directory)} as it was"
+        )
+    else:
+        incremental.save_manifest(output_directory, merged)
+        logging.info(
+            f"Merged the manifests of {n_shards - len(missing_shards)} shards, "
+            f"covering {len(cap_shards)} CAPs, into a manifest of {len(merged)} trees"
+        )
+
+    return {
+        "missing_shards": missing_shards,
+        "duplicated_caps": {
+            cap_id: sorted(shard_indices)
+            for cap_id, shard_indices in sorted(cap_shards.items())
+            if len(shard_indices) > 1
+        },
+        "missing_caps": sorted(missing_caps),
+    }
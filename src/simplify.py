@@ -0,0 +1,282 @@
+# Shrinks very large NGS trees before they are rendered. Dendroscope's time and
+# memory grow with the number of nodes, and the biggest trees have tens of
+# thousands of haplotypes, most of them from the same visit and many of them
+# seen only a handful of times.
+#
+# Two reductions can be applied, using the fields of the leaf labels:
+#     1) Haplotypes below a read count or frequency threshold are dropped.
+#        Internal nodes left with a single child are merged into it.
+#     2) Clades whose remaining leaves are all NGS haplotypes from the same
+#        visit are collapsed into one leaf, labelled after the clade's most
+#        read haplotype but carrying the whole clade's count and frequency.
+#        It keeps the WPI field, so the visit styles still match it, and gets
+#        a last field numbering the collapsed leaves of the tree
+#        (..._NGS_1200_0.08_collapsed3), since sibling clades of a visit can
+#        add up to the same count and frequency and labels must be unique.
+# OGV sequences and labels outside the naming scheme are never dropped or
+# collapsed.
+#
+# The reduced tree is written to tmp/simplified/ under the original file name,
+# along with a JSON record of which haplotypes were dropped and which leaves
+# each collapsed leaf stands for.
+
+import json
+import math
+import re
+from pathlib import Path
+
+import numpy as np
+
+import tree as compact_tree
+from leaf_index import MISSING_COUNT, LeafIndex
+
+# Values of a clade's WPI besides the WPI its leaves share
+MIXED = -2  # leaves from more than one visit, or leaves that aren't NGS
+EMPTY = -3  # every leaf was dropped
+
+NEWICK_SPECIAL_RE = re.compile(r"[\s(),:;\[\]']")
+
+
+class SimplifyOptions:
+    """
+    Which reductions to apply to a tree before rendering it.
+
+    Args:
+        collapse_same_wpi (bool): Collapse clades of haplotypes from one visit
+        min_count (int): Drop NGS haplotypes with fewer reads than this
+        min_frequency (float): Drop NGS haplotypes with a lower frequency
+    """
+
+    def __init__(
+        self,
+        collapse_same_wpi: bool = False,
+        min_count: int = 0,
+        min_frequency: float = 0.0,
+    ):
+        self.collapse_same_wpi = collapse_same_wpi
+        self.min_count = int(min_count)
+        self.min_frequency = float(min_frequency)
+
+    def is_enabled(self) -> bool:
+        return self.collapse_same_wpi or self.min_count > 0 or self.min_frequency > 0
+
+    def describe(self) -> str:
+        return (
+            f"collapse_same_wpi={self.collapse_same_wpi} "
+            f"min_count={self.min_count} min_frequency={self.min_frequency}"
+        )
+
+
+def quote_label(label: str) -> str:
+    if NEWICK_SPECIAL_RE.search(label):
+        return "'" + label.replace("'", "''") + "'"
+
+    return label
+
+
+def format_length(length: float, extra_length: float = 0.0) -> str:
+    if math.isnan(length):
+        if not extra_length:
+            return ""
+        length = 0.0
+
+    return f":{length + extra_length:.10g}"
+
+
+def get_dropped_leaves(leaf_index: LeafIndex, options: SimplifyOptions) -> np.ndarray:
+    count = leaf_index.count
+    dropped = leaf_index.is_ngs & (
+        ((count != MISSING_COUNT) & (count < options.min_count))
+        | (leaf_index.frequency < options.min_frequency)
+    )
+
+    # An empty tree can't be rendered at all, so the thresholds give way
+    if dropped.all():
+        dropped[:] = False
+
+    return dropped
+
+
+def get_clade_wpis(tree: compact_tree.Tree, leaf_ids: list, leaf_wpis: np.ndarray) -> tuple:
+    # The WPI shared by the remaining leaves under each node and how many
+    # remaining leaves there are. Nodes are numbered in preorder, so walking
+    # them backwards folds every child into its parent before the parent is
+    # folded into its own
+    clade_wpis = np.full(len(tree), EMPTY, dtype=np.int64)
+    clade_wpis[leaf_ids] = leaf_wpis
+    n_leaves = np.zeros(len(tree), dtype=np.int64)
+    n_leaves[leaf_ids] = leaf_wpis != EMPTY
+
+    for node in range(len(tree) - 1, 0, -1):
+        parent = tree.parent(node)
+        child_wpi = clade_wpis[node]
+        n_leaves[parent] += n_leaves[node]
+
+        if child_wpi == EMPTY or clade_wpis[parent] == child_wpi:
+            continue
+
+        clade_wpis[parent] = child_wpi if clade_wpis[parent] == EMPTY else MIXED
+
+    return clade_wpis, n_leaves
+
+
+def iter_clade_leaves(tree: compact_tree.Tree, node: int, clade_wpis: np.ndarray):
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+
+        if tree.is_leaf(node):
+            yield node
+            continue
+
+        stack.extend(
+            child for child in reversed(tree.children(node)) if clade_wpis[child] != EMPTY
+        )
+
+
+def collapse_clade(
+    tree: compact_tree.Tree,
+    node: int,
+    clade_wpis: np.ndarray,
+    leaf_positions: dict,
+    leaf_index: LeafIndex,
+    clade_number: int,
+) -> tuple:
+    # The label and branch length of the leaf standing in for a clade, and the
+    # labels of the leaves it stands for
+    members = list(iter_clade_leaves(tree, node, clade_wpis))
+    positions = [leaf_positions[member] for member in members]
+    counts = leaf_index.count[positions]
+    frequencies = leaf_index.frequency[positions]
+    representative = members[int(np.argmax(counts))]
+
+    fields = tree.label(representative).split("_")
+    fields += [""] * (8 - len(fields))
+    fields[6] = str(int(counts[counts != MISSING_COUNT].sum()))
+    fields[7] = f"{np.nansum(frequencies):.6g}"
+    fields.append(f"collapsed{clade_number}")
+
+    # Place the leaf where its representative was, relative to the clade
+    depth = 0.0
+    ancestor = representative
+
+    while ancestor != node:
+        if not math.isnan(tree.branch_length(ancestor)):
+            depth += tree.branch_length(ancestor)
+        ancestor = tree.parent(ancestor)
+
+    return "_".join(fields), depth, [tree.label(member) for member in members]
+
+
+def simplify_tree(tree_file: Path, options: SimplifyOptions) -> tuple:
+    """
+    Apply the reductions in options to a Newick tree.
+
+    Args:
+        tree_file (Path): Path to the Newick file
+        options (SimplifyOptions): The reductions to apply
+
+    Returns:
+        tuple: The reduced tree as Newick text, its leaf labels in order and a
+            record of what was dropped and collapsed
+    """
+    tree = compact_tree.Tree.from_newick(tree_file)
+    leaf_ids = list(tree.leaf_indices())
+    leaf_index = LeafIndex(tree.label(leaf_id) for leaf_id in leaf_ids)
+    leaf_positions = {leaf_id: position for position, leaf_id in enumerate(leaf_ids)}
+
+    dropped = get_dropped_leaves(leaf_index, options)
+    leaf_wpis = np.where(leaf_index.is_ngs & (leaf_index.wpi > 0), leaf_index.wpi, MIXED)
+    leaf_wpis[dropped] = EMPTY
+    clade_wpis, n_leaves = get_clade_wpis(tree, leaf_ids, leaf_wpis)
+
+    parts = []
+    leaf_names = []
+    collapsed = {}
+    # Items are either text to write out or a (node, extra branch length) to
+    # expand, so trees of any depth are written without recursion
+    stack = [(tree.root.index, 0.0)]
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+
+        node, extra_length = item
+        length = tree.branch_length(node)
+
+        if tree.is_leaf(node):
+            leaf_names.append(tree.label(node))
+            parts.append(quote_label(tree.label(node)) + format_length(length, extra_length))
+            continue
+
+        if options.collapse_same_wpi and clade_wpis[node] > 0 and n_leaves[node] > 1:
+            label, depth, members = collapse_clade(
+                tree, node, clade_wpis, leaf_positions, leaf_index, len(collapsed) + 1
+            )
+            collapsed[label] = members
+            leaf_names.append(label)
+            parts.append(quote_label(label) + format_length(length, extra_length + depth))
+            continue
+
+        children = [child for child in tree.children(node) if clade_wpis[child] != EMPTY]
+
+        # A node left with one child is only a bend in the branch
+        if len(children) == 1:
+            stack.append(
+                (children[0], extra_length + (0.0 if math.isnan(length) else length))
+            )
+            continue
+
+        stack.append(")" + quote_label(tree.label(node)) + format_length(length, extra_length))
+
+        for position, child in enumerate(reversed(children)):
+            if position:
+                stack.append(",")
+            stack.append((child, 0.0))
+
+        stack.append("(")
+
+    report = {
+        "tree": str(tree_file),
+        "options": options.describe(),
+        "leaves": len(leaf_ids),
+        "simplified_leaves": len(leaf_names),
+        "dropped": [name for name, drop in zip(leaf_index.names, dropped) if drop],
+        "collapsed": collapsed,
+    }
+
+    return "".join(parts) + ";\n", leaf_names, report
+
+
+def write_simplified_tree(
+    tree_file: Path, output_directory: Path, options: SimplifyOptions
+) -> tuple:
+    """
+    Write the reduced copy of a tree, and the record of what was removed from
+    it, to the tmp/simplified directory of a run.
+
+    Args:
+        tree_file (Path): Path to the Newick file
+        output_directory (Path): The run's output directory
+        options (SimplifyOptions): The reductions to apply
+
+    Returns:
+        tuple: Path to the reduced tree, the LeafIndex of its leaves and the
+            record of what was dropped and collapsed
+    """
+    simplified_directory = output_directory / "tmp" / "simplified"
+    simplified_directory.mkdir(parents=True, exist_ok=True)
+
+    newick_text, leaf_names, report = simplify_tree(tree_file, options)
+
+    simplified_tree_file = simplified_directory / tree_file.name
+    simplified_tree_file.write_text(newick_text)
+
+    with open(simplified_directory / f"{tree_file.stem}.collapsed.json", "w") as report_fh:
+        json.dump(report, report_fh, indent=4)
+
+    return simplified_tree_file, LeafIndex(leaf_names), report
@@ -1,25 +1,283 @@
-import ete3
+# A compact, read-mostly tree representation.
+#
+# ete3 builds a Python object (with its own dict) for every node, which makes it
+# impossible to hold a whole cohort of NGS trees in memory at once. Here a tree
+# is a handful of flat arrays instead:
+#     1) parents: the index of each node's parent (-1 for the root)
+#     2) branch_lengths: the length of the branch above each node (nan if unset)
+#     3) label_offsets: where each node's label starts in one shared string
+# Nodes are numbered in the order they are first seen in the file, which for
+# Newick is a preorder traversal. Node objects are only thin views onto a tree.
+
+import math
+import xml.etree.ElementTree as ElementTree
+from array import array
 from pathlib import Path
+from typing import Iterator
+
+import newick
+
 
 class Tree:
+    __slots__ = (
+        "parents",
+        "branch_lengths",
+        "label_offsets",
+        "labels",
+        "_child_offsets",
+        "_children",
+    )
+
+    def __init__(self, parents: array, branch_lengths: array, labels: list):
+        self.parents = parents
+        self.branch_lengths = branch_lengths
+
+        self.label_offsets = array("I", [0])
+        for label in labels:
+            self.label_offsets.append(self.label_offsets[-1] + len(label))
+        self.labels = "".join(labels)
+
+        # Built on first use, most callers only need the leaves
+        self._child_offsets: array | None = None
+        self._children: array | None = None
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def __iter__(self) -> Iterator["Node"]:
+        for index in range(len(self)):
+            yield Node(self, index)
+
+    @property
+    def root(self) -> "Node":
+        return Node(self, self.parents.index(-1))
+
+    def node(self, index: int) -> "Node":
+        return Node(self, index)
+
+    def label(self, index: int) -> str:
+        return self.labels[self.label_offsets[index] : self.label_offsets[index + 1]]
+
+    def branch_length(self, index: int) -> float:
+        return self.branch_lengths[index]
+
+    def parent(self, index: int) -> int:
+        return self.parents[index]
+
+    def children(self, index: int) -> array:
+        if self._children is None:
+            self._index_children()
+
+        return self._children[self._child_offsets[index] : self._child_offsets[index + 1]]
+
+    def is_leaf(self, index: int) -> bool:
+        if self._children is None:
+            self._index_children()
+
+        return self._child_offsets[index] == self._child_offsets[index + 1]
+
+    def leaf_indices(self) -> Iterator[int]:
+        for index in range(len(self)):
+            if self.is_leaf(index):
+                yield index
+
+    def leaves(self) -> Iterator["Node"]:
+        for index in self.leaf_indices():
+            yield Node(self, index)
+
+    def leaf_names(self) -> list:
+        return [self.label(index) for index in self.leaf_indices()]
+
+    def nbytes(self) -> int:
+        # Approximate size of the arrays backing the tree, for memory reports
+        size = sum(
+            values.itemsize * len(values)
+            for values in (self.parents, self.branch_lengths, self.label_offsets)
+        )
+        size += len(self.labels.encode("utf-8"))
+
+        if self._children is not None:
+            size += self._children.itemsize * len(self._children)
+            size += self._child_offsets.itemsize * len(self._child_offsets)
+
+        return size
+
+    def _index_children(self):
+        # Lay the children out contiguously per parent (CSR style), keeping the
+        # order in which they appear in the file
+        counts = array("I", bytes(4 * (len(self) + 1)))
+
+        for parent in self.parents:
+            if parent >= 0:
+                counts[parent + 1] += 1
+
+        child_offsets = array("I", counts)
+        for index in range(1, len(child_offsets)):
+            child_offsets[index] += child_offsets[index - 1]
+
+        children = array("i", bytes(4 * (len(self) - 1 if len(self) else 0)))
+        fill = array("I", child_offsets)
 
-    def __init__(ete_tree: ete3.Tree):
-        self.ete_tree = ete_tree
-        self.nodes = []
-        pass
+        for index, parent in enumerate(self.parents):
+            if parent >= 0:
+                children[fill[parent]] = index
+                fill[parent] += 1
 
+        self._child_offsets = child_offsets
+        self._children = children
 
-    def populate_nodes(self):
-        for node in self.ete_tree.get_tree_root().get_leaves():
-            
+    @classmethod
+    def from_newick(cls, newick_filepath: Path) -> "Tree":
+        """
+        Load the first tree of a Newick file.
+
+        Args:
+            newick_filepath (Path): Path to the Newick file
+
+        Returns:
+            Tree: The tree
+        """
+        parents = array("i")
+        branch_lengths = array("d")
+        labels = []
+
+        def add_node(parent: int) -> int:
+            parents.append(parent)
+            branch_lengths.append(math.nan)
+            labels.append("")
+            return len(parents) - 1
+
+        open_nodes = []
+        last_node = -1
+        previous = "("
+
+        for token in newick.iter_tokens(newick_filepath):
+            if token.startswith("["):
+                continue
+
+            if token == "(":
+                last_node = add_node(open_nodes[-1] if open_nodes else -1)
+                open_nodes.append(last_node)
+            elif token in (",", ")"):
+                # An unlabelled leaf, as in "(,A)" or "(A,)"
+                if previous in ("(", ","):
+                    last_node = add_node(open_nodes[-1])
 
+                if token == ")":
+                    last_node = open_nodes.pop()
+            elif token == ";":
+                break
+            elif token == ":":
+                pass
+            elif previous == ":":
+                branch_lengths[last_node] = float(token)
+            elif previous in ("(", ","):
+                last_node = add_node(open_nodes[-1] if open_nodes else -1)
+                labels[last_node] = newick.label_from_token(token)
+            elif previous == ")":
+                labels[last_node] = newick.label_from_token(token)
+
+            previous = token if token in newick.STRUCTURAL_TOKENS else "label"
+
+        return cls(parents, branch_lengths, labels)
 
     @classmethod
-    def from_nexus(nx_filepath: Path) -> "Tree":
-        pass
+    def from_nexus(cls, nx_filepath: Path) -> "Tree":
+        """
+        Load the first tree of a NeXML file, as written by Dendroscope's
+        `save format=NeXML`.
+
+        Node labels fall back to the label of the node's OTU when the node has
+        none of its own.
+
+        Args:
+            nx_filepath (Path): Path to the NeXML file
+
+        Returns:
+            Tree: The tree
+        """
+        otu_labels = {}
+        node_ids = {}
+        labels = []
+        edges = []
+        in_tree = False
+
+        for event, element in ElementTree.iterparse(
+            str(nx_filepath), events=("start", "end")
+        ):
+            tag = element.tag.rsplit("}", 1)[-1]
+
+            if event == "start":
+                if tag == "tree":
+                    in_tree = True
+                continue
+
+            if tag == "otu":
+                otu_labels[element.get("id")] = element.get("label", "")
+            elif tag == "node" and in_tree:
+                node_ids[element.get("id")] = len(labels)
+                label = element.get("label")
+                if label is None:
+                    label = otu_labels.get(element.get("otu"), "")
+                labels.append(label)
+            elif tag == "edge" and in_tree:
+                edges.append(
+                    (element.get("source"), element.get("target"), element.get("length"))
+                )
+            elif tag == "tree":
+                element.clear()
+                break
+
+            if tag in ("otu", "node", "edge"):
+                element.clear()
+
+        parents = array("i", [-1] * len(labels))
+        branch_lengths = array("d", [math.nan] * len(labels))
+
+        for source, target, length in edges:
+            parents[node_ids[target]] = node_ids[source]
+            if length is not None:
+                branch_lengths[node_ids[target]] = float(length)
+
+        return cls(parents, branch_lengths, labels)
 
 
 class Node:
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: Tree, index: int):
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self) -> str:
+        return f"Node({self.index}, {self.name!r})"
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, Node)
+            and self.tree is other.tree
+            and self.index == other.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    @property
+    def name(self) -> str:
+        return self.tree.label(self.index)
+
+    @property
+    def dist(self) -> float:
+        return self.tree.branch_length(self.index)
+
+    @property
+    def parent(self) -> "Node | None":
+        parent = self.tree.parent(self.index)
+        return None if parent < 0 else Node(self.tree, parent)
+
+    @property
+    def children(self) -> list:
+        return [Node(self.tree, child) for child in self.tree.children(self.index)]
 
-    def __init__():
-        pass
\ No newline at end of file
+    def is_leaf(self) -> bool:
+        return self.tree.is_leaf(self.index)
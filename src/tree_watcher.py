@@ -0,0 +1,178 @@
+# Finds the Newick files that land in a tree directory, for the watch command.
+#
+# Upstream jobs write their trees into the directory over several hours, and
+# a tree must not be rendered before it has been written in full. A file is
+# handed out once:
+#     1) its size and modification time have stayed the same for
+#        settle_seconds, and
+#     2) it ends in the ';' that closes a Newick tree.
+# A file that changes after being handed out is handed out again once it has
+# settled.
+#
+# With inotify_simple installed, the directory's events say which files to
+# look at as soon as they are written. Without it, or on file systems like NFS
+# where writes from other hosts raise no events, the directory is listed every
+# poll_interval seconds instead.
+
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# How much of the end of a file to read to find the closing ';'
+NEWICK_TAIL_BYTES = 64
+
+
+def get_signature(path: Path) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+def is_complete_newick(path: Path, size: int) -> bool:
+    try:
+        with open(path, "rb") as tree_fh:
+            tree_fh.seek(max(size - NEWICK_TAIL_BYTES, 0))
+            return tree_fh.read().rstrip().endswith(b";")
+    except FileNotFoundError:
+        return False
+
+
+class TreeWatcher:
+    """
+    Hands out the Newick files of a directory as they are written, new and
+    changed ones alike, once they have been written in full.
+
+    Args:
+        tree_directory (Path): The directory to watch
+        poll_interval (float): Longest time poll waits for, and how often the
+            directory is listed without inotify
+        settle_seconds (float): How long a file has to stay the same before
+            it is considered written
+        use_inotify (bool): Use inotify when inotify_simple is installed
+    """
+
+    def __init__(
+        self,
+        tree_directory: Path,
+        poll_interval: float,
+        settle_seconds: float,
+        use_inotify: bool = True,
+    ):
+        self.tree_directory = tree_directory
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        # The signature each file had when it was handed out
+        self.handed_out = {}
+        # Files that are still being written, with their signature and when
+        # it was first seen
+        self.settling = {}
+        self.rescan = True
+        self.inotify = None
+
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(
+                str(tree_directory),
+                flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO,
+            )
+
+        logging.info(
+            f"Watching {tree_directory} "
+            f"{'with inotify' if self.inotify is not None else 'by polling it'}"
+        )
+
+    def list_trees(self) -> set:
+        with os.scandir(self.tree_directory) as entries:
+            return {
+                entry.name
+                for entry in entries
+                if entry.name.endswith(".nwk") and entry.is_file()
+            }
+
+    def wait_for_changes(self) -> set:
+        # The names of the files that may have changed
+        timeout = self.poll_interval
+
+        if self.settling:
+            timeout = min(timeout, self.settle_seconds)
+
+        if self.inotify is None:
+            time.sleep(timeout)
+            return self.list_trees()
+
+        events = self.inotify.read(timeout=int(timeout * 1000))
+
+        # The kernel dropped events, so anything may have changed
+        if any(event.mask & flags.Q_OVERFLOW for event in events):
+            return self.list_trees()
+
+        return {event.name for event in events if event.name.endswith(".nwk")} | set(
+            self.settling
+        )
+
+    def poll(self) -> list:
+        """
+        Wait for files to change, for at most poll_interval seconds.
+
+        Returns:
+            list: Paths of the files that have been written since they were
+                last handed out
+        """
+        if self.rescan:
+            self.rescan = False
+            names = self.list_trees()
+        else:
+            names = self.wait_for_changes()
+
+        now = time.monotonic()
+        ready = []
+
+        for name in sorted(names):
+            path = self.tree_directory / name
+            signature = get_signature(path)
+
+            if signature is None or self.handed_out.get(name) == signature:
+                self.settling.pop(name, None)
+                continue
+
+            settling = self.settling.get(name)
+
+            if settling is None or settling[0] != signature:
+                self.settling[name] = (signature, now)
+                continue
+
+            if now - settling[1] < self.settle_seconds or not is_complete_newick(
+                path, signature[0]
+            ):
+                continue
+
+            del self.settling[name]
+            self.handed_out[name] = signature
+            ready.append(path)
+
+        return ready
+
+    def forget(self):
+        # Hand every file out again, e.g. after the lookup table changed
+        self.handed_out.clear()
+        self.rescan = True
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()